@@ -1,8 +1,12 @@
 from .io.record import (Record, MultiRecord, rdheader, rdrecord, rdsamp,
                         wrsamp, dl_database)
-from .io.annotation import (Annotation, rdann, wrann, show_ann_labels,
-                            show_ann_classes)
-from .io.download import get_dbs, get_record_list, dl_files, set_db_index_url
+from .io.annotation import (Annotation, CompactAnnotation, AnnotationTable,
+                            AnnotationWriter, RhythmIndex, rdann, rdanns,
+                            wrann, show_ann_labels, show_ann_classes)
+from .io.download import (get_dbs, get_record_list, dl_files, set_db_index_url,
+                          set_metadata_cache, clear_metadata_cache)
+from .io.pipeline import rdrecord_remote, iter_records
+from .io import aio
 from .plot.plot import plot_items, plot_wfdb, plot_all_records
 
 from .version import __version__
@@ -1,7 +1,10 @@
 from .record import (Record, MultiRecord, rdheader, rdrecord, rdsamp, wrsamp,
                      dl_database, SIGNAL_CLASSES)
 from ._signal import est_res, wr_dat_file
-from .annotation import (Annotation, rdann, wrann, show_ann_labels,
-                         show_ann_classes)
-from .download import get_dbs, get_record_list, dl_files, set_db_index_url
-from .tff import rdtff
+from .annotation import (Annotation, CompactAnnotation, AnnotationTable,
+                         AnnotationWriter, RhythmIndex, rdann, rdanns,
+                         wrann, show_ann_labels, show_ann_classes)
+from .download import (get_dbs, get_record_list, dl_files, set_db_index_url,
+                       set_metadata_cache, clear_metadata_cache)
+from .pipeline import rdrecord_remote, iter_records
+from .tff import rdtff, tff2wfdb
@@ -894,6 +894,103 @@ def _rd_segment(file_name, dir_name, pb_dir, fmt, n_sig, sig_len, byte_offset,
     return signals
 
 
+def _dat_byte_ranges(file_name, fmt, n_sig, sig_len, byte_offset,
+                     samps_per_frame, skew, sampfrom, sampto, channels,
+                     ignore_skew):
+    """
+    Get the byte ranges of the dat file(s) that `_rd_segment` reads for
+    a single segment record, without reading them. Used to fetch the
+    content of remote files ahead of reading.
+
+    Parameters
+    ----------
+    See docstring for `_rd_segment`.
+
+    Returns
+    -------
+    byte_ranges : list
+        List of (file_name, start_byte, byte_count) tuples, one per dat
+        file containing wanted channels.
+
+    """
+    byte_offset = [b if b is not None else 0 for b in byte_offset]
+    samps_per_frame = [s if s is not None else 1 for s in samps_per_frame]
+    if ignore_skew:
+        skew = [0] * n_sig
+    else:
+        skew = [s if s is not None else 0 for s in skew]
+
+    file_name, datchannel = describe_list_indices(file_name)
+
+    byte_ranges = []
+    for fn in file_name:
+        if not [c for c in datchannel[fn] if c in channels]:
+            continue
+        first_chan = datchannel[fn][0]
+        f_fmt = fmt[first_chan]
+        start_byte, n_read_samples = _dat_read_params(
+            f_fmt, sig_len, byte_offset[first_chan],
+            [skew[c] for c in datchannel[fn]],
+            sum([samps_per_frame[c] for c in datchannel[fn]]),
+            sampfrom, sampto)[:2]
+        if f_fmt in ['212', '310', '311']:
+            byte_count = _required_byte_num('read', f_fmt, n_read_samples)
+        else:
+            byte_count = n_read_samples * BYTES_PER_SAMPLE[f_fmt]
+        byte_ranges.append((fn, start_byte, byte_count))
+
+    return byte_ranges
+
+
+def _dat_requests(header, pb_dir, sampfrom, sampto, channels, channel_names,
+                  ignore_skew):
+    """
+    Get the remote requests for the dat file content read by
+    `rdrecord` for a single segment record, used to fetch the content
+    ahead of reading. Returns an empty list when the content can't be
+    determined from the header alone, in which case it is fetched as
+    needed.
+
+    Parameters
+    ----------
+    header : Record
+        The record's header, as read by `rdheader`.
+    pb_dir : str
+        The Physiobank directory of the record.
+    * other params
+        See docstring for `rdrecord`.
+
+    Returns
+    -------
+    requests : list
+        List of ('GET', url, (start_byte, byte_count)) requests, as
+        performed by `download._request`.
+
+    """
+    if sampto is None:
+        sampto = header.sig_len
+    if channel_names is not None:
+        channels = [header.sig_name.index(name) for name in channel_names
+                    if name in header.sig_name]
+    elif channels is None:
+        channels = list(range(header.n_sig))
+
+    # Invalid inputs are reported by the reading function
+    if (sampto is None or header.sig_len is None or not 0 <= sampfrom < sampto
+            or any(c not in range(header.n_sig) for c in channels)):
+        return []
+
+    byte_ranges = _dat_byte_ranges(
+        header.file_name, header.fmt, header.n_sig, header.sig_len,
+        header.byte_offset, header.samps_per_frame, header.skew, sampfrom,
+        sampto, channels, ignore_skew)
+
+    return [('GET', download._file_url(pb_dir, file_name),
+             (start_byte, byte_count))
+            for file_name, start_byte, byte_count in byte_ranges
+            if byte_count > 0]
+
+
 def _rd_dat_signals(file_name, dir_name, pb_dir, fmt, n_sig, sig_len,
                    byte_offset, samps_per_frame, skew, sampfrom, sampto,
                    smooth_frames):
@@ -1650,17 +1747,44 @@ def wr_dat_file(file_name, fmt, d_signal, byte_offset, expanded=False,
                 d_signal[:, expand_ch] = e_d_signal[ch][framenum::spf]
                 expand_ch = expand_ch + 1
 
-    # This n_sig is used for making list items.
-    # Does not necessarily represent number of signals (ie. for expanded=True)
-    n_sig = d_signal.shape[1]
+    b_write = _dat_bytes(d_signal, fmt)
+
+    # Byte offset in the file
+    if byte_offset is not None and byte_offset>0:
+        print('Writing file '+file_name+' with '+str(byte_offset)+' empty leading bytes')
+        b_write = np.append(np.zeros(byte_offset, dtype = 'uint8'), b_write)
+
+    # Write the bytes to the file
+    with open(os.path.join(write_dir, file_name),'wb') as f:
+        b_write.tofile(f)
+
+
+def _dat_bytes(d_signal, fmt):
+    """
+    Get the bytes encoding a digital signal in a dat file format.
+
+    Parameters
+    ----------
+    d_signal : numpy array
+        The 2d digital signal, with samples in rows. Multiple frame
+        samples act as extra channels.
+    fmt : str
+        The dat file format: '80', '212', '16', '24', or '32'.
+
+    Returns
+    -------
+    b_write : numpy array
+        The bytes to write, as uint8. The samples are concatenated row
+        by row, so the bytes of consecutive signal blocks can be
+        written one after another, except for format 212 blocks with an
+        odd number of samples.
+
+    """
+    d_signal = np.asarray(d_signal, dtype='int64')
 
     if fmt == '80':
         # convert to 8 bit offset binary form
-        d_signal = d_signal + 128
-        # Concatenate into 1D
-        d_signal = d_signal.reshape(-1)
-        # Convert to un_signed 8 bit dtype to write
-        b_write = d_signal.astype('uint8')
+        b_write = (d_signal.reshape(-1) + 128).astype('uint8')
 
     elif fmt == '212':
         # Each sample is represented by a 12 bit two's complement
@@ -1672,24 +1796,17 @@ def wr_dat_file(file_name, fmt, d_signal, byte_offset, expanded=False,
         # the remaining 8 bits of the second sample). The process is
         # repeated for each successive pair of samples.
 
-        # convert to 12 bit two's complement
-        d_signal[d_signal<0] = d_signal[d_signal<0] + 4096
-
-        # Concatenate into 1D
-        d_signal = d_signal.reshape(-1)
+        # convert to 12 bit two's complement, and concatenate into 1D
+        d_signal = d_signal.reshape(-1) & 4095
 
         n_samp = len(d_signal)
-        # use this for byte processing
-        processn_samp = n_samp
-
         # Odd numbered number of samples. Fill in extra blank for
         # following byte calculation.
-        if processn_samp % 2:
-            d_signal = np.concatenate([d_signal, np.array([0])])
-            processn_samp +=1
+        if n_samp % 2:
+            d_signal = np.append(d_signal, 0)
 
         # The individual bytes to write
-        b_write = np.zeros([int(1.5*processn_samp)], dtype = 'uint8')
+        b_write = np.zeros([int(1.5 * len(d_signal))], dtype='uint8')
 
         # Fill in the byte triplets
 
@@ -1704,63 +1821,15 @@ def wr_dat_file(file_name, fmt, d_signal, byte_offset, expanded=False,
         if n_samp % 2:
             b_write = b_write[:-1]
 
-    elif fmt == '16':
-        # convert to 16 bit two's complement
-        d_signal[d_signal<0] = d_signal[d_signal<0] + 65536
-        # Split samples into separate bytes using binary masks
-        b1 = d_signal & [255]*n_sig
-        b2 = ( d_signal & [65280]*n_sig ) >> 8
-        # Interweave the bytes so that the same samples' bytes are consecutive
-        b1 = b1.reshape((-1, 1))
-        b2 = b2.reshape((-1, 1))
-        b_write = np.concatenate((b1, b2), axis=1)
-        b_write = b_write.reshape((1,-1))[0]
-        # Convert to un_signed 8 bit dtype to write
-        b_write = b_write.astype('uint8')
-    elif fmt == '24':
-        # convert to 24 bit two's complement
-        d_signal[d_signal<0] = d_signal[d_signal<0] + 16777216
-        # Split samples into separate bytes using binary masks
-        b1 = d_signal & [255]*n_sig
-        b2 = ( d_signal & [65280]*n_sig ) >> 8
-        b3 = ( d_signal & [16711680]*n_sig ) >> 16
-        # Interweave the bytes so that the same samples' bytes are consecutive
-        b1 = b1.reshape((-1, 1))
-        b2 = b2.reshape((-1, 1))
-        b3 = b3.reshape((-1, 1))
-        b_write = np.concatenate((b1, b2, b3), axis=1)
-        b_write = b_write.reshape((1,-1))[0]
-        # Convert to un_signed 8 bit dtype to write
-        b_write = b_write.astype('uint8')
-
-    elif fmt == '32':
-        # convert to 32 bit two's complement
-        d_signal[d_signal<0] = d_signal[d_signal<0] + 4294967296
-        # Split samples into separate bytes using binary masks
-        b1 = d_signal & [255]*n_sig
-        b2 = ( d_signal & [65280]*n_sig ) >> 8
-        b3 = ( d_signal & [16711680]*n_sig ) >> 16
-        b4 = ( d_signal & [4278190080]*n_sig ) >> 24
-        # Interweave the bytes so that the same samples' bytes are consecutive
-        b1 = b1.reshape((-1, 1))
-        b2 = b2.reshape((-1, 1))
-        b3 = b3.reshape((-1, 1))
-        b4 = b4.reshape((-1, 1))
-        b_write = np.concatenate((b1, b2, b3, b4), axis=1)
-        b_write = b_write.reshape((1,-1))[0]
-        # Convert to un_signed 8 bit dtype to write
-        b_write = b_write.astype('uint8')
+    elif fmt in ['16', '24', '32']:
+        # Two's complement, with the least significant bytes first
+        n_bytes = int(fmt) // 8
+        b_write = d_signal.reshape(-1).astype('<i4').view('uint8')
+        b_write = b_write.reshape((-1, 4))[:, :n_bytes].reshape(-1)
     else:
         raise ValueError('This library currently only supports writing the following formats: 80, 16, 24, 32')
 
-    # Byte offset in the file
-    if byte_offset is not None and byte_offset>0:
-        print('Writing file '+file_name+' with '+str(byte_offset)+' empty leading bytes')
-        b_write = np.append(np.zeros(byte_offset, dtype = 'uint8'), b_write)
-
-    # Write the bytes to the file
-    with open(os.path.join(write_dir, file_name),'wb') as f:
-        b_write.tofile(f)
+    return b_write
 
 
 def describe_list_indices(full_list):
@@ -0,0 +1,230 @@
+"""
+Awaitable counterparts of the WFDB reading functions, for use in
+asyncio applications.
+
+The remote content of a record is fetched concurrently without blocking
+the event loop, and the decoding is run in the loop's default executor.
+Concurrent calls reading the same remote content share the in-flight
+requests.
+
+Examples
+--------
+>>> record = await wfdb.aio.rdrecord('100', pb_dir='mitdb', sampto=3600)
+>>> ann = await wfdb.aio.rdann('100', 'atr', pb_dir='mitdb')
+
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import os
+import threading
+
+from . import _signal
+from . import annotation
+from . import download
+from . import record
+
+
+# The maximum number of concurrent remote requests
+IO_WORKERS = 16
+
+# The executor running the blocking remote requests
+_io_executor = None
+_io_executor_lock = threading.Lock()
+
+# The remote requests currently being performed, mapping each
+# (event loop, do_request, method, url, byte_range) key to its future.
+_in_flight = {}
+
+
+def _get_io_executor():
+    """
+    Get the executor running the remote requests, creating it if needed.
+    """
+    global _io_executor
+    with _io_executor_lock:
+        if _io_executor is None:
+            _io_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=IO_WORKERS, thread_name_prefix='wfdb-aio')
+    return _io_executor
+
+
+async def _fetch(method, url, byte_range=None, do_request=None):
+    """
+    Perform a remote request without blocking the event loop, sharing
+    the request with any identical one in flight.
+
+    See `download._request` for the parameters and return value.
+    `do_request` is the function performing the request: the
+    context-local fetcher if one is set, or `download._do_request`.
+
+    """
+    if do_request is None:
+        do_request = download._remote_fetcher.get() or download._do_request
+    loop = asyncio.get_running_loop()
+    key = (loop, do_request, method, url, byte_range)
+
+    future = _in_flight.get(key)
+    if future is None:
+        future = loop.run_in_executor(_get_io_executor(), do_request,
+                                      method, url, byte_range)
+        _in_flight[key] = future
+        future.add_done_callback(lambda f: _in_flight.pop(key, None))
+
+    # Shield so that cancelling one caller doesn't cancel the shared request
+    return await asyncio.shield(future)
+
+
+async def _prefetch(requests, store):
+    """
+    Fetch the (method, url, byte_range) requests concurrently, and add
+    their content to `store`. The errors of failed requests are also
+    stored, to be raised when the reading function requests the content.
+    """
+    requests = [r for r in requests if r not in store]
+    results = await asyncio.gather(*[_fetch(*r) for r in requests],
+                                   return_exceptions=True)
+    for request, result in zip(requests, results):
+        store[request] = result
+
+
+async def _run(store, func, *args, **kwargs):
+    """
+    Run a blocking reading function in the loop's default executor,
+    serving its remote requests from `store`.
+
+    Requests which were not fetched ahead are performed through the
+    event loop, blocking only the executor thread.
+
+    """
+    loop = asyncio.get_running_loop()
+    do_request = download._remote_fetcher.get() or download._do_request
+
+    def fetcher(method, url, byte_range):
+        request = (method, url, byte_range)
+        if request not in store:
+            store[request] = asyncio.run_coroutine_threadsafe(
+                _fetch(method, url, byte_range, do_request), loop).result()
+        if isinstance(store[request], BaseException):
+            raise store[request]
+        return store[request]
+
+    context = contextvars.copy_context()
+    context.run(download._remote_fetcher.set, fetcher)
+
+    return await loop.run_in_executor(
+        None, functools.partial(context.run, func, *args, **kwargs))
+
+
+async def rdheader(record_name, pb_dir=None, rd_segments=False):
+    """
+    Read a WFDB header file. Awaitable version of `wfdb.rdheader`.
+
+    See `wfdb.rdheader` for the parameters and return value.
+
+    """
+    return await _rdheader(record_name, pb_dir, rd_segments, {})
+
+
+async def _rdheader(record_name, pb_dir, rd_segments, store):
+    """
+    Read a header, keeping the fetched content in `store`.
+    """
+    if pb_dir is not None:
+        base_record_name = os.path.split(record_name)[1]
+        await _prefetch([('GET', download._file_url(
+            pb_dir, base_record_name + '.hea'), None)], store)
+
+    return await _run(store, record.rdheader, record_name, pb_dir=pb_dir,
+                      rd_segments=rd_segments)
+
+
+async def rdrecord(record_name, sampfrom=0, sampto=None, channels=None,
+                   physical=True, pb_dir=None, m2s=True, smooth_frames=True,
+                   ignore_skew=False, return_res=64, force_channels=True,
+                   channel_names=None, warn_empty=False):
+    """
+    Read a WFDB record. Awaitable version of `wfdb.rdrecord`.
+
+    See `wfdb.rdrecord` for the parameters and return value.
+
+    Notes
+    -----
+    For remote single segment records, the header is fetched first and
+    then all the required dat file byte ranges are fetched
+    concurrently. The content of multi segment records is fetched as
+    it is needed by the reading function.
+
+    """
+    store = {}
+
+    if pb_dir is not None:
+        header = await _rdheader(record_name, pb_dir, False, store)
+        if isinstance(header, record.Record) and header.n_sig:
+            await _prefetch(_signal._dat_requests(header, pb_dir, sampfrom,
+                                                  sampto, channels,
+                                                  channel_names,
+                                                  ignore_skew), store)
+
+    return await _run(store, record.rdrecord, record_name,
+                      sampfrom=sampfrom, sampto=sampto, channels=channels,
+                      physical=physical, pb_dir=pb_dir, m2s=m2s,
+                      smooth_frames=smooth_frames, ignore_skew=ignore_skew,
+                      return_res=return_res, force_channels=force_channels,
+                      channel_names=channel_names, warn_empty=warn_empty)
+
+
+async def rdsamp(record_name, sampfrom=0, sampto=None, channels=None,
+                 pb_dir=None, channel_names=None, warn_empty=False):
+    """
+    Read a WFDB record, and return the physical signals and a few
+    important descriptor fields. Awaitable version of `wfdb.rdsamp`.
+
+    See `wfdb.rdsamp` for the parameters and return value.
+
+    """
+    rec = await rdrecord(record_name=record_name, sampfrom=sampfrom,
+                         sampto=sampto, channels=channels, physical=True,
+                         pb_dir=pb_dir, m2s=True, channel_names=channel_names,
+                         warn_empty=warn_empty)
+
+    signals = rec.p_signal
+    fields = {}
+    for field in ['fs','sig_len', 'n_sig', 'base_date', 'base_time',
+                  'units','sig_name', 'comments']:
+        fields[field] = getattr(rec, field)
+
+    return signals, fields
+
+
+async def rdann(record_name, extension, sampfrom=0, sampto=None,
+                shift_samps=False, pb_dir=None,
+                return_label_elements=('symbol',), summarize_labels=False):
+    """
+    Read a WFDB annotation file. Awaitable version of `wfdb.rdann`.
+
+    See `wfdb.rdann` for the parameters and return value.
+
+    Notes
+    -----
+    For remote annotation files, the annotation file and the record
+    header, used for the sampling frequency, are fetched concurrently.
+
+    """
+    store = {}
+
+    if pb_dir is not None:
+        base_record_name = os.path.split(record_name)[1]
+        await _prefetch([
+            ('GET', download._file_url(
+                pb_dir, base_record_name + '.' + extension), None),
+            ('GET', download._file_url(
+                pb_dir, base_record_name + '.hea'), None)
+        ], store)
+
+    return await _run(store, annotation.rdann, record_name, extension,
+                      sampfrom=sampfrom, sampto=sampto,
+                      shift_samps=shift_samps, pb_dir=pb_dir,
+                      return_label_elements=return_label_elements,
+                      summarize_labels=summarize_labels)
@@ -1,8 +1,10 @@
-import copy
+import multiprocessing
 import numpy as np
 import os
 import pandas as pd
 import re
+import tempfile
+import zipfile
 
 from . import download
 from . import _header
@@ -150,7 +152,7 @@ class Annotation(object):
 
         self.ann_len = len(self.sample)
 
-    def wrann(self, write_fs=False, write_dir=''):
+    def wrann(self, write_fs=False, write_dir='', write_index=False):
         """
         Write a WFDB annotation file from this object.
 
@@ -158,7 +160,23 @@ class Annotation(object):
         ----------
         write_fs : bool, optional
             Whether to write the `fs` attribute to the file.
+        write_index : bool, optional
+            Whether to also write the checkpoint index of the file, used
+            by `rdann` with `use_index=True`.
 
+        """
+        self.prep_write_fields()
+
+        # Write the header file using the specified fields
+        self.wr_ann_file(write_fs=write_fs, write_dir=write_dir,
+                         write_index=write_index)
+
+        return
+
+    def prep_write_fields(self):
+        """
+        Check the fields of this object for writing, and set the
+        label_store field from the other label fields if necessary.
         """
         for field in ['record_name', 'extension']:
             if getattr(self, field) is None:
@@ -185,9 +203,6 @@ class Annotation(object):
             self.convert_label_attribute(source_field=present_label_fields[0],
                                          target_field='label_store')
 
-        # Write the header file using the specified fields
-        self.wr_ann_file(write_fs=write_fs, write_dir=write_dir)
-
         return
 
     def get_label_fields(self):
@@ -569,50 +584,84 @@ class Annotation(object):
         Table composed of entire WFDB standard annotation table, overwritten/appended
         with custom_labels if any. Sets __label_map__ attribute, or returns value.
         """
+        symbols, descriptions, _, _ = self.get_label_lookup()
+        label_store = np.flatnonzero(symbols != None)
 
-        label_map =  ann_label_table.copy()
-
-        if self.custom_labels is not None:
-            self.standardize_custom_labels()
-            for i in self.custom_labels.index:
-                label_map.loc[i] = self.custom_labels.loc[i]
+        label_map = pd.DataFrame({'label_store': label_store,
+                                  'symbol': symbols[label_store],
+                                  'description': descriptions[label_store]},
+                                 index=label_store)
+        label_map = label_map[list(ann_label_fields)]
 
         if inplace:
             self.__label_map__ = label_map
         else:
             return label_map
 
+    def get_label_lookup(self):
+        """
+        Get the lookup arrays and tables of the labels used in this
+        annotation: the WFDB standard annotation labels, overwritten/
+        appended with custom_labels if any.
 
-    def wr_ann_file(self, write_fs, write_dir=''):
+        See `label_store_lookup` for the returned values.
+        """
+        if self.custom_labels is not None:
+            self.standardize_custom_labels()
+
+        return label_store_lookup(self.custom_labels)
+
+
+    def wr_ann_file(self, write_fs, write_dir='', write_index=False):
         """
         Calculate the bytes used to encode an annotation set and
         write them to an annotation file
         """
 
-        # Calculate the fs bytes to write if present and desired to write
+        # Calculate the bytes of the special annotations at the start
+        head_bytes = self.calc_head_bytes(write_fs)
+        # Calculate the core field bytes to write
+        core_bytes = self.calc_core_bytes()
+
+        # Combine all bytes to write: fs and custom annotations (if any), main content, file terminator
+        filebytes = np.concatenate((head_bytes, core_bytes,
+                                    np.array([0,0]))).astype('u1')
+
+        # Write the file
+        with open(os.path.join(write_dir, self.record_name+'.'+self.extension),
+                  'wb') as f:
+            filebytes.tofile(f)
+
+        # An existing index no longer matches the file
+        if write_index:
+            wr_ann_index(self.record_name, self.extension,
+                         filebytes.reshape([-1, 2]), write_dir=write_dir)
+        else:
+            rm_ann_index(self.record_name, self.extension,
+                         write_dir=write_dir)
+
+        return
+
+    def calc_head_bytes(self, write_fs):
+        """
+        Calculate the bytes of the special annotations written at the
+        start of the annotation file: the fs field if present and
+        desired to write, and the custom_labels field if present.
+        """
         if write_fs:
             fs_bytes = self.calc_fs_bytes()
         else:
             fs_bytes = []
-        # Calculate the custom_labels bytes to write if present
         cl_bytes = self.calc_cl_bytes()
-        # Calculate the core field bytes to write
-        core_bytes = self.calc_core_bytes()
 
         # Mark the end of the special annotation types if needed
-        if fs_bytes == [] and cl_bytes == []:
+        if len(fs_bytes) == 0 and len(cl_bytes) == 0:
             end_special_bytes = []
         else:
             end_special_bytes = [0, 236, 255, 255, 255, 255, 1, 0]
 
-        # Write the file
-        with open(os.path.join(write_dir, self.record_name+'.'+self.extension),
-                  'wb') as f:
-            # Combine all bytes to write: fs (if any), custom annotations (if any), main content, file terminator
-            np.concatenate((fs_bytes, cl_bytes, end_special_bytes, core_bytes,
-                            np.array([0,0]))).astype('u1').tofile(f)
-
-        return
+        return np.concatenate((fs_bytes, cl_bytes,
+                               end_special_bytes)).astype('u1')
 
     # Calculate the bytes written to the annotation file for the fs field
     def calc_fs_bytes(self):
@@ -677,43 +726,8 @@ class Annotation(object):
         """
         Convert all used annotation fields into bytes to write
         """
-        # The difference sample to write
-        if len(self.sample) == 1:
-            sampdiff = np.array([self.sample[0]])
-        else:
-            sampdiff = np.concatenate(([self.sample[0]], np.diff(self.sample)))
-
-        # Create a copy of the annotation object with a
-        # compact version of fields to write
-        compact_annotation = copy.deepcopy(self)
-        compact_annotation.compact_fields()
-
-
-        # The optional fields to be written. Write if they are not None or all empty
-        extra_write_fields = []
-
-        for field in ['num', 'subtype', 'chan', 'aux_note']:
-            if not isblank(getattr(compact_annotation, field)):
-                extra_write_fields.append(field)
-
-        data_bytes = []
-
-        # Iterate across all fields one index at a time
-        for i in range(len(sampdiff)):
-
-            # Process the samp (difference) and sym items
-            data_bytes.append(field2bytes('samptype', [sampdiff[i], self.symbol[i]]))
-
-            # Process the extra optional fields
-            for field in extra_write_fields:
-                value = getattr(compact_annotation, field)[i]
-                if value is not None:
-                    data_bytes.append(field2bytes(field, value))
-
-        # Flatten and convert to correct format
-        data_bytes = np.array([item for sublist in data_bytes for item in sublist]).astype('u1')
-
-        return data_bytes
+        return ann_core_bytes(self.sample, self.label_store, self.subtype,
+                              self.chan, self.num, self.aux_note)
 
     # Compact all of the object's fields so that the output
     # writing annotation file writes as few bytes as possible
@@ -801,48 +815,23 @@ class Annotation(object):
         if self.custom_labels is not None:
             self.check_field('custom_labels')
 
-        # Create the label map
-        label_map = ann_label_table.copy()
-
-        # Convert the tuple triplets into a pandas dataframe if needed
-        if isinstance(self.custom_labels, (list, tuple)):
-            custom_labels = label_triplets_to_df(self.custom_labels)
-        elif isinstance(self.custom_labels, pd.DataFrame):
-            # Set the index just in case it doesn't already match the label_store
-            self.custom_labels.set_index(
-                self.custom_labels['label_store'].values, inplace=True)
-            custom_labels = self.custom_labels
-        else:
-            custom_labels = None
-
-        # Merge the standard wfdb labels with the custom labels.
-        # custom labels values overwrite standard wfdb if overlap.
-        if custom_labels is not None:
-            for i in custom_labels.index:
-                label_map.loc[i] = custom_labels.loc[i]
-            # This doesn't work...
-            # label_map.loc[custom_labels.index] = custom_labels.loc[custom_labels.index]
-
         # Get the labels using one of the features
         if self.label_store is not None:
-            index_vals = set(self.label_store)
-            reset_index = False
+            label_store = np.asarray(self.label_store, dtype='int64')
         elif self.symbol is not None:
-            index_vals = set(self.symbol)
-            label_map.set_index(label_map['symbol'].values, inplace=True)
-            reset_index = True
+            label_store = self.convert_label_attribute('symbol', 'label_store',
+                                                       inplace=False)
         elif self.description is not None:
-            index_vals = set(self.description)
-            label_map.set_index(label_map['description'].values, inplace=True)
-            reset_index = True
+            label_store = self.convert_label_attribute('description',
+                                                       'label_store',
+                                                       inplace=False)
         else:
             raise Exception('No annotation labels contained in object')
 
-        contained_labels = label_map.loc[index_vals, :]
-
-        if reset_index:
-            contained_labels.set_index(contained_labels['label_store'].values,
-                                       inplace=True)
+        symbols, descriptions, _, _ = self.get_label_lookup()
+        check_label_stores(label_store, symbols)
+        contained_labels = contained_label_table(label_store, symbols,
+                                                 descriptions)
 
         if inplace:
             self.contained_labels = contained_labels
@@ -893,26 +882,1002 @@ class Annotation(object):
           target attribute already has a value. If False, does not perform conversion in the aforementioned case.
           Set to True (do conversion) if inplace=False.
 
-        Creates mapping df on the fly based on ann_label_table and self.custom_labels
+        Uses the label lookup arrays of ann_label_table and self.custom_labels
         """
         if inplace and not overwrite:
             if getattr(self, target_field) is not None:
                 return
 
-        label_map = self.create_label_map(inplace=False)
-        label_map.set_index(label_map[source_field].values, inplace=True)
+        symbols, descriptions, symbol_stores, description_stores = self.get_label_lookup()
+        source_item = getattr(self, source_field)
 
-        target_item = label_map.loc[getattr(self, source_field), target_field].values
+        # Map the source values onto label_store values
+        if source_field == 'label_store':
+            label_store = np.asarray(source_item, dtype='int64')
+        else:
+            store_table = symbol_stores if source_field == 'symbol' else description_stores
+            label_store = np.fromiter(map(store_table.__getitem__, source_item),
+                                      dtype='int64', count=len(source_item))
 
-        if target_field != 'label_store':
-            # Should already be int64 dtype if target is label_store
-            target_item = list(target_item)
+        if target_field == 'label_store':
+            target_item = label_store
+        else:
+            check_label_stores(label_store, symbols)
+            lookup = symbols if target_field == 'symbol' else descriptions
+            target_item = list(np.take(lookup, label_store))
 
         if inplace:
             setattr(self, target_field, target_item)
         else:
             return target_item
 
+    def get_rhythm_episodes(self, sig_len=None):
+        """
+        Get the rhythm episodes of this annotation, delimited by its
+        rhythm change annotations: the '+' labels whose aux_note holds
+        the new rhythm, eg. '(AFIB'.
+
+        Parameters
+        ----------
+        sig_len : int, optional
+            The signal length of the record, at which the last episode
+            ends. Leave as None to end it after the last annotation.
+
+        Returns
+        -------
+        start : numpy array
+            The first sample of each episode.
+        end : numpy array
+            The sample following the last sample of each episode.
+        rhythm : numpy array
+            The rhythm of each episode, eg. '(AFIB'.
+
+        """
+        if self.label_store is not None:
+            label_store = self.label_store
+        else:
+            source_field = [f for f in ann_label_fields
+                            if getattr(self, f) is not None][0]
+            label_store = self.convert_label_attribute(source_field,
+                                                       'label_store',
+                                                       inplace=False)
+
+        return rhythm_episodes(self.sample, label_store, self.aux_note,
+                               sig_len)
+
+    def to_compact(self):
+        """
+        Get a CompactAnnotation holding the fields of this annotation
+        in a compact form.
+
+        Returns
+        -------
+        compact_annotation : CompactAnnotation
+            The compact representation of this annotation.
+
+        """
+        if self.label_store is not None:
+            label_store = self.label_store
+        else:
+            source_field = [f for f in ann_label_fields
+                            if getattr(self, f) is not None][0]
+            label_store = self.convert_label_attribute(source_field,
+                                                       'label_store',
+                                                       inplace=False)
+        n_ann = len(self.sample)
+
+        if self.custom_labels is not None:
+            self.standardize_custom_labels()
+
+        if self.aux_note is not None:
+            aux_inds = [i for i in range(n_ann) if self.aux_note[i]]
+            aux_strings = [self.aux_note[i] for i in aux_inds]
+        else:
+            aux_inds, aux_strings = [], []
+
+        return CompactAnnotation(
+            record_name=self.record_name, extension=self.extension,
+            sample=self.sample, label_store=label_store,
+            subtype=self.subtype, chan=self.chan, num=self.num,
+            aux_inds=aux_inds, aux_strings=aux_strings, fs=self.fs,
+            custom_labels=self.custom_labels,
+            contained_labels=self.contained_labels)
+
+
+class CompactAnnotation(object):
+    """
+    A compact representation of WFDB annotations, for keeping many
+    annotations in memory.
+
+    The labels are stored as a uint8 array of `label_store` values, and
+    their symbols and descriptions are looked up in a table shared by
+    all annotations with the same label definitions, only when they are
+    accessed. The `subtype`, `chan` and `num` fields use the int8/uint8
+    types they are stored as in annotation files, and the aux_note
+    strings are stored only for the annotations which have one.
+
+    CompactAnnotation objects are returned by `rdann` with
+    `compact=True`, or created with `Annotation.to_compact`.
+
+    Examples
+    --------
+    >>> ann = wfdb.rdann('sample-data/100', 'atr', compact=True)
+    >>> ann.symbol[:5]
+    ['+', 'N', 'N', 'N', 'N']
+
+    """
+
+    def __init__(self, record_name, extension, sample, label_store,
+                 subtype=None, chan=None, num=None, aux_inds=None,
+                 aux_strings=None, fs=None, custom_labels=None,
+                 contained_labels=None):
+        """
+        Parameters
+        ----------
+        record_name : str
+            The base file name (without extension) of the record that the
+            annotation is associated with.
+        extension : str
+            The file extension of the file the annotation is stored in.
+        sample : numpy array
+            The annotation locations in samples relative to the
+            beginning of the record.
+        label_store : numpy array
+            The integer value used to store/encode each annotation label.
+        subtype, chan, num : numpy array, optional
+            The subtype, chan and num fields of each annotation. Default
+            to 0.
+        aux_inds : numpy array, optional
+            The indices of the annotations with an aux_note.
+        aux_strings : list, optional
+            The aux_note strings of the annotations at `aux_inds`.
+        fs : int, or float, optional
+            The sampling frequency of the record.
+        custom_labels : pandas dataframe, optional
+            The custom annotation labels defined in the annotation file.
+            See `Annotation`.
+        contained_labels : pandas dataframe, optional
+            The unique labels contained in this annotation. See
+            `Annotation`.
+
+        """
+        n_ann = len(sample)
+
+        self.record_name = record_name
+        self.extension = extension
+        self.sample = np.asarray(sample, dtype='int64')
+        self.label_store = np.asarray(label_store, dtype='uint8')
+        self.subtype = self._compact_field(subtype, 'int8', n_ann)
+        self.chan = self._compact_field(chan, 'uint8', n_ann)
+        self.num = self._compact_field(num, 'int8', n_ann)
+        self.aux_inds = np.asarray(aux_inds if aux_inds is not None else [],
+                                   dtype='int64')
+        self.aux_strings = list(aux_strings or [])
+        self.fs = fs
+        self.custom_labels = custom_labels
+        self.contained_labels = contained_labels
+
+        self.ann_len = n_ann
+
+        # The label lookup of the custom labels it was computed for
+        self._lookup = (None, None)
+
+    @staticmethod
+    def _compact_field(values, dtype, n_ann):
+        if values is None:
+            return np.zeros(n_ann, dtype=dtype)
+        return np.asarray(values).astype(dtype)
+
+    def __len__(self):
+        return self.ann_len
+
+    def _label_lookup(self):
+        """
+        Get the arrays mapping each label_store value to its symbol and
+        description. Computed once for the object's custom labels.
+        """
+        custom_labels, lookup = self._lookup
+        if lookup is None or custom_labels is not self.custom_labels:
+            lookup = label_store_lookup(self.custom_labels)
+            self._lookup = (self.custom_labels, lookup)
+        return lookup
+
+    @property
+    def symbol(self):
+        """
+        The symbol of each annotation label, as a list.
+        """
+        return list(self._label_lookup()[0][self.label_store])
+
+    @property
+    def description(self):
+        """
+        The description of each annotation label, as a list.
+        """
+        return list(self._label_lookup()[1][self.label_store])
+
+    @property
+    def aux_note(self):
+        """
+        The aux_note string of each annotation, as a list, with empty
+        strings for annotations without one.
+        """
+        aux_note = [''] * self.ann_len
+        for i, aux in zip(self.aux_inds, self.aux_strings):
+            aux_note[i] = aux
+        return aux_note
+
+    def apply_range(self, sampfrom=0, sampto=None):
+        """
+        Filter the annotation attributes to keep only items between the
+        desired sample values
+        """
+        sampto = sampto or self.sample[-1]
+
+        kept = (self.sample >= sampfrom) & (self.sample <= sampto)
+        kept_inds = np.where(kept)[0]
+
+        for field in ['sample', 'label_store', 'subtype', 'chan', 'num']:
+            setattr(self, field, getattr(self, field)[kept])
+
+        aux_kept = kept[self.aux_inds]
+        self.aux_strings = [a for a, k in zip(self.aux_strings, aux_kept) if k]
+        self.aux_inds = np.searchsorted(kept_inds, self.aux_inds[aux_kept])
+
+        self.ann_len = len(self.sample)
+
+    def get_contained_labels(self, inplace=True):
+        """
+        Get the set of unique labels contained in this annotation, with
+        their number of occurrences. Returns a pandas dataframe or sets
+        the contained_labels attribute of the object.
+        """
+        symbols, descriptions = self._label_lookup()[:2]
+        contained_labels = contained_label_table(
+            self.label_store.astype('int64'), symbols, descriptions)
+
+        if inplace:
+            self.contained_labels = contained_labels
+            return
+        else:
+            return contained_labels
+
+    def to_annotation(self, return_label_elements=('symbol',)):
+        """
+        Get an Annotation object holding the fields of this annotation.
+
+        Parameters
+        ----------
+        return_label_elements : list, or tuple, optional
+            The label elements to set in the returned object. At least
+            one of: 'symbol', 'label_store', 'description'.
+
+        Returns
+        -------
+        annotation : Annotation
+            The annotation, with the same fields that `rdann` returns.
+
+        """
+        annotation = Annotation(
+            record_name=self.record_name, extension=self.extension,
+            sample=self.sample.astype('int'),
+            label_store=self.label_store.astype('int'),
+            subtype=self.subtype.astype('int'), chan=self.chan.astype('int'),
+            num=self.num.astype('int'), aux_note=self.aux_note, fs=self.fs,
+            custom_labels=self.custom_labels,
+            contained_labels=self.contained_labels)
+        annotation.set_label_elements(list(return_label_elements))
+
+        return annotation
+
+
+class AnnotationTable(object):
+    """
+    The annotations of multiple records, held as one table of columns.
+
+    Each column is a numpy array with one item per annotation, for the
+    annotations of all records concatenated in order. The labels are
+    stored as their `label_store` values, and the aux_note strings are
+    referenced by index.
+
+    AnnotationTable objects are returned by `rdanns`.
+
+    Attributes
+    ----------
+    record_names : list
+        The names of the records whose annotations are in the table.
+    extension : str
+        The file extension of the annotation files.
+    record : numpy array
+        The index in `record_names` of the record of each annotation.
+    sample : numpy array
+        The annotation locations in samples relative to the beginning
+        of each record.
+    label_store : numpy array
+        The integer value used to store/encode each annotation label.
+    subtype, chan, num : numpy array
+        The subtype, chan and num fields of each annotation.
+    aux_index : numpy array
+        The index in `aux_strings` of the aux_note of each annotation,
+        or -1 for annotations without one.
+    aux_strings : list
+        The aux_note strings of the annotations.
+    fs : list
+        The sampling frequency of each record, or None if unknown.
+    custom_labels : list
+        The custom labels of each record, as pandas dataframes, or None
+        for records using only the standard labels.
+
+    Examples
+    --------
+    >>> table = wfdb.rdanns(['100', '101'], 'atr', pb_dir='mitdb')
+    >>> df = table.to_pandas()
+
+    """
+
+    # The columns of the table and their dtypes
+    columns = [('record', 'int32'), ('sample', 'int64'),
+               ('label_store', 'uint8'), ('subtype', 'int8'),
+               ('chan', 'uint8'), ('num', 'int8'), ('aux_index', 'int32')]
+
+    def __init__(self, record_names, extension, record, sample, label_store,
+                 subtype, chan, num, aux_index, aux_strings, fs=None,
+                 custom_labels=None):
+        self.record_names = list(record_names)
+        self.extension = extension
+        for (name, dtype), values in zip(self.columns,
+                                         [record, sample, label_store, subtype,
+                                          chan, num, aux_index]):
+            setattr(self, name, np.asarray(values, dtype=dtype))
+        self.aux_strings = list(aux_strings)
+        n_records = len(self.record_names)
+        self.fs = list(fs) if fs is not None else [None] * n_records
+        self.custom_labels = (list(custom_labels) if custom_labels is not None
+                              else [None] * n_records)
+
+        # The symbol lookup of each record's custom labels, mapping the
+        # id of the custom labels to them and their lookup.
+        self._symbol_lookups = {}
+
+    def __len__(self):
+        return len(self.sample)
+
+    def _symbol_lookup(self, custom_labels):
+        """
+        Get the array mapping each label_store value to its symbol, for
+        a record's custom labels. Computed once for each custom labels.
+        """
+        cached = self._symbol_lookups.get(id(custom_labels))
+        if cached is None or cached[0] is not custom_labels:
+            cached = (custom_labels, label_store_lookup(custom_labels)[0])
+            self._symbol_lookups[id(custom_labels)] = cached
+        return cached[1]
+
+    @property
+    def symbol(self):
+        """
+        The symbol of each annotation label, as an object array.
+        """
+        symbol = np.take(label_store_lookup()[0], self.label_store)
+
+        for i, custom_labels in enumerate(self.custom_labels):
+            if custom_labels is not None:
+                inds = np.flatnonzero(self.record == i)
+                symbol[inds] = np.take(self._symbol_lookup(custom_labels),
+                                       self.label_store[inds])
+        return symbol
+
+    @property
+    def aux_note(self):
+        """
+        The aux_note string of each annotation, as a list, with empty
+        strings for annotations without one.
+        """
+        aux_strings = self.aux_strings + ['']
+        return [aux_strings[i] for i in self.aux_index]
+
+    def to_structured(self):
+        """
+        Get the table as a numpy structured array, with one field per
+        column.
+        """
+        table = np.empty(len(self), dtype=self.columns)
+        for name, _ in self.columns:
+            table[name] = getattr(self, name)
+        return table
+
+    def to_pandas(self):
+        """
+        Get the table as a pandas dataframe, with one column per table
+        column. The record column is categorical, with the record names
+        as categories.
+
+        The numeric columns are not copied where pandas allows it.
+        """
+        data = {name: getattr(self, name) for name, _ in self.columns}
+        data['record'] = pd.Categorical.from_codes(self.record,
+                                                   self.record_names)
+        return pd.DataFrame(data, columns=[name for name, _ in self.columns],
+                            copy=False)
+
+
+class AnnotationWriter(object):
+    """
+    A writer of WFDB annotation files, to which annotations are written
+    in batches as they are produced, without holding them all in
+    memory.
+
+    The file written is identical to the one written by a single
+    `wrann` call with all of the annotations. The annotations are
+    buffered and written to the file every `flush_interval`
+    annotations, and the file is completed when the writer is closed.
+
+    Examples
+    --------
+    >>> with wfdb.AnnotationWriter('100', 'qrs', fs=360) as writer:
+            for qrs_inds in detector:
+                writer.write(qrs_inds, symbol=['N'] * len(qrs_inds))
+
+    """
+
+    def __init__(self, record_name, extension, fs=None, custom_labels=None,
+                 write_dir='', write_index=False, flush_interval=4096):
+        """
+        Parameters
+        ----------
+        record_name : str
+            The string name of the WFDB record to be written (without
+            any file extensions).
+        extension : str
+            The string annotation file extension.
+        fs : int, or float, optional
+            The numerical sampling frequency of the record to be written
+            to the file.
+        custom_labels : pandas dataframe, or list, optional
+            The map of custom defined annotation labels used for the
+            annotations. See `wrann`.
+        write_dir : str, optional
+            The directory in which to write the annotation file.
+        write_index : bool, optional
+            Whether to also write the checkpoint index of the annotation
+            file when the writer is closed. See `wrann`.
+        flush_interval : int, optional
+            The number of annotations buffered before they are written
+            to the file.
+
+        """
+        # Check and encode the fields written at the start of the file
+        head = Annotation(record_name=record_name, extension=extension,
+                          sample=np.empty(0, dtype='int64'), fs=fs,
+                          custom_labels=custom_labels)
+        for field in ['record_name', 'extension']:
+            if getattr(head, field) is None:
+                raise Exception('Missing required field for writing annotation file: ',field)
+        for field in ['record_name', 'extension', 'fs', 'custom_labels']:
+            if getattr(head, field) is not None:
+                head.check_field(field)
+        head.standardize_custom_labels()
+        head_bytes = head.calc_head_bytes(write_fs=True)
+
+        self.record_name = record_name
+        self.extension = extension
+        self.custom_labels = head.custom_labels
+        self.write_dir = write_dir
+        self.write_index = write_index
+        self.flush_interval = flush_interval
+
+        # The fields of the last annotation written
+        self.prev_sample = 0
+        self.prev_chan = 0
+        self.prev_num = 0
+
+        self._buffer = [head_bytes]
+        self._n_buffered = 0
+        self._file = open(os.path.join(write_dir, record_name + '.'
+                                       + extension), 'wb')
+        # An existing index no longer matches the file
+        rm_ann_index(record_name, extension, write_dir=write_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, sample, symbol=None, subtype=None, chan=None, num=None,
+              aux_note=None, label_store=None):
+        """
+        Write a batch of annotations following the ones already
+        written.
+
+        Parameters
+        ----------
+        sample : numpy array
+            The annotation locations in samples relative to the beginning
+            of the record. Must not precede the last annotation written.
+        symbol, subtype, chan, num, aux_note, label_store : optional
+            The other fields of the annotations. See `wrann`. Fields
+            which are not set are not written, and keep the values of
+            the previous annotations when the file is read.
+
+        """
+        if self._file is None:
+            raise ValueError('Cannot write to a closed annotation writer')
+
+        sample = np.asarray(sample)
+        if len(sample) == 0:
+            return
+        if sample[0] < self.prev_sample:
+            raise ValueError("The 'sample' field must contain monotonically increasing sample numbers")
+
+        annotation = Annotation(record_name=self.record_name,
+                                extension=self.extension, sample=sample,
+                                symbol=symbol, subtype=subtype, chan=chan,
+                                num=num, aux_note=aux_note,
+                                label_store=label_store,
+                                custom_labels=self.custom_labels)
+
+        # Find out which input field describes the labels
+        if symbol is None:
+            if label_store is None:
+                raise Exception("Either the 'symbol' field or the 'label_store' field must be set")
+        else:
+            if label_store is None:
+                annotation.sym_to_aux()
+            else:
+                raise Exception("Only one of the 'symbol' and 'label_store' fields may be input, for describing annotation labels")
+
+        annotation.prep_write_fields()
+
+        self._buffer.append(ann_core_bytes(
+            annotation.sample, annotation.label_store, annotation.subtype,
+            annotation.chan, annotation.num, annotation.aux_note,
+            prev_sample=self.prev_sample, prev_chan=self.prev_chan,
+            prev_num=self.prev_num))
+        self._n_buffered += len(sample)
+
+        self.prev_sample = int(sample[-1])
+        if chan is not None:
+            self.prev_chan = int(annotation.chan[-1])
+        if num is not None:
+            self.prev_num = int(annotation.num[-1])
+
+        if self._n_buffered >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered annotations to the file.
+        """
+        if self._buffer:
+            self._file.write(np.concatenate(self._buffer).tobytes())
+            self._file.flush()
+        self._buffer = []
+        self._n_buffered = 0
+
+    def close(self):
+        """
+        Write the remaining annotations and the file terminator, and
+        close the file.
+        """
+        if self._file is None:
+            return
+
+        self._buffer.append(np.array([0, 0], dtype='u1'))
+        self.flush()
+        self._file.close()
+        self._file = None
+
+        if self.write_index:
+            file_name = os.path.join(self.write_dir, self.record_name + '.'
+                                     + self.extension)
+            wr_ann_index(self.record_name, self.extension,
+                         np.fromfile(file_name, '<u1').reshape([-1, 2]),
+                         write_dir=self.write_dir)
+
+
+class RhythmIndex(object):
+    """
+    An index of the rhythm episodes and annotations of multiple
+    records, for querying the rhythm at given samples and the
+    annotations within rhythms.
+
+    Attributes
+    ----------
+    record_names : list
+        The names of the indexed records.
+    rhythms : numpy array
+        The distinct rhythms of the episodes, eg. '(AFIB'. The rhythm of
+        each episode is stored as its index in this array.
+    record, start, end, rhythm : numpy array
+        The record index, first sample, following sample and rhythm
+        index of each episode, sorted by record and start.
+    ann_record, ann_sample, ann_label_store, ann_rhythm : numpy array
+        The record index, sample, label_store value and rhythm index (-1
+        if outside any episode) of each annotation.
+
+    Examples
+    --------
+    >>> table = wfdb.rdanns(wfdb.get_record_list('mitdb'), 'atr',
+                            pb_dir='mitdb')
+    >>> rhythm_index = wfdb.RhythmIndex(table)
+    >>> rhythm_index.rhythm_at('100', [1000, 50000])
+    >>> record, sample = rhythm_index.annotations_in_rhythm('V', '(AFIB')
+
+    """
+
+    # Samples of different records are kept apart by offsetting them
+    # by their record index times this stride.
+    record_stride = 2 ** 40
+
+    def __init__(self, annotations, sig_lens=None):
+        """
+        Parameters
+        ----------
+        annotations : list, or AnnotationTable
+            The annotations of each record, as Annotation or
+            CompactAnnotation objects, or as an AnnotationTable returned
+            by `rdanns`.
+        sig_lens : list, optional
+            The signal length of each record, at which its last episode
+            ends. Leave as None to end the last episodes after the last
+            annotations.
+
+        """
+        if isinstance(annotations, AnnotationTable):
+            record_names = annotations.record_names
+            ann_record = annotations.record.astype('int64')
+            sample = annotations.sample
+            label_store = annotations.label_store
+            aux_note = np.append(np.array(annotations.aux_strings,
+                                          dtype='object'),
+                                 '')[annotations.aux_index]
+        else:
+            record_names = [ann.record_name for ann in annotations]
+            n_anns = [len(ann.sample) for ann in annotations]
+            ann_record = np.repeat(np.arange(len(annotations)), n_anns)
+            sample = np.concatenate([ann.sample for ann in annotations]
+                                    + [np.empty(0, dtype='int64')])
+            label_store = np.concatenate(
+                [ann.label_store if ann.label_store is not None
+                 else ann.convert_label_attribute('symbol', 'label_store',
+                                                  inplace=False)
+                 for ann in annotations] + [np.empty(0, dtype='int64')])
+            aux_note = []
+            for ann, n_ann in zip(annotations, n_anns):
+                aux_note.extend(ann.aux_note if ann.aux_note is not None
+                                else [''] * n_ann)
+
+        n_records = len(record_names)
+        if sig_lens is None:
+            sig_lens = [None] * n_records
+        ann_bounds = np.searchsorted(ann_record, np.arange(n_records + 1))
+
+        # Extract the episodes of each record
+        episodes = [rhythm_episodes(sample[a:b], label_store[a:b],
+                                    aux_note[a:b], sig_len)
+                    for a, b, sig_len in zip(ann_bounds[:-1],
+                                             ann_bounds[1:], sig_lens)]
+
+        self.record_names = list(record_names)
+        self.record = np.repeat(np.arange(n_records),
+                                [len(e[0]) for e in episodes])
+        self.start = np.concatenate([e[0] for e in episodes]
+                                    + [np.empty(0, dtype='int64')])
+        self.end = np.concatenate([e[1] for e in episodes]
+                                  + [np.empty(0, dtype='int64')])
+        self.rhythms, self.rhythm = np.unique(
+            np.concatenate([e[2] for e in episodes]
+                           + [np.empty(0, dtype='U1')]),
+            return_inverse=True)
+
+        self.ann_record = np.asarray(ann_record, dtype='int64')
+        self.ann_sample = np.asarray(sample, dtype='int64')
+        self.ann_label_store = np.asarray(label_store, dtype='int64')
+        self.ann_rhythm = self._episode_rhythm(
+            self.episode_at(self.ann_record, self.ann_sample))
+
+    def _episode_rhythm(self, episode):
+        """
+        Get the rhythm index of each episode, or -1 for episode -1.
+        """
+        return np.append(self.rhythm, -1)[episode]
+
+    def record_index(self, record):
+        """
+        Get the index of a record given its name or index.
+        """
+        if isinstance(record, str_types):
+            return self.record_names.index(record)
+        return record
+
+    def rhythm_code(self, rhythm):
+        """
+        Get the index of a rhythm in `rhythms`, or -1 if no episode has
+        the rhythm.
+        """
+        code = np.flatnonzero(self.rhythms == rhythm)
+        return code[0] if len(code) else -1
+
+    def episode_at(self, record, sample):
+        """
+        Get the index of the episode containing each sample of the
+        given records, or -1 for samples outside any episode.
+
+        Parameters
+        ----------
+        record : int, or numpy array
+            The record index of each sample.
+        sample : int, or numpy array
+            The samples.
+
+        Returns
+        -------
+        episode : numpy array
+            The episode index of each sample.
+
+        """
+        record, sample = np.broadcast_arrays(np.asarray(record, dtype='int64'),
+                                             np.asarray(sample, dtype='int64'))
+        if not len(self.start):
+            return np.full(record.shape, -1, dtype='int64')
+
+        episode = np.searchsorted(self.record * self.record_stride
+                                  + self.start,
+                                  record * self.record_stride + sample,
+                                  side='right') - 1
+        inds = np.maximum(episode, 0)
+        found = ((episode >= 0) & (self.record[inds] == record)
+                 & (sample < self.end[inds]))
+
+        return np.where(found, episode, -1)
+
+    def rhythm_at(self, record, sample):
+        """
+        Get the rhythm at each sample of a record.
+
+        Parameters
+        ----------
+        record : str, or int
+            The name or index of the record.
+        sample : int, or numpy array
+            The samples.
+
+        Returns
+        -------
+        rhythm : numpy array
+            The rhythm at each sample, eg. '(AFIB', or '' for samples
+            outside any episode.
+
+        """
+        episode = self.episode_at(self.record_index(record), sample)
+        rhythms = np.append(self.rhythms, '')
+        return rhythms[self._episode_rhythm(episode)]
+
+    def annotations_in_rhythm(self, symbol, rhythm):
+        """
+        Get the annotations with a given label symbol within the
+        episodes of a given rhythm, in all records.
+
+        Parameters
+        ----------
+        symbol : str
+            The standard WFDB symbol of the annotations, eg. 'V'.
+        rhythm : str
+            The rhythm, eg. '(AFIB'.
+
+        Returns
+        -------
+        record : numpy array
+            The record index of each annotation.
+        sample : numpy array
+            The sample of each annotation.
+
+        """
+        code = self.rhythm_code(rhythm)
+        found = ((self.ann_label_store == label_store_lookup()[2][symbol])
+                 & (self.ann_rhythm == code) & (code >= 0))
+
+        return self.ann_record[found], self.ann_sample[found]
+
+    def rhythm_durations(self, rhythm):
+        """
+        Get the total duration of the episodes of a given rhythm in
+        each record, in samples.
+
+        Parameters
+        ----------
+        rhythm : str
+            The rhythm, eg. '(AFIB'.
+
+        Returns
+        -------
+        durations : numpy array
+            The duration of the rhythm in each record.
+
+        """
+        in_rhythm = self.rhythm == self.rhythm_code(rhythm)
+        return np.bincount(self.record[in_rhythm],
+                           weights=(self.end - self.start)[in_rhythm],
+                           minlength=len(self.record_names)).astype('int64')
+
+
+# The shared label lookup arrays of standard annotation labels
+_standard_label_lookup = None
+
+
+def label_store_lookup(custom_labels=None):
+    """
+    Get the arrays mapping each label_store value to its symbol and
+    description, and the tables mapping each symbol and description to
+    its label_store value, for the standard labels overwritten/appended
+    with `custom_labels`.
+
+    Parameters
+    ----------
+    custom_labels : pandas dataframe, optional
+        The custom label definitions, in the standardized format with
+        the columns ['label_store', 'symbol', 'description'].
+
+    Returns
+    -------
+    symbols : numpy array
+        Object array of the symbol of each label_store value, with None
+        for undefined values.
+    descriptions : numpy array
+        Object array of the description of each label_store value.
+    symbol_stores : dict
+        The label_store value of each defined symbol.
+    description_stores : dict
+        The label_store value of each defined description.
+
+    Notes
+    -----
+    The lookup of the standard labels is computed once and shared, so
+    the returned values should not be modified.
+
+    """
+    global _standard_label_lookup
+
+    if custom_labels is None and _standard_label_lookup is not None:
+        return _standard_label_lookup
+
+    symbols = np.full(64, None, dtype='object')
+    descriptions = np.full(64, None, dtype='object')
+    for table in [ann_label_table, custom_labels]:
+        if table is None:
+            continue
+        label_store = table['label_store'].values.astype('int')
+        symbols[label_store] = table['symbol'].values
+        descriptions[label_store] = table['description'].values
+
+    # When a symbol/description is defined more than once, the custom
+    # label definition takes precedence over the standard one.
+    defined_stores = np.flatnonzero(symbols != None)
+    if custom_labels is not None:
+        custom_stores = custom_labels['label_store'].values.astype('int')
+        defined_stores = np.concatenate(
+            [np.setdiff1d(defined_stores, custom_stores), custom_stores])
+    symbol_stores = {symbols[i]: int(i) for i in defined_stores}
+    description_stores = {descriptions[i]: int(i) for i in defined_stores}
+
+    lookup = (symbols, descriptions, symbol_stores, description_stores)
+
+    if custom_labels is None:
+        _standard_label_lookup = lookup
+
+    return lookup
+
+
+def check_label_stores(label_store, symbols):
+    """
+    Ensure that all label_store values are defined in the label lookup
+    array `symbols`, as returned by `label_store_lookup`.
+    """
+    if not len(label_store):
+        return
+
+    label_store = np.asarray(label_store)
+    if label_store.min() < 0 or label_store.max() >= len(symbols):
+        undefined = True
+    else:
+        undefined = (symbols[label_store] == None).any()
+
+    if undefined:
+        defined = set(np.flatnonzero(symbols != None))
+        raise KeyError('Undefined label_store values: %s'
+                       % sorted(set(label_store.tolist()) - defined))
+
+
+# The label_store value of rhythm change annotations, '+'
+RHYTHM_LABEL_STORE = 28
+
+
+def rhythm_episodes(sample, label_store, aux_note, sig_len=None):
+    """
+    Get the rhythm episodes delimited by rhythm change annotations: the
+    '+' labels whose aux_note holds the new rhythm, eg. '(AFIB'.
+
+    Consecutive episodes of the same rhythm are merged.
+
+    Parameters
+    ----------
+    sample : numpy array
+        The annotation locations in samples.
+    label_store : numpy array
+        The label_store values of the annotations.
+    aux_note : list, or numpy array
+        The aux_note strings of the annotations.
+    sig_len : int, optional
+        The signal length of the record, at which the last episode
+        ends. Leave as None to end it after the last annotation.
+
+    Returns
+    -------
+    start : numpy array
+        The first sample of each episode.
+    end : numpy array
+        The sample following the last sample of each episode.
+    rhythm : numpy array
+        The rhythm of each episode.
+
+    """
+    sample = np.asarray(sample, dtype='int64')
+    inds = np.flatnonzero(np.asarray(label_store) == RHYTHM_LABEL_STORE)
+    if aux_note is None:
+        inds = inds[:0]
+
+    # Only the rhythm change annotations' strings are looked up
+    rhythm = np.char.rstrip(np.array([aux_note[i] or '' for i in inds],
+                                     dtype='U'), '\x00')
+    # Ignore rhythm annotations without a rhythm, and repeated rhythms
+    has_rhythm = rhythm != ''
+    inds, rhythm = inds[has_rhythm], rhythm[has_rhythm]
+    changed = np.ones(len(rhythm), dtype='bool')
+    changed[1:] = rhythm[1:] != rhythm[:-1]
+    inds, rhythm = inds[changed], rhythm[changed]
+
+    start = sample[inds]
+    if sig_len is None:
+        sig_len = sample[-1] + 1 if len(sample) else 0
+    end = np.append(start[1:], sig_len).astype('int64')
+
+    return start, end, rhythm
+
+
+def contained_label_table(label_store, symbols, descriptions):
+    """
+    Get the table of the unique labels contained in an annotation, with
+    their number of occurrences.
+
+    Parameters
+    ----------
+    label_store : numpy array
+        The label_store value of each annotation.
+    symbols : numpy array
+        The symbol of each label_store value, from `label_store_lookup`.
+    descriptions : numpy array
+        The description of each label_store value.
+
+    Returns
+    -------
+    contained_labels : pandas dataframe
+        The columns ['label_store', 'symbol', 'description',
+        'n_occurrences'], indexed by label_store value.
+
+    """
+    n_occurrences = np.bincount(label_store, minlength=len(symbols))
+    contained_stores = np.flatnonzero(n_occurrences)
+
+    contained_labels = pd.DataFrame(
+        {'label_store': contained_stores,
+         'symbol': symbols[contained_stores],
+         'description': descriptions[contained_stores],
+         'n_occurrences': n_occurrences[contained_stores]},
+        index=contained_stores)
+
+    return contained_labels[list(ann_label_fields) + ['n_occurrences']]
+
 
 def label_triplets_to_df(triplets):
     """
@@ -995,6 +1960,109 @@ def compact_carry_field(full_field):
     return compact_field
 
 
+def ann_core_bytes(sample, label_store, subtype=None, chan=None, num=None,
+                   aux_note=None, prev_sample=0, prev_chan=0, prev_num=0):
+    """
+    Encode the core fields of a set of annotations into the bytes of an
+    annotation file.
+
+    The bytes of all annotations are placed with numpy operations. Only
+    the aux_note strings are encoded one by one.
+
+    Parameters
+    ----------
+    sample : numpy array
+        The annotation locations in samples.
+    label_store : numpy array
+        The integer values of the annotation labels.
+    subtype, chan, num : numpy array, optional
+        The subtype, chan and num fields. subtype values are written
+        where they are not 0, and chan and num values where they differ
+        from the previous annotation's.
+    aux_note : list, optional
+        The aux_note strings, written where they are not empty.
+    prev_sample, prev_chan, prev_num : int, optional
+        The sample, chan and num values of the annotation preceding the
+        first one, for encoding annotations following ones that were
+        already written. A new file starts from 0 for each.
+
+    Returns
+    -------
+    data_bytes : numpy array
+        The encoded bytes, as uint8.
+
+    """
+    sample = np.asarray(sample, dtype='int64')
+    label_store = np.asarray(label_store, dtype='int64')
+    n_ann = len(sample)
+
+    sampdiff = np.diff(sample, prepend=prev_sample)
+    # Sample differences which do not fit in 10 bits are written with a
+    # preceding SKIP
+    skip = sampdiff > 1023
+
+    # The fields written for each annotation, in order, with the
+    # indicator byte following their value.
+    fields = []
+    if num is not None:
+        num = np.asarray(num, dtype='int64')
+        fields.append((num, num != np.append(prev_num, num[:-1]), 240))
+    if subtype is not None:
+        subtype = np.asarray(subtype, dtype='int64')
+        fields.append((subtype, subtype != 0, 244))
+    if chan is not None:
+        chan = np.asarray(chan, dtype='int64')
+        fields.append((chan, chan != np.append(prev_chan, chan[:-1]), 248))
+
+    # aux_note takes the length byte, the indicator byte, and the
+    # string padded to an even length
+    aux_len = np.zeros(n_ann, dtype='int64')
+    if aux_note is not None:
+        aux_inds = [i for i in range(n_ann) if aux_note[i]]
+        aux_len[aux_inds] = [len(aux_note[i]) for i in aux_inds]
+    else:
+        aux_inds = []
+    aux_bytes = np.where(aux_len > 0, 2 + aux_len + aux_len % 2, 0)
+
+    # The number of bytes and the starting byte of each annotation
+    ann_bytes = np.where(skip, 8, 2) + aux_bytes
+    for _, write, _ in fields:
+        ann_bytes += 2 * write
+    start = np.cumsum(ann_bytes) - ann_bytes
+
+    data_bytes = np.zeros(int(ann_bytes.sum()), dtype='int64')
+
+    # Sample difference and label
+    sd = sampdiff[~skip]
+    pos = start[~skip]
+    data_bytes[pos] = sd & 255
+    data_bytes[pos + 1] = ((sd & 768) >> 8) + 4 * label_store[~skip]
+    # SKIP, the 4 byte sample difference, then 0 and label
+    sd = sampdiff[skip]
+    pos = start[skip]
+    data_bytes[pos + 1] = 236
+    data_bytes[pos + 2] = (sd & 16711680) >> 16
+    data_bytes[pos + 3] = (sd & 4278190080) >> 24
+    data_bytes[pos + 4] = sd & 255
+    data_bytes[pos + 5] = (sd & 65280) >> 8
+    data_bytes[pos + 7] = 4 * label_store[skip]
+
+    # num, subtype and chan
+    pos = start + np.where(skip, 8, 2)
+    for values, write, indicator in fields:
+        data_bytes[pos[write]] = values[write]
+        data_bytes[pos[write] + 1] = indicator
+        pos = pos + 2 * write
+
+    # aux_note
+    for i in aux_inds:
+        data_bytes[pos[i]] = aux_len[i]
+        data_bytes[pos[i] + 1] = 252
+        data_bytes[pos[i] + 2:pos[i] + 2 + aux_len[i]] = [ord(c) for c in aux_note[i]]
+
+    return data_bytes.astype('u1')
+
+
 # Convert an annotation field into bytes to write
 def field2bytes(field, value):
 
@@ -1048,7 +2116,7 @@ def field2bytes(field, value):
 
 def wrann(record_name, extension, sample, symbol=None, subtype=None, chan=None,
           num=None, aux_note=None, label_store=None, fs=None,
-          custom_labels=None, write_dir=''):
+          custom_labels=None, write_dir='', write_index=False):
     """
     Write a WFDB annotation file.
 
@@ -1119,6 +2187,10 @@ def wrann(record_name, extension, sample, symbol=None, subtype=None, chan=None,
         in its mapping. ie. it must come in format 1 or 3 above.
     write_dir : str, optional
         The directory in which to write the annotation file
+    write_index : bool, optional
+        Whether to also write the checkpoint index of the annotation file,
+        used by `rdann` with `use_index=True` to read sample windows
+        without decoding the whole file.
 
     Notes
     -----
@@ -1157,7 +2229,8 @@ def wrann(record_name, extension, sample, symbol=None, subtype=None, chan=None,
             raise Exception("Only one of the 'symbol' and 'label_store' fields may be input, for describing annotation labels")
 
     # Perform field checks and write the annotation file
-    annotation.wrann(write_fs=True, write_dir=write_dir)
+    annotation.wrann(write_fs=True, write_dir=write_dir,
+                     write_index=write_index)
 
 
 def show_ann_labels():
@@ -1186,8 +2259,8 @@ def show_ann_classes():
 
 # todo: return as df option?
 def rdann(record_name, extension, sampfrom=0, sampto=None, shift_samps=False,
-          pb_dir=None, return_label_elements=['symbol'],
-          summarize_labels=False):
+          pb_dir=None, return_label_elements=('symbol',),
+          summarize_labels=False, use_index=False, compact=False):
     """
     Read a WFDB annotation file record_name.extension and return an
     Annotation object.
@@ -1212,7 +2285,7 @@ def rdann(record_name, extension, sampfrom=0, sampto=None, shift_samps=False,
         directory from which to find the required annotation file. eg. For
         record '100' in 'http://physionet.org/physiobank/database/mitdb':
         pb_dir='mitdb'.
-    return_label_elements : list, optional
+    return_label_elements : list, or tuple, optional
         The label elements that are to be returned from reading the annotation
         file. A list with at least one of the following options: 'symbol',
         'label_store', 'description'.
@@ -1220,11 +2293,23 @@ def rdann(record_name, extension, sampfrom=0, sampto=None, shift_samps=False,
         If True, assign a summary table of the set of annotation labels
         contained in the file to the 'contained_labels' attribute of the
         returned object. This table will contain the columns:
-        ['label_store', 'symbol', 'description', 'n_occurences']
+        ['label_store', 'symbol', 'description', 'n_occurrences']
+    use_index : bool, optional
+        Whether to use the checkpoint index of a local annotation file,
+        stored next to it with the '.idx' suffix, so that reading a
+        window with `sampto` only decodes the blocks of annotations
+        covering the window. The index is built and written when the
+        file is first read with this option if it doesn't exist or is
+        out of date. See `wr_ann_index`.
+    compact : bool, optional
+        If True, return a CompactAnnotation instead of an Annotation, with
+        the labels stored as label_store values and the fields in minimal
+        dtypes. `return_label_elements` is then ignored, as all label
+        elements are available on demand.
 
     Returns
     -------
-    annotation : Annotation
+    annotation : Annotation, or CompactAnnotation
         The Annotation object. Call help(wfdb.Annotation) for the attribute
         descriptions.
 
@@ -1245,22 +2330,44 @@ def rdann(record_name, extension, sampfrom=0, sampto=None, shift_samps=False,
     return_label_elements = check_read_inputs(sampfrom, sampto,
                                               return_label_elements)
 
-    # Read the file in byte pairs
-    filebytes = load_byte_pairs(record_name, extension, pb_dir)
+    fields = None
+    ann_index = None
+    if use_index and pb_dir is None:
+        ann_index = rd_ann_index(record_name, extension)
+        # Only decode the blocks covering the window
+        if ann_index is not None and sampto:
+            head_bytes, window_bytes, state = load_indexed_byte_pairs(
+                record_name, extension, ann_index, sampfrom, sampto)
+            fields = proc_ann_bytes_vectorized(window_bytes, sampto, *state)
+            head_fields = proc_ann_bytes(head_bytes, None)
 
-    # Get wfdb annotation fields from the file bytes
-    (sample, label_store, subtype,
-     chan, num, aux_note) = proc_ann_bytes(filebytes, sampto)
+    if fields is None:
+        # Read the file in byte pairs
+        filebytes = load_byte_pairs(record_name, extension, pb_dir)
+
+        # Get wfdb annotation fields from the file bytes
+        fields = proc_ann_bytes(filebytes, sampto)
+        head_fields = fields
+
+        if use_index and pb_dir is None and ann_index is None:
+            wr_ann_index(record_name, extension, filebytes)
+
+    (sample, label_store, subtype, chan, num, aux_note) = fields
 
     # Get the indices of annotations that hold definition information about
     # the entire annotation file, and other empty annotations to be removed.
     potential_definition_inds, rm_inds = get_special_inds(sample, label_store,
                                                           aux_note)
 
-    # Try to extract information describing the annotation file
+    # Try to extract information describing the annotation file, from
+    # the annotations at its start
+    if head_fields is not fields:
+        potential_definition_inds = get_special_inds(head_fields[0],
+                                                     head_fields[1],
+                                                     head_fields[5])[0]
     (fs,
      custom_labels) = interpret_defintion_annotations(potential_definition_inds,
-                                                      aux_note)
+                                                      head_fields[5])
 
     # Remove annotations that do not store actual sample and label information
     (sample, label_store, subtype,
@@ -1281,11 +2388,21 @@ def rdann(record_name, extension, sampfrom=0, sampto=None, shift_samps=False,
             pass
 
     # Create the annotation object
-    annotation = Annotation(record_name=os.path.split(record_name)[1],
-                            extension=extension, sample=sample,
-                            label_store=label_store,  subtype=subtype,
-                            chan=chan, num=num, aux_note=aux_note, fs=fs,
-                            custom_labels=custom_labels)
+    if compact:
+        aux_inds = [i for i in range(len(aux_note)) if aux_note[i]]
+        annotation = CompactAnnotation(
+            record_name=os.path.split(record_name)[1], extension=extension,
+            sample=sample, label_store=label_store, subtype=subtype,
+            chan=chan, num=num, aux_inds=aux_inds,
+            aux_strings=[aux_note[i] for i in aux_inds], fs=fs,
+            custom_labels=(label_triplets_to_df(custom_labels)
+                           if custom_labels is not None else None))
+    else:
+        annotation = Annotation(record_name=os.path.split(record_name)[1],
+                                extension=extension, sample=sample,
+                                label_store=label_store,  subtype=subtype,
+                                chan=chan, num=num, aux_note=aux_note, fs=fs,
+                                custom_labels=custom_labels)
 
     # Apply the desired index range
     if sampfrom > 0 and sampto is not None:
@@ -1301,12 +2418,110 @@ def rdann(record_name, extension, sampfrom=0, sampto=None, shift_samps=False,
     if summarize_labels:
         annotation.get_contained_labels(inplace=True)
 
+    if compact:
+        return annotation
+
     # Set/unset the desired label values
     annotation.set_label_elements(return_label_elements)
 
     return annotation
 
 
+def rdanns(record_names, extension, sampfrom=0, sampto=None, pb_dir=None,
+           workers=1):
+    """
+    Read the WFDB annotation files of multiple records into a single
+    table.
+
+    Parameters
+    ----------
+    record_names : list
+        The record names of the annotation files to read. See `rdann`.
+    extension : str
+        The annotatator extension of the annotation files.
+    sampfrom : int, optional
+        The minimum sample number for annotations to be returned.
+    sampto : int, optional
+        The maximum sample number for annotations to be returned.
+    pb_dir : str, optional
+        Option used to stream data from Physiobank. See `rdann`.
+    workers : int, optional
+        The number of processes reading the files in parallel. Leave as
+        1 to read them in the current process.
+
+    Returns
+    -------
+    table : AnnotationTable
+        The annotations of all records, in order, as one table.
+
+    Notes
+    -----
+    The records' label definitions are not applied to the table, so
+    the labels of records with custom labels must be interpreted using
+    the table's `custom_labels` attribute.
+
+    Examples
+    --------
+    >>> table = wfdb.rdanns(wfdb.get_record_list('mitdb'), 'atr',
+                            pb_dir='mitdb', workers=4)
+
+    """
+    record_names = list(record_names)
+    rdinputs = [(record_name, extension, sampfrom, sampto, pb_dir)
+                for record_name in record_names]
+
+    if workers > 1:
+        with multiprocessing.Pool(
+                processes=workers, initializer=download.set_db_index_url,
+                initargs=(download.get_db_index_url(),)) as pool:
+            annotations = pool.map(rd_compact_ann, rdinputs,
+                                   chunksize=max(1, len(rdinputs) // (4 * workers)))
+    else:
+        annotations = [rd_compact_ann(inputs) for inputs in rdinputs]
+
+    n_anns = [len(ann) for ann in annotations]
+
+    # Offset each file's aux_note indices into the joined list
+    aux_index = np.full(sum(n_anns), -1, dtype='int32')
+    aux_strings = []
+    ann_start = 0
+    for ann, n_ann in zip(annotations, n_anns):
+        aux_index[ann_start + ann.aux_inds] = np.arange(
+            len(aux_strings), len(aux_strings) + len(ann.aux_strings))
+        aux_strings.extend(ann.aux_strings)
+        ann_start += n_ann
+
+    def concat(field, dtype):
+        return np.concatenate([getattr(ann, field) for ann in annotations]
+                              + [np.empty(0, dtype=dtype)])
+
+    return AnnotationTable(
+        record_names=record_names, extension=extension,
+        record=np.repeat(np.arange(len(record_names), dtype='int32'), n_anns),
+        sample=concat('sample', 'int64'),
+        label_store=concat('label_store', 'uint8'),
+        subtype=concat('subtype', 'int8'), chan=concat('chan', 'uint8'),
+        num=concat('num', 'int8'), aux_index=aux_index,
+        aux_strings=aux_strings, fs=[ann.fs for ann in annotations],
+        custom_labels=[ann.custom_labels for ann in annotations])
+
+
+def rd_compact_ann(inputs):
+    """
+    Read an annotation file in compact form, for `rdanns`.
+
+    Parameters
+    ----------
+    inputs : tuple
+        The (record_name, extension, sampfrom, sampto, pb_dir) of the
+        annotation file.
+
+    """
+    record_name, extension, sampfrom, sampto, pb_dir = inputs
+    return rdann(record_name, extension, sampfrom=sampfrom, sampto=sampto,
+                 pb_dir=pb_dir, compact=True)
+
+
 def check_read_inputs(sampfrom, sampto, return_label_elements):
 
     if sampto and sampto <= sampfrom:
@@ -1316,6 +2531,8 @@ def check_read_inputs(sampfrom, sampto, return_label_elements):
 
     if isinstance(return_label_elements, str):
         return_label_elements = [return_label_elements]
+    else:
+        return_label_elements = list(return_label_elements)
 
     if set.union(set(ann_label_fields), set(return_label_elements))!=set(ann_label_fields):
         raise ValueError('return_label_elements must be a list containing one or more of the following elements:',label_types)
@@ -1334,8 +2551,351 @@ def load_byte_pairs(record_name, extension, pb_dir):
 
     return filebytes
 
+# The number of annotations per block of the annotation index
+ANN_INDEX_INTERVAL = 1024
+
+
+def calc_ann_index(filebytes, interval=ANN_INDEX_INTERVAL):
+    """
+    Calculate the checkpoint index of an annotation file.
+
+    Parameters
+    ----------
+    filebytes : numpy array
+        The byte pairs of the annotation file.
+    interval : int, optional
+        The number of annotations between checkpoints.
+
+    Returns
+    -------
+    checkpoints : numpy array, or None
+        Structured array with one row per block of `interval`
+        annotations, with the byte offset of the block's first
+        annotation, and the sample, chan and num values carried over
+        from the annotation preceding it. The first block starts at
+        byte 0. None if the file can't be indexed: it has an unusual
+        layout, or its samples are not monotonic after the first block.
+
+    """
+    fields = proc_ann_bytes_vectorized(filebytes, None, return_starts=True)
+    if fields is None:
+        return None
+    sample, _, _, chan, num, _, ann_starts = fields
+
+    if np.any(np.diff(sample[interval - 1:]) < 0):
+        return None
+
+    inds = np.arange(interval, len(sample), interval)
+    checkpoints = np.zeros(len(inds) + 1, dtype=[('byte', '<i8'),
+                                                  ('sample', '<i8'),
+                                                  ('chan', '<i8'),
+                                                  ('num', '<i8')])
+    checkpoints['byte'][1:] = 2 * ann_starts[inds]
+    checkpoints['sample'][1:] = sample[inds - 1]
+    checkpoints['chan'][1:] = chan[inds - 1]
+    checkpoints['num'][1:] = num[inds - 1]
+
+    return checkpoints
+
+
+def wr_ann_index(record_name, extension, filebytes, write_dir=''):
+    """
+    Write the checkpoint index of an annotation file, to the file
+    `record_name.extension.idx`.
+
+    The index holds the checkpoints calculated by `calc_ann_index`,
+    along with the size and modification time of the annotation file to
+    detect when it is out of date. If the file can't be indexed, any
+    existing index is removed instead. The index is written to a
+    temporary file which then replaces the index file, so readers never
+    see a partially written index. Nothing is written if the index file
+    can't be created.
+
+    Parameters
+    ----------
+    record_name : str
+        The record name of the WFDB annotation file.
+    extension : str
+        The annotatator extension of the annotation file.
+    filebytes : numpy array
+        The byte pairs of the annotation file.
+    write_dir : str, optional
+        The directory in which the annotation file is located.
+
+    """
+    checkpoints = calc_ann_index(filebytes)
+    if checkpoints is None:
+        rm_ann_index(record_name, extension, write_dir=write_dir)
+        return
+
+    index_file = os.path.join(write_dir, record_name + '.' + extension + '.idx')
+    temp_file = None
+    try:
+        file_mtime = os.stat(os.path.join(
+            write_dir, record_name + '.' + extension)).st_mtime_ns
+        fd, temp_file = tempfile.mkstemp(
+            dir=os.path.dirname(index_file) or '.',
+            prefix=os.path.basename(index_file) + '.', suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, checkpoints=checkpoints,
+                     file_size=np.int64(filebytes.size),
+                     file_mtime=np.int64(file_mtime))
+        os.replace(temp_file, index_file)
+    except OSError:
+        if temp_file is not None and os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+def rm_ann_index(record_name, extension, write_dir=''):
+    """
+    Remove the checkpoint index of an annotation file, if there is one.
+    """
+    try:
+        os.remove(os.path.join(write_dir, record_name + '.' + extension
+                               + '.idx'))
+    except OSError:
+        pass
+
+
+def rd_ann_index(record_name, extension):
+    """
+    Read the checkpoint index of a local annotation file. Returns None
+    if there is no index, if it is corrupt, or if it does not match the
+    size and modification time of the annotation file.
+    """
+    index_file = record_name + '.' + extension + '.idx'
+    if not os.path.isfile(index_file):
+        return None
+
+    try:
+        with np.load(index_file) as index:
+            checkpoints = index['checkpoints']
+            file_size = int(index['file_size'])
+            file_mtime = int(index['file_mtime'])
+        file_stat = os.stat(record_name + '.' + extension)
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        return None
+
+    if (file_size != file_stat.st_size
+            or file_mtime != file_stat.st_mtime_ns):
+        return None
+
+    return checkpoints
+
+
+def load_indexed_byte_pairs(record_name, extension, checkpoints, sampfrom,
+                            sampto):
+    """
+    Load the byte pairs of the blocks of an annotation file covering a
+    sample window, using its checkpoint index.
+
+    Returns
+    -------
+    head_bytes : numpy array
+        The byte pairs of the first block, which holds any definition
+        annotations.
+    window_bytes : numpy array
+        The byte pairs of the blocks covering the window, terminated by
+        an eof pair.
+    state : tuple
+        The sample, chan and num values carried over from the annotation
+        preceding the window's first block.
+
+    """
+    # The first block whose annotations may be at or after sampfrom
+    start = max(np.searchsorted(checkpoints['sample'], sampfrom) - 1, 0)
+    # The first block starting after sampto
+    end = np.searchsorted(checkpoints['sample'], sampto, side='right')
+
+    with open(record_name + '.' + extension, 'rb') as f:
+        head_end = checkpoints['byte'][1] if len(checkpoints) > 1 else -1
+        head_bytes = np.fromfile(f, '<u1', count=head_end)
+
+        f.seek(checkpoints['byte'][start])
+        if end < len(checkpoints):
+            count = checkpoints['byte'][end] - checkpoints['byte'][start]
+        else:
+            count = -1
+        window_bytes = np.fromfile(f, '<u1', count=count)
+
+    eof = np.zeros(2, dtype='u1')
+    if len(checkpoints) > 1:
+        head_bytes = np.concatenate((head_bytes, eof))
+    if end < len(checkpoints):
+        window_bytes = np.concatenate((window_bytes, eof))
+
+    state = tuple(int(checkpoints[field][start])
+                  for field in ['sample', 'chan', 'num'])
+
+    return head_bytes.reshape([-1, 2]), window_bytes.reshape([-1, 2]), state
+
+
 #  Get regular annotation fields from the annotation bytes
 def proc_ann_bytes(filebytes, sampto):
+    """
+    Get the annotation fields from the annotation file byte pairs.
+
+    The byte pairs are decoded with numpy operations by
+    `proc_ann_bytes_vectorized`. Unusual files which it does not handle
+    are decoded one annotation at a time by `proc_ann_bytes_loop`.
+    """
+    fields = proc_ann_bytes_vectorized(filebytes, sampto)
+    if fields is None:
+        fields = proc_ann_bytes_loop(filebytes, sampto)
+    return fields
+
+
+def proc_ann_bytes_vectorized(filebytes, sampto, prev_sample=0, prev_chan=0,
+                              prev_num=0, return_starts=False):
+    """
+    Get the annotation fields from the annotation file byte pairs,
+    using numpy operations on all the byte pairs at once.
+
+    Only the SKIP and AUX pairs, which are followed by data pairs, are
+    visited one by one to locate the data pairs. Every other pair is
+    either the sample difference and label of an annotation, or a NUM,
+    SUB or CHAN field of the preceding annotation.
+
+    Returns None for files with unusual layouts, which have to be
+    decoded by `proc_ann_bytes_loop`: fields preceding the first
+    annotation, repeated fields within one annotation, consecutive
+    SKIPs, or data running into the final byte pair.
+
+    The byte pairs may also start in the middle of a file, at the start
+    of an annotation, with `prev_sample`, `prev_chan` and `prev_num`
+    giving the values of the preceding annotation. If `return_starts`
+    is True, the index of the first byte pair of each annotation is
+    also returned.
+    """
+    n_pairs = filebytes.shape[0]
+    if n_pairs < 2:
+        fields = [], [], [], [], [], []
+        return fields + (np.array([], dtype='int64'),) if return_starts else fields
+
+    codes = (filebytes[:, 1] >> 2).astype('int64')
+    low = filebytes[:, 0].astype('int64')
+    # The pairs processed as annotation starts or fields. The final pair
+    # holds the eof marker.
+    n_proc = n_pairs - 1
+
+    # Locate the SKIP and AUX pairs which are not themselves data pairs
+    skip_inds = []
+    aux_inds = []
+    cover_end = 0
+    for i in np.where((codes[:n_proc] == 59) | (codes[:n_proc] == 63))[0]:
+        if i < cover_end:
+            continue
+        if codes[i] == 59:
+            skip_inds.append(i)
+            cover_end = i + 3
+        else:
+            aux_inds.append(i)
+            cover_end = i + 1 + (int(low[i]) + 1) // 2
+    if cover_end > n_proc or codes[n_proc] > 59:
+        return None
+    skip_inds = np.array(skip_inds, dtype='int64')
+    aux_inds = np.array(aux_inds, dtype='int64')
+
+    # Mark the data pairs following the SKIP and AUX pairs
+    data_bounds = np.zeros(n_pairs + 1, dtype='int64')
+    np.add.at(data_bounds, skip_inds + 1, 1)
+    np.add.at(data_bounds, skip_inds + 3, -1)
+    aux_data_len = (low[aux_inds] + 1) // 2
+    np.add.at(data_bounds, aux_inds + 1, 1)
+    np.add.at(data_bounds, aux_inds + 1 + aux_data_len, -1)
+    is_data = np.cumsum(data_bounds[:n_pairs]) > 0
+    is_data[n_proc:] = True
+
+    # The label pair following a SKIP must be a regular annotation
+    if len(skip_inds) and np.any(codes[skip_inds + 3] >= 59):
+        return None
+
+    # The pairs holding the sample difference and label of annotations
+    ann_pairs = np.where(~is_data & (codes < 59))[0]
+    n_ann = len(ann_pairs)
+    # The annotation each pair belongs to
+    ann_num = np.cumsum(~is_data & (codes < 59)) - 1
+
+    # Sample differences. SKIPs add their 32 bit value to the following
+    # annotation's difference.
+    sample_diff = (low[ann_pairs]
+                   + 256 * (filebytes[ann_pairs, 1] & 3).astype('int64'))
+    if len(skip_inds):
+        skip_val = (65536 * low[skip_inds + 1]
+                    + 16777216 * filebytes[skip_inds + 1, 1].astype('int64')
+                    + low[skip_inds + 2]
+                    + 256 * filebytes[skip_inds + 2, 1].astype('int64'))
+        skip_val[skip_val > 2147483647] -= 4294967296
+        sample_diff[ann_num[skip_inds + 3]] += skip_val
+    sample = prev_sample + np.cumsum(sample_diff)
+    label_store = codes[ann_pairs]
+    # Annotations preceded by a SKIP start at the SKIP
+    ann_starts = ann_pairs.copy()
+    ann_starts[ann_num[skip_inds + 3]] -= 3
+
+    # The extra fields, each belonging to the preceding annotation
+    field_values = {}
+    for field, code in [('num', 60), ('subtype', 61), ('chan', 62),
+                        ('aux_note', 63)]:
+        field_pairs = np.where(~is_data & (codes == code))[0]
+        field_ann = ann_num[field_pairs]
+        if len(field_pairs) and (field_ann[0] < 0
+                                 or np.any(np.diff(field_ann) == 0)):
+            return None
+        field_values[field] = (field_pairs, field_ann)
+
+    # subtype defaults to 0
+    field_pairs, field_ann = field_values['subtype']
+    subtype = np.zeros(n_ann, dtype='int64')
+    subtype[field_ann] = filebytes[field_pairs, 0].astype('i1')
+
+    # chan and num carry over the previous value
+    chan = fill_carry_field(n_ann, *field_values['chan'],
+                            values=filebytes[field_values['chan'][0], 0],
+                            prev_value=prev_chan)
+    num = fill_carry_field(n_ann, *field_values['num'],
+                           values=filebytes[field_values['num'][0], 0].astype('i1'),
+                           prev_value=prev_num)
+
+    # aux_note defaults to an empty string
+    aux_note = [''] * n_ann
+    for i, ann in zip(aux_inds, field_values['aux_note'][1]):
+        aux_note[ann] = filebytes[i + 1:i + 1 + (int(low[i]) + 1) // 2].tobytes()[:low[i]].decode('latin-1')
+
+    # Stop at the first annotation beyond sampto
+    if sampto:
+        beyond = np.where(sample > sampto)[0]
+        if len(beyond):
+            end = beyond[0]
+            sample, label_store, subtype, chan, num, ann_starts = [
+                a[:end] for a in (sample, label_store, subtype, chan, num,
+                                  ann_starts)]
+            aux_note = aux_note[:end]
+
+    if return_starts:
+        return sample, label_store, subtype, chan, num, aux_note, ann_starts
+    return sample, label_store, subtype, chan, num, aux_note
+
+
+def fill_carry_field(n_ann, field_pairs, field_ann, values, prev_value=0):
+    """
+    Expand the values of a carried over field (chan or num) to all
+    annotations. Annotations without a value carry over the previous
+    annotation's value, and the first value defaults to `prev_value`.
+    """
+    full_values = np.zeros(n_ann, dtype='int64')
+    full_values[field_ann] = values
+    has_value = np.zeros(n_ann, dtype='bool')
+    has_value[field_ann] = True
+    source = np.maximum.accumulate(np.where(has_value, np.arange(n_ann), -1))
+    return np.where(source >= 0, full_values[source], prev_value)
+
+
+def proc_ann_bytes_loop(filebytes, sampto):
+    """
+    Get the annotation fields from the annotation file byte pairs,
+    processing one annotation at a time.
+    """
 
     # Base annotation fields
     sample, label_store, subtype, chan, num, aux_note = [], [], [], [], [], []
@@ -1567,9 +3127,12 @@ def rm_empty_indices(*args):
     if not rm_inds:
         return args[1:]
 
-    keep_inds = [i for i in range(len(args[1])) if i not in rm_inds]
+    keep = np.ones(len(args[1]), dtype='bool')
+    keep[list(rm_inds)] = False
+    keep_inds = np.where(keep)[0]
 
-    return [[a[i] for i in keep_inds] for a in args[1:]]
+    return [a[keep] if isinstance(a, np.ndarray)
+            else [a[i] for i in keep_inds] for a in args[1:]]
 
 def lists_to_int_arrays(*args):
     """
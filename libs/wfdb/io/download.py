@@ -1,20 +1,48 @@
+import contextlib
+import contextvars
+import hashlib
+import json
 import multiprocessing
 import numpy as np
 import re
 import os
 import posixpath
 import requests
+import time
 
 
 # The physiobank index url
 PB_INDEX_URL = 'http://physionet.org/physiobank/database/'
 
+# The checksum listing looked for in a database's base directory
+MANIFEST_NAME = 'SHA256SUMS.txt'
+# The local file recording the checksums of the last manifest sync
+LOCAL_MANIFEST_NAME = '.wfdb_manifest'
+# Size of the chunks streamed to disk when downloading files
+DL_CHUNK_SIZE = 65536
+# Default time in seconds for which cached remote metadata is fresh
+CACHE_TTL = 3600
+
 class Config(object):
     pass
 
 # The configuration database index url. Uses physiobank index by default.
 config = Config()
 config.db_index_url = PB_INDEX_URL
+# The metadata cache settings. In memory only by default.
+config.cache_ttl = CACHE_TTL
+config.cache_dir = None
+
+# Context-local database index url, overriding `config.db_index_url`
+_db_index_url = contextvars.ContextVar('wfdb_db_index_url', default=None)
+
+# The in memory metadata cache, mapping each url to its cache entry
+_metadata_cache = {}
+
+# Context-local replacement of `_do_request` used by the streaming
+# functions, set by `wfdb.io.aio` to supply content fetched ahead.
+_remote_fetcher = contextvars.ContextVar('wfdb_remote_fetcher',
+                                         default=None)
 
 
 def set_db_index_url(db_index_url=PB_INDEX_URL):
@@ -32,6 +60,252 @@ def set_db_index_url(db_index_url=PB_INDEX_URL):
     config.db_index_url = db_index_url
 
 
+def get_db_index_url():
+    """
+    Get the database index url in effect: the one set by
+    `use_db_index_url` in the current context, or otherwise the one set
+    by `set_db_index_url`.
+    """
+    db_index_url = _db_index_url.get()
+    if db_index_url is None:
+        return config.db_index_url
+    return db_index_url
+
+
+@contextlib.contextmanager
+def use_db_index_url(db_index_url):
+    """
+    Context manager setting the database index url for the current
+    context only, ie. the current thread or asyncio task.
+
+    Unlike `set_db_index_url`, which changes the url for the whole
+    process, this can be used by concurrent readers streaming from
+    different locations.
+
+    Parameters
+    ----------
+    db_index_url : str
+        The database index url to use within the context.
+
+    Notes
+    -----
+    The reading functions (`rdheader`, `rdrecord`, `rdsamp`, `rdann`)
+    keep no shared mutable state and open their own file handles, so
+    they can be called concurrently from multiple threads. Threads
+    started by a `ThreadPoolExecutor` do not inherit the context of the
+    submitting thread: use this context manager within the submitted
+    function, or submit it through `contextvars.copy_context().run`.
+
+    Examples
+    --------
+    >>> with wfdb.io.download.use_db_index_url('http://localhost/db/'):
+            record = wfdb.rdrecord('100', pb_dir='mitdb')
+
+    """
+    token = _db_index_url.set(db_index_url)
+    try:
+        yield
+    finally:
+        _db_index_url.reset(token)
+
+
+def set_metadata_cache(ttl=CACHE_TTL, cache_dir=None):
+    """
+    Configure the cache of remote metadata: the DBS, RECORDS,
+    ANNOTATORS and manifest listings. Remote file sizes are not cached.
+
+    Cached entries are used without contacting the server for `ttl`
+    seconds. After that, listings are revalidated with a conditional
+    request (If-None-Match/If-Modified-Since), so unchanged listings
+    are not downloaded again.
+
+    Parameters
+    ----------
+    ttl : int, or None, optional
+        The time in seconds for which cached entries are considered
+        fresh. Set to 0 or None to disable the cache.
+    cache_dir : str, optional
+        A local directory in which to also store the cache entries, so
+        that they persist across processes and sessions. Leave as None
+        to only cache in memory.
+
+    Examples
+    --------
+    >>> wfdb.io.download.set_metadata_cache(ttl=86400, cache_dir='/tmp/wfdb')
+
+    """
+    config.cache_ttl = ttl
+    config.cache_dir = cache_dir
+    if cache_dir is not None and not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+
+def clear_metadata_cache():
+    """
+    Remove all entries of the remote metadata cache, in memory and in
+    the cache directory if one is set.
+    """
+    _metadata_cache.clear()
+    if config.cache_dir is not None and os.path.isdir(config.cache_dir):
+        for file in os.listdir(config.cache_dir):
+            if file.endswith('.json'):
+                os.remove(os.path.join(config.cache_dir, file))
+
+
+def _cache_file_name(key):
+    """
+    The file in the cache directory storing the entry of a cache key.
+    """
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(config.cache_dir, digest + '.json')
+
+
+def _rd_cache_entry(key):
+    """
+    Get the cache entry of a key from memory, or from the cache
+    directory. Returns None if there is no entry.
+    """
+    entry = _metadata_cache.get(key)
+    if entry is None and config.cache_dir is not None:
+        cache_file = _cache_file_name(key)
+        if os.path.isfile(cache_file):
+            try:
+                with open(cache_file, 'r') as fp:
+                    entry = json.load(fp)
+            except ValueError:
+                return None
+            _metadata_cache[key] = entry
+    return entry
+
+
+def _wr_cache_entry(key, entry):
+    """
+    Store the cache entry of a key in memory, and in the cache
+    directory if one is set.
+    """
+    _metadata_cache[key] = entry
+    if config.cache_dir is not None:
+        cache_file = _cache_file_name(key)
+        tmp_file = '%s.%d.tmp' % (cache_file, os.getpid())
+        with open(tmp_file, 'w') as fp:
+            json.dump(entry, fp)
+        os.replace(tmp_file, cache_file)
+
+
+def _get_listing(url):
+    """
+    Get the content of a remote metadata listing, using the metadata
+    cache.
+
+    Parameters
+    ----------
+    url : str
+        The full url of the listing.
+
+    Returns
+    -------
+    status_code : int
+        The HTTP status code of the response. 404 responses are also
+        cached, since they are used to check for missing listings.
+    content : bytes
+        The content of the listing.
+
+    """
+    if not config.cache_ttl:
+        response = requests.get(url)
+        return response.status_code, response.content
+
+    key = 'GET ' + url
+    entry = _rd_cache_entry(key)
+    if entry is not None and time.time() - entry['time'] < config.cache_ttl:
+        return entry['status_code'], entry['content'].encode('latin-1')
+
+    # Revalidate the stale entry
+    headers = {}
+    if entry is not None:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    response = requests.get(url, headers=headers)
+    if response.status_code == 304 and entry is not None:
+        entry['time'] = time.time()
+    else:
+        # Only cache definite answers
+        if response.status_code not in (200, 404):
+            return response.status_code, response.content
+        entry = {'time': time.time(),
+                 'status_code': response.status_code,
+                 'content': response.content.decode('latin-1'),
+                 'etag': response.headers.get('etag'),
+                 'last_modified': response.headers.get('last-modified')}
+    _wr_cache_entry(key, entry)
+
+    return entry['status_code'], entry['content'].encode('latin-1')
+
+
+def _request(method, url, byte_range=None):
+    """
+    Perform a request for remote file content, for the streaming
+    functions. Goes through the context-local fetcher if one is set.
+
+    Parameters
+    ----------
+    method : str
+        'GET' to get the file content, or 'HEAD' to get its size.
+    url : str
+        The full url of the file.
+    byte_range : tuple, optional
+        The (start_byte, byte_count) of the content to get. Leave as
+        None to get the entire file.
+
+    Returns
+    -------
+    content : bytes, or int
+        The requested content for 'GET', or the file size in bytes for
+        'HEAD'.
+
+    """
+    fetcher = _remote_fetcher.get()
+    if fetcher is not None:
+        return fetcher(method, url, byte_range)
+    return _do_request(method, url, byte_range)
+
+
+def _do_request(method, url, byte_range=None):
+    """
+    Perform a request for remote file content. See `_request`.
+    """
+    if method == 'HEAD':
+        response = requests.head(url, headers={'Accept-Encoding': 'identity'})
+        # Raise HTTPError if invalid url
+        response.raise_for_status()
+        return int(response.headers['content-length'])
+
+    if byte_range is None:
+        response = requests.get(url)
+    else:
+        # Specify the byte range
+        start_byte, byte_count = byte_range
+        end_byte = start_byte + byte_count - 1
+        headers = {"Range":"bytes=%d-%d" % (start_byte, end_byte),
+                   'Accept-Encoding': '*'}
+        response = requests.get(url, headers=headers, stream=True)
+
+    # Raise HTTPError if invalid url
+    response.raise_for_status()
+
+    return response.content
+
+
+def _file_url(pb_dir, file_name):
+    """
+    The full url of a remote file in a Physiobank directory.
+    """
+    return posixpath.join(get_db_index_url(), pb_dir, file_name)
+
+
 def _remote_file_size(url=None, file_name=None, pb_dir=None):
     """
     Get the remote file size in bytes
@@ -57,14 +331,11 @@ def _remote_file_size(url=None, file_name=None, pb_dir=None):
 
     # Option to construct the url
     if file_name and pb_dir:
-        url = posixpath.join(config.db_index_url, pb_dir, file_name)
+        url = _file_url(pb_dir, file_name)
 
-    response = requests.head(url, headers={'Accept-Encoding': 'identity'})
-    # Raise HTTPError if invalid url
-    response.raise_for_status()
-
-    # Supposed size of the file
-    remote_file_size = int(response.headers['content-length'])
+    # Supposed size of the file. Not cached, since it is used to decide
+    # whether to resume partial downloads of files that may change.
+    remote_file_size = _request('HEAD', url)
 
     return remote_file_size
 
@@ -83,14 +354,11 @@ def _stream_header(file_name, pb_dir):
 
     """
     # Full url of header location
-    url = posixpath.join(config.db_index_url, pb_dir, file_name)
-    response = requests.get(url)
-
-    # Raise HTTPError if invalid url
-    response.raise_for_status()
+    url = _file_url(pb_dir, file_name)
+    content = _request('GET', url)
 
     # Get each line as a string
-    filelines = response.content.decode('iso-8859-1').splitlines()
+    filelines = content.decode('iso-8859-1').splitlines()
 
     # Separate content into header and comment lines
     header_lines = []
@@ -140,21 +408,14 @@ def _stream_dat(file_name, pb_dir, byte_count, start_byte, dtype):
     """
 
     # Full url of dat file
-    url = posixpath.join(config.db_index_url, pb_dir, file_name)
-
-    # Specify the byte range
-    end_byte = start_byte + byte_count - 1
-    headers = {"Range":"bytes=%d-%d" % (start_byte, end_byte),
-               'Accept-Encoding': '*'}
+    url = _file_url(pb_dir, file_name)
 
-    # Get the content
-    response = requests.get(url, headers=headers, stream=True)
+    # Get the content of the byte range
+    content = _request('GET', url, (start_byte, byte_count))
 
-    # Raise HTTPError if invalid url
-    response.raise_for_status()
-
-    # Convert to numpy array
-    sig_data = np.fromstring(response.content, dtype=dtype)
+    # Convert to numpy array. Copied to be writable, since the samples
+    # may be skewed in place.
+    sig_data = np.frombuffer(content, dtype=dtype).copy()
 
     return sig_data
 
@@ -172,15 +433,13 @@ def _stream_annotation(file_name, pb_dir):
 
     """
     # Full url of annotation file
-    url = posixpath.join(config.db_index_url, pb_dir, file_name)
+    url = _file_url(pb_dir, file_name)
 
     # Get the content
-    response = requests.get(url)
-    # Raise HTTPError if invalid url
-    response.raise_for_status()
+    content = _request('GET', url)
 
     # Convert to numpy array
-    ann_data = np.fromstring(response.content, dtype=np.dtype('<u1'))
+    ann_data = np.frombuffer(content, dtype=np.dtype('<u1'))
 
     return ann_data
 
@@ -194,10 +453,10 @@ def get_dbs():
     >>> dbs = get_dbs()
 
     """
-    url = posixpath.join(config.db_index_url, 'DBS')
-    response = requests.get(url)
+    url = posixpath.join(get_db_index_url(), 'DBS')
+    _, content = _get_listing(url)
 
-    dbs = response.content.decode('ascii').splitlines()
+    dbs = content.decode('ascii').splitlines()
     dbs = [re.sub('\t{2,}', '\t', line).split('\t') for line in dbs]
 
     return dbs
@@ -224,16 +483,16 @@ def get_record_list(db_dir, records='all'):
 
     """
     # Full url physiobank database
-    db_url = posixpath.join(config.db_index_url, db_dir)
+    db_url = posixpath.join(get_db_index_url(), db_dir)
 
     # Check for a RECORDS file
     if records == 'all':
-        response = requests.get(posixpath.join(db_url, 'RECORDS'))
-        if response.status_code == 404:
+        status_code, content = _get_listing(posixpath.join(db_url, 'RECORDS'))
+        if status_code == 404:
             raise ValueError('The database %s has no WFDB files to download' % db_url)
 
         # Get each line as a string
-        record_list = response.content.decode('ascii').splitlines()
+        record_list = content.decode('ascii').splitlines()
     # Otherwise the records are input manually
     else:
         record_list = records
@@ -244,18 +503,18 @@ def get_record_list(db_dir, records='all'):
 def get_annotators(db_dir, annotators):
 
     # Full url physiobank database
-    db_url = posixpath.join(config.db_index_url, db_dir)
+    db_url = posixpath.join(get_db_index_url(), db_dir)
 
     if annotators is not None:
         # Check for an ANNOTATORS file
-        r = requests.get(posixpath.join(db_url, 'ANNOTATORS'))
-        if r.status_code == 404:
+        status_code, content = _get_listing(posixpath.join(db_url, 'ANNOTATORS'))
+        if status_code == 404:
             if annotators == 'all':
                 return
             else:
                 raise ValueError('The database %s has no annotation files to download' % db_url)
         # Make sure the input annotators are present in the database
-        ann_list = r.content.decode('ascii').splitlines()
+        ann_list = content.decode('ascii').splitlines()
         ann_list = [a.split('\t')[0] for a in ann_list]
 
         # Get the annotation file types required
@@ -306,7 +565,7 @@ def dl_pb_file(inputs):
     basefile, subdir, db, dl_dir, keep_subdirs, overwrite = inputs
 
     # Full url of file
-    url = posixpath.join(config.db_index_url, db, subdir, basefile)
+    url = posixpath.join(get_db_index_url(), db, subdir, basefile)
 
     # Supposed size of the file
     remote_file_size = _remote_file_size(url)
@@ -368,7 +627,310 @@ def dl_full_file(url, save_file_name):
     return
 
 
-def dl_files(db, dl_dir, files, keep_subdirs=True, overwrite=False):
+# ---- Manifest based synchronization of database files ------- #
+
+def get_manifest(db_dir, manifest_name=MANIFEST_NAME):
+    """
+    Get the checksum manifest of a database.
+
+    Parameters
+    ----------
+    db_dir : str
+        The database directory, usually the same as the database slug.
+        The location to look for the manifest file.
+    manifest_name : str, optional
+        The name of the manifest file, listing the sha256 digest of
+        each database file in the format written by `sha256sum`.
+
+    Returns
+    -------
+    manifest : dict, or None
+        Dictionary mapping each file path, relative to the database's
+        base directory, to its hex sha256 digest. None if the database
+        has no manifest file.
+
+    Examples
+    --------
+    >>> manifest = wfdb.io.download.get_manifest('mitdb')
+
+    """
+    url = posixpath.join(get_db_index_url(), db_dir, manifest_name)
+    status_code, content = _get_listing(url)
+    if status_code == 404:
+        return None
+    if status_code != 200:
+        raise requests.HTTPError('%d Error for url: %s' % (status_code, url))
+
+    return _parse_manifest(content.decode('utf-8'))
+
+
+def _parse_manifest(content):
+    """
+    Parse the lines of a `sha256sum` style listing: '<digest> <path>',
+    where the path may be prefixed by '*' for binary mode.
+    """
+    manifest = {}
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        digest, file = line.split(None, 1)
+        file = file.lstrip('*').strip()
+        if file.startswith('./'):
+            file = file[2:]
+        manifest[file] = digest.lower()
+
+    return manifest
+
+
+def _rd_local_manifest(dl_dir):
+    """
+    Read the manifest written by the last sync into `dl_dir`, if any.
+    """
+    manifest_file = os.path.join(dl_dir, LOCAL_MANIFEST_NAME)
+    if not os.path.isfile(manifest_file):
+        return {}
+    with open(manifest_file, 'r') as fp:
+        return json.load(fp)
+
+
+def _wr_local_manifest(dl_dir, manifest):
+    """
+    Write the manifest of the synced files into `dl_dir`.
+    """
+    manifest_file = os.path.join(dl_dir, LOCAL_MANIFEST_NAME)
+    with open(manifest_file + '.tmp', 'w') as fp:
+        json.dump(manifest, fp, indent=0, sort_keys=True)
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+
+def _file_sha256(file_name):
+    """
+    Compute the hex sha256 digest of a local file.
+    """
+    sha = hashlib.sha256()
+    with open(file_name, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(DL_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _local_file_name(file, dl_dir, keep_subdirs):
+    """
+    The local path of a database file, relative to the database's base
+    directory.
+    """
+    subdir, basefile = posixpath.split(file)
+    if keep_subdirs:
+        return os.path.join(dl_dir, subdir, basefile)
+    return os.path.join(dl_dir, basefile)
+
+
+def _manifest_entry(local_file, digest):
+    """
+    The local manifest entry of a file. The size and modification time
+    allow detecting local changes without rehashing the file.
+    """
+    stat = os.stat(local_file)
+    return {'sha256': digest, 'size': stat.st_size,
+            'mtime': stat.st_mtime_ns}
+
+
+def _is_current(file, db, dl_dir, keep_subdirs, remote_manifest,
+                local_manifest):
+    """
+    Determine whether the local copy of a database file matches the
+    remote manifest.
+
+    Local files which are not recorded in the local manifest, or which
+    were modified since they were recorded, are hashed and their
+    entries in `local_manifest` are updated. Files missing from the
+    remote manifest are compared by size with the remote file, as done
+    by `dl_pb_file`.
+
+    """
+    local_file = _local_file_name(file, dl_dir, keep_subdirs)
+    remote_digest = remote_manifest.get(file)
+
+    if not os.path.isfile(local_file):
+        return False
+    # No digest to compare against
+    if remote_digest is None:
+        url = posixpath.join(get_db_index_url(), db, file)
+        return os.path.getsize(local_file) == _remote_file_size(url)
+
+    entry = local_manifest.get(file)
+    stat = os.stat(local_file)
+    if (entry is None or entry['size'] != stat.st_size
+            or entry['mtime'] != stat.st_mtime_ns):
+        entry = _manifest_entry(local_file, _file_sha256(local_file))
+        local_manifest[file] = entry
+
+    return entry['sha256'] == remote_digest
+
+
+def _iter_content(url):
+    """
+    Stream the content of a remote file in chunks. Goes through the
+    context-local fetcher if one is set.
+    """
+    fetcher = _remote_fetcher.get()
+    if fetcher is not None:
+        yield fetcher('GET', url, None)
+        return
+
+    response = requests.get(url, stream=True,
+                            headers={'Accept-Encoding': 'identity'})
+    response.raise_for_status()
+    for chunk in response.iter_content(chunk_size=DL_CHUNK_SIZE):
+        yield chunk
+
+
+def dl_verified_file(inputs):
+    """
+    Download a file from physiobank, verifying its sha256 digest while
+    streaming it to disk.
+
+    The input args are to be unpacked for the use of multiprocessing
+    map. The file is written to a temporary file and only moved into
+    place once its content is verified.
+
+    Returns
+    -------
+    file : str
+        The path of the downloaded file relative to the database's base
+        directory.
+    digest : str
+        The hex sha256 digest of the downloaded content.
+
+    """
+    file, db, dl_dir, keep_subdirs, expected_digest = inputs
+
+    url = posixpath.join(get_db_index_url(), db, file)
+    local_file = _local_file_name(file, dl_dir, keep_subdirs)
+    part_file = local_file + '.part'
+
+    sha = hashlib.sha256()
+    with open(part_file, 'wb') as writefile:
+        for chunk in _iter_content(url):
+            sha.update(chunk)
+            writefile.write(chunk)
+
+    digest = sha.hexdigest()
+    if expected_digest is not None and digest != expected_digest:
+        os.remove(part_file)
+        raise ValueError('Checksum mismatch for downloaded file %s: expected %s, got %s'
+                         % (url, expected_digest, digest))
+    os.replace(part_file, local_file)
+
+    return file, digest
+
+
+def sync_files(db, dl_dir, files, keep_subdirs=True, overwrite=False,
+               remote_manifest=None, manifest_name=MANIFEST_NAME,
+               local_manifest=None):
+    """
+    Download the specified files of a Physiobank database which are
+    missing or changed locally, as determined by the database's
+    checksum manifest.
+
+    The delta is computed in one pass over the remote manifest and the
+    local manifest written by the previous sync, without querying the
+    server for each file. Files that need downloading are fetched in
+    parallel, and their sha256 digests are verified while streaming.
+
+    Parameters
+    ----------
+    db : str
+        The Physiobank database directory to download. eg. For database:
+        'http://physionet.org/physiobank/database/mitdb', db='mitdb'.
+    dl_dir : str
+        The full local directory path in which to download the files.
+    files : list
+        A list of strings specifying the file names to download relative
+        to the database base directory.
+    keep_subdirs : bool, optional
+        Whether to keep the relative subdirectories of downloaded files
+        as they are organized in Physiobank (True), or to download all
+        files into the same base directory (False).
+    overwrite : bool, optional
+        If True, all files will be redownloaded regardless.
+    remote_manifest : dict, optional
+        The database's manifest, as returned by `get_manifest`. Fetched
+        if not given.
+    manifest_name : str, optional
+        The name of the database's manifest file.
+    local_manifest : dict, optional
+        The local manifest read by `_rd_local_manifest`, possibly with
+        entries already updated by `_is_current`. Read from `dl_dir` if
+        not given.
+
+    Returns
+    -------
+    dl_files : list
+        The files which were downloaded.
+
+    Notes
+    -----
+    Files not listed in the remote manifest (or all files, if the
+    database has no manifest) are downloaded if they do not exist
+    locally, or if their size differs from that of the remote file.
+
+    The local manifest is stored as the file '.wfdb_manifest' in
+    `dl_dir`.
+
+    """
+    if remote_manifest is None:
+        remote_manifest = get_manifest(db, manifest_name) or {}
+    if local_manifest is None:
+        local_manifest = _rd_local_manifest(dl_dir)
+
+    # Drop stale entries of files which were removed locally
+    local_manifest = {f: e for f, e in local_manifest.items()
+        if os.path.isfile(_local_file_name(f, dl_dir, keep_subdirs))}
+
+    # Remove duplicates, preserving order
+    files = list(dict.fromkeys(files))
+
+    if overwrite:
+        dl_files = files
+    else:
+        dl_files = [file for file in files
+                    if not _is_current(file, db, dl_dir, keep_subdirs,
+                                       remote_manifest, local_manifest)]
+
+    dl_inputs = [(file, db, dl_dir, keep_subdirs, remote_manifest.get(file))
+                 for file in dl_files]
+
+    # Make any required local directories
+    make_local_dirs(dl_dir, [(None, posixpath.split(file)[0])
+                             for file in dl_files], keep_subdirs)
+
+    if dl_inputs:
+        print('Downloading %d changed files...' % len(dl_inputs))
+        # A context-local fetcher does not cross process boundaries
+        if _remote_fetcher.get() is not None:
+            results = [dl_verified_file(i) for i in dl_inputs]
+        else:
+            # Limit to 2 connections to avoid overloading the server
+            with multiprocessing.Pool(processes=2,
+                                      initializer=set_db_index_url,
+                                      initargs=(get_db_index_url(),)) as pool:
+                results = pool.map(dl_verified_file, dl_inputs)
+        for file, digest in results:
+            local_manifest[file] = _manifest_entry(
+                _local_file_name(file, dl_dir, keep_subdirs), digest)
+        print('Finished downloading files')
+    else:
+        print('All files are up to date')
+
+    _wr_local_manifest(dl_dir, local_manifest)
+
+    return dl_files
+
+
+def dl_files(db, dl_dir, files, keep_subdirs=True, overwrite=False,
+             use_manifest=False):
     """
     Download specified files from a Physiobank database.
 
@@ -394,6 +956,10 @@ def dl_files(db, dl_dir, files, keep_subdirs=True, overwrite=False):
         will be redownloaded. If the local file is smaller, the file will be
         assumed to be partially downloaded and the remaining bytes will be
         downloaded and appended.
+    use_manifest : bool, optional
+        If True, the database's checksum manifest is used to only download
+        the files which are missing or whose content changed since the last
+        sync, verifying each downloaded file's digest. See `sync_files`.
 
     Examples
     --------
@@ -404,11 +970,15 @@ def dl_files(db, dl_dir, files, keep_subdirs=True, overwrite=False):
     """
 
     # Full url physiobank database
-    db_url = posixpath.join(config.db_index_url, db)
+    db_url = posixpath.join(get_db_index_url(), db)
     # Check if the database is valid
     response = requests.get(db_url)
     response.raise_for_status()
 
+    if use_manifest:
+        sync_files(db, dl_dir, files, keep_subdirs, overwrite)
+        return
+
     # Construct the urls to download
     dl_inputs = [(os.path.split(file)[1], os.path.split(file)[0], db, dl_dir, keep_subdirs, overwrite) for file in files]
 
@@ -418,7 +988,8 @@ def dl_files(db, dl_dir, files, keep_subdirs=True, overwrite=False):
     print('Downloading files...')
     # Create multiple processes to download files.
     # Limit to 2 connections to avoid overloading the server
-    pool = multiprocessing.Pool(processes=2)
+    pool = multiprocessing.Pool(processes=2, initializer=set_db_index_url,
+                                initargs=(get_db_index_url(),))
     pool.map(dl_pb_file, dl_inputs)
     print('Finished downloading files')
 
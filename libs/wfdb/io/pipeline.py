@@ -0,0 +1,267 @@
+"""
+Pipelined reading of remote Physiobank records.
+
+Reading a remote record with `rdrecord` and `rdann` performs its
+requests one after the other: the header, the dat file size if the
+signal length is missing, each dat file, then each annotation file and
+the header again for the sampling frequency. The functions in this
+module issue all the requests of a record concurrently once its header
+is known, and can prefetch the next records of a database while the
+current one is being processed.
+
+"""
+import collections
+import concurrent.futures
+import contextvars
+import posixpath
+
+from . import _signal
+from . import annotation
+from . import download
+from . import record
+
+
+# The maximum number of concurrent remote requests per record
+REQUEST_WORKERS = 8
+
+
+def _split_record_name(record_name, pb_dir):
+    """
+    Move the subdirectory of a record name relative to `pb_dir` into
+    the Physiobank directory, as expected by the reading functions.
+    """
+    dir_name, base_record_name = posixpath.split(record_name)
+    return base_record_name, posixpath.join(pb_dir, dir_name)
+
+
+def _fetch_all(requests, store, executor):
+    """
+    Perform the (method, url, byte_range) requests concurrently, and
+    add their content, or their errors, to `store`.
+    """
+    do_request = download._remote_fetcher.get() or download._do_request
+    futures = [(r, executor.submit(do_request, *r))
+               for r in requests if r not in store]
+    for request, future in futures:
+        try:
+            store[request] = future.result()
+        except Exception as e:
+            store[request] = e
+
+
+def _read_from_store(store, func, *args, **kwargs):
+    """
+    Run a reading function, serving its remote requests from `store`.
+    Requests which were not fetched ahead are performed directly.
+    """
+    do_request = download._remote_fetcher.get() or download._do_request
+
+    def fetcher(method, url, byte_range):
+        request = (method, url, byte_range)
+        if request not in store:
+            store[request] = do_request(method, url, byte_range)
+        if isinstance(store[request], Exception):
+            raise store[request]
+        return store[request]
+
+    token = download._remote_fetcher.set(fetcher)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        download._remote_fetcher.reset(token)
+
+
+def _fetch_record(record_name, pb_dir, ann_extensions, sampfrom, sampto,
+                  channels, channel_names, ignore_skew, executor):
+    """
+    Fetch the remote content needed to read a record and its
+    annotations.
+
+    Returns
+    -------
+    store : dict
+        The content of each (method, url, byte_range) request.
+
+    """
+    store = {}
+    hea_url = download._file_url(pb_dir, record_name + '.hea')
+
+    # The header and the annotation files are independent
+    requests = [('GET', hea_url, None)]
+    for extension in ann_extensions:
+        requests.append(('GET', download._file_url(
+            pb_dir, record_name + '.' + extension), None))
+    _fetch_all(requests, store, executor)
+
+    if isinstance(store[('GET', hea_url, None)], Exception):
+        return store
+
+    header = _read_from_store(store, record.rdheader, record_name,
+                              pb_dir=pb_dir)
+    if not isinstance(header, record.Record) or not header.n_sig:
+        return store
+
+    # The signal length must be inferred from the first dat file's size
+    if header.sig_len is None and sampto is None:
+        _fetch_all([('HEAD', download._file_url(pb_dir, header.file_name[0]),
+                     None)], store, executor)
+        header.sig_len = _read_from_store(
+            store, _signal._infer_sig_len, file_name=header.file_name[0],
+            fmt=header.fmt[0],
+            n_sig=header.file_name.count(header.file_name[0]),
+            dir_name='', pb_dir=pb_dir)
+
+    _fetch_all(_signal._dat_requests(header, pb_dir, sampfrom, sampto,
+                                     channels, channel_names, ignore_skew),
+               store, executor)
+
+    return store
+
+
+def _read_record(record_name, pb_dir, ann_extensions, store, rd_kwargs):
+    """
+    Read a record and its annotations from the fetched content.
+    """
+    rec = _read_from_store(store, record.rdrecord, record_name,
+                           pb_dir=pb_dir, **rd_kwargs)
+    annotations = [_read_from_store(store, annotation.rdann, record_name,
+                                    extension, pb_dir=pb_dir)
+                   for extension in ann_extensions]
+    return rec, annotations
+
+
+def rdrecord_remote(record_name, pb_dir, ann_extensions=None, sampfrom=0,
+                    sampto=None, channels=None, physical=True, m2s=True,
+                    smooth_frames=True, ignore_skew=False, return_res=64,
+                    force_channels=True, channel_names=None,
+                    warn_empty=False):
+    """
+    Read a remote WFDB record and optionally its annotations, issuing
+    the requests concurrently once the header is known.
+
+    Parameters
+    ----------
+    record_name : str
+        The name of the WFDB record to be read, without any file
+        extensions, relative to `pb_dir`.
+    pb_dir : str
+        The Physiobank database directory from which to find the
+        required record files. eg. For record '100' in
+        'http://physionet.org/physiobank/database/mitdb', pb_dir='mitdb'.
+    ann_extensions : list, optional
+        The extensions of the annotation files to read along with the
+        record.
+    * other params
+        See `rdrecord`.
+
+    Returns
+    -------
+    record : Record or MultiRecord
+        The record, as returned by `rdrecord`.
+    annotations : list
+        The Annotation objects, one per element of `ann_extensions`.
+
+    Examples
+    --------
+    >>> record, (ann,) = wfdb.rdrecord_remote('100', 'mitdb',
+                                              ann_extensions=['atr'])
+
+    """
+    rd_kwargs = dict(sampfrom=sampfrom, sampto=sampto, channels=channels,
+                     physical=physical, m2s=m2s, smooth_frames=smooth_frames,
+                     ignore_skew=ignore_skew, return_res=return_res,
+                     force_channels=force_channels,
+                     channel_names=channel_names, warn_empty=warn_empty)
+    ann_extensions = list(ann_extensions or [])
+    record_name, pb_dir = _split_record_name(record_name, pb_dir)
+
+    with concurrent.futures.ThreadPoolExecutor(REQUEST_WORKERS) as executor:
+        store = _fetch_record(record_name, pb_dir, ann_extensions, sampfrom,
+                              sampto, channels, channel_names, ignore_skew,
+                              executor)
+
+    return _read_record(record_name, pb_dir, ann_extensions, store,
+                        rd_kwargs)
+
+
+def iter_records(pb_dir, records='all', ann_extensions=None, prefetch=2,
+                 **kwargs):
+    """
+    Iterate over the remote records of a Physiobank database, reading
+    each record and optionally its annotations, while prefetching the
+    content of the next records.
+
+    Parameters
+    ----------
+    pb_dir : str
+        The Physiobank database directory.
+    records : list, or 'all', optional
+        The records to read. Leave as 'all' to read all records listed
+        in the database's RECORDS file.
+    ann_extensions : list, optional
+        The extensions of the annotation files to read along with each
+        record.
+    prefetch : int, optional
+        The number of records whose content is fetched ahead of the
+        record being read. Set to 0 to disable prefetching.
+    kwargs : dict, optional
+        The `rdrecord` options to read each record with, see
+        `rdrecord_remote`.
+
+    Yields
+    ------
+    record_name : str
+        The name of the record.
+    record : Record or MultiRecord
+        The record.
+    annotations : list
+        The Annotation objects, one per element of `ann_extensions`.
+
+    Examples
+    --------
+    >>> for record_name, record, (ann,) in wfdb.iter_records(
+            'mitdb', ann_extensions=['atr'], channels=[0]):
+            pass
+
+    """
+    record_list = download.get_record_list(pb_dir, records)
+    ann_extensions = list(ann_extensions or [])
+    rd_kwargs = dict(kwargs)
+    plan_kwargs = [rd_kwargs.get(k) for k in ['sampfrom', 'sampto',
+                                              'channels', 'channel_names',
+                                              'ignore_skew']]
+    plan_kwargs[0] = plan_kwargs[0] or 0
+    plan_kwargs[4] = bool(plan_kwargs[4])
+
+    request_executor = concurrent.futures.ThreadPoolExecutor(REQUEST_WORKERS)
+    record_executor = concurrent.futures.ThreadPoolExecutor(max(prefetch, 1))
+    pending = collections.deque()
+    record_iter = iter(record_list)
+
+    def submit_next():
+        for record_name in record_iter:
+            base_record_name, rec_pb_dir = _split_record_name(record_name,
+                                                              pb_dir)
+            # Run in the caller's context, for the database index url
+            context = contextvars.copy_context()
+            pending.append((record_name, base_record_name, rec_pb_dir,
+                            record_executor.submit(
+                context.run, _fetch_record, base_record_name, rec_pb_dir,
+                ann_extensions, *plan_kwargs, executor=request_executor)))
+            return
+
+    try:
+        for _ in range(prefetch + 1):
+            submit_next()
+        while pending:
+            record_name, base_record_name, rec_pb_dir, future = pending.popleft()
+            store = future.result()
+            submit_next()
+            rec, annotations = _read_record(base_record_name, rec_pb_dir,
+                                            ann_extensions, store, rd_kwargs)
+            yield record_name, rec, annotations
+    finally:
+        for pending_record in pending:
+            pending_record[-1].cancel()
+        record_executor.shutdown(wait=True)
+        request_executor.shutdown(wait=True)
@@ -1140,6 +1140,10 @@ def rdrecord(record_name, sampfrom=0, sampto=None, channels=None,
     for the common purpose of extracting the physical signals and a few
     important descriptor fields.
 
+    This function keeps no shared state between calls, and can be
+    called concurrently from multiple threads. To stream from different
+    database index urls concurrently, see `download.use_db_index_url`.
+
     Examples
     --------
     >>> record = wfdb.rdrecord('sample-data/test01_00s', sampfrom=800,
@@ -1559,7 +1563,7 @@ def is_monotonic(full_list):
     return True
 
 def dl_database(db_dir, dl_dir, records='all', annotators='all',
-                keep_subdirs=True, overwrite=False):
+                keep_subdirs=True, overwrite=False, use_manifest=False):
     """
     Download WFDB record (and optionally annotation) files from a
     Physiobank database. The database must contain a 'RECORDS' file in
@@ -1599,14 +1603,25 @@ def dl_database(db_dir, dl_dir, records='all', annotators='all',
         file is smaller, the file will be assumed to be partially
         downloaded and the remaining bytes will be downloaded and
         appended.
+    use_manifest : bool, optional
+        If True, the database's checksum manifest is used to perform an
+        incremental sync: only files which are missing locally or whose
+        content changed since the last sync are downloaded, and each
+        downloaded file's checksum is verified. The existence of
+        annotation files is looked up in the manifest, and headers
+        which are already current are read from `dl_dir` instead of
+        being fetched. Falls back to the default behaviour if the
+        database has no manifest.
 
     Examples
     --------
     >>> wfdb.dl_database('ahadb', os.getcwd())
 
+    >>> wfdb.dl_database('mitdb', os.getcwd(), use_manifest=True)
+
     """
     # Full url physiobank database
-    db_url = posixpath.join(download.config.db_index_url, db_dir)
+    db_url = posixpath.join(download.get_db_index_url(), db_dir)
     # Check if the database is valid
     r = requests.get(db_url)
     r.raise_for_status()
@@ -1616,6 +1631,26 @@ def dl_database(db_dir, dl_dir, records='all', annotators='all',
     # Get the annotator extensions
     annotators = download.get_annotators(db_dir, annotators)
 
+    manifest = None
+    if use_manifest:
+        manifest = download.get_manifest(db_dir)
+        local_manifest = download._rd_local_manifest(dl_dir)
+
+    def read_header(dir_name, rec_name):
+        """
+        Read a header from the local copy if it is known to be current,
+        or from Physiobank otherwise.
+        """
+        hea_file = posixpath.join(dir_name, rec_name + '.hea')
+        if (manifest is not None and not overwrite
+                and download._is_current(hea_file, db_dir, dl_dir,
+                                         keep_subdirs, manifest,
+                                         local_manifest)):
+            local_file = download._local_file_name(hea_file, dl_dir,
+                                                   keep_subdirs)
+            return rdheader(local_file[:-4])
+        return rdheader(rec_name, pb_dir=posixpath.join(db_dir, dir_name))
+
     # All files to download (relative to the database's home directory)
     allfiles = []
 
@@ -1630,7 +1665,7 @@ def dl_database(db_dir, dl_dir, records='all', annotators='all',
             # If MIT format, have to figure out all associated files
             allfiles.append(rec+'.hea')
             dir_name, baserecname = os.path.split(rec)
-            record = rdheader(baserecname, pb_dir=posixpath.join(db_dir, dir_name))
+            record = read_header(dir_name, baserecname)
 
             # Single segment record
             if isinstance(record, Record):
@@ -1650,19 +1685,30 @@ def dl_database(db_dir, dl_dir, records='all', annotators='all',
                     if seg.endswith('_layout'):
                         continue
                     # Add all dat files of the segment
-                    recseg = rdheader(seg, pb_dir=posixpath.join(db_dir, dir_name))
+                    recseg = read_header(dir_name, seg)
                     for file in recseg.file_name:
                         allfiles.append(posixpath.join(dir_name, file))
         # check whether the record has any requested annotation files
         if annotators is not None:
             for a in annotators:
                 annfile = rec+'.'+a
-                url = posixpath.join(download.config.db_index_url, db_dir, annfile)
+                if manifest is not None:
+                    if annfile in manifest:
+                        allfiles.append(annfile)
+                    continue
+
+                url = posixpath.join(download.get_db_index_url(), db_dir, annfile)
                 rh = requests.head(url)
 
                 if rh.status_code != 404:
                     allfiles.append(annfile)
 
+    if manifest is not None:
+        download.sync_files(db_dir, dl_dir, allfiles, keep_subdirs,
+                            overwrite, remote_manifest=manifest,
+                            local_manifest=local_manifest)
+        return
+
     dlinputs = [(os.path.split(file)[1], os.path.split(file)[0], db_dir, dl_dir, keep_subdirs, overwrite) for file in allfiles]
 
     # Make any required local directories
@@ -1671,7 +1717,9 @@ def dl_database(db_dir, dl_dir, records='all', annotators='all',
     print('Downloading files...')
     # Create multiple processes to download files.
     # Limit to 2 connections to avoid overloading the server
-    pool = multiprocessing.Pool(processes=2)
+    pool = multiprocessing.Pool(
+        processes=2, initializer=download.set_db_index_url,
+        initargs=(download.get_db_index_url(),))
     pool.map(download.dl_pb_file, dlinputs)
     print('Finished downloading files')
 
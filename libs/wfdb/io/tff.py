@@ -9,6 +9,11 @@ import os
 import struct
 
 import numpy as np
+import pandas as pd
+
+from . import _signal
+from . import annotation
+from . import record
 
 
 def rdtff(file_name, cut_end=False):
@@ -37,10 +42,9 @@ def rdtff(file_name, cut_end=False):
 
     Notes
     -----
-    This function is slow because tff files may contain any number of
-    escape sequences interspersed with the signals. There is no way to
-    know the number of samples/escape sequences beforehand, so the file
-    is inefficiently parsed a small chunk at a time.
+    tff files may contain any number of escape sequences interspersed
+    with the signals. The whole file is read into memory, and the escape
+    sequences are located and removed with numpy operations.
 
     It is recommended that you convert your tff files to wfdb format.
 
@@ -57,6 +61,167 @@ def rdtff(file_name, cut_end=False):
     return signal, fields, markers, triggers
 
 
+# The annotation labels of the markers and triggers written by tff2wfdb
+TFF_ANN_LABELS = pd.DataFrame({'label_store': [42, 43],
+                               'symbol': ['M', 'G'],
+                               'description': ['Marker', 'Trigger']})
+
+
+def tff2wfdb(file_name, record_name, fmt='16', write_dir='', cut_end=False,
+             ann_extension='tff', chunk_size=16777216):
+    """
+    Convert a tff file into a WFDB record, reading and writing the
+    signal a chunk at a time.
+
+    The samples are written unchanged, with an adc gain of 1. Unsigned
+    samples are offset to be centered around 0, with the baseline set
+    to preserve their physical values. The markers and triggers are
+    written as an annotation file, with the custom labels defined in
+    `TFF_ANN_LABELS`.
+
+    Parameters
+    ----------
+    file_name : str
+        Name of the .tff file to convert.
+    record_name : str
+        The name of the WFDB record to write.
+    fmt : str, optional
+        The WFDB format of the dat file. Must be able to store the
+        resolution of the tff samples.
+    write_dir : str, optional
+        The directory in which to write the record files.
+    cut_end : bool, optional
+        If True, cuts out the last sample for all channels. See
+        `rdtff`.
+    ann_extension : str, optional
+        The extension of the annotation file with the markers and
+        triggers. The file is only written if the tff file contains any.
+    chunk_size : int, optional
+        The number of bytes of the tff file read at a time.
+
+    Returns
+    -------
+    sig_len : int
+        The number of samples per channel written.
+
+    Examples
+    --------
+    >>> wfdb.io.tff2wfdb('sample-data/03700181.tff', '03700181')
+
+    """
+    file_size = os.path.getsize(file_name)
+    with open(file_name, 'rb') as fp:
+        fields, file_fields = _rdheader(fp)
+        n_sig = file_fields['n_sig']
+        bit_width = file_fields['bit_width']
+        if fmt not in ['80', '212', '16', '24', '32']:
+            raise ValueError('This library currently only supports writing the following formats: 80, 212, 16, 24, 32')
+        if _signal._fmt_res(fmt) < bit_width:
+            raise ValueError('Format %s cannot store the %d bit tff samples'
+                             % (fmt, bit_width))
+
+        dtype = _sample_dtype(bit_width, file_fields['is_signed'])
+        frame_size = n_sig * dtype.itemsize
+        # The offset applied to unsigned samples
+        offset = 0 if file_fields['is_signed'] else 2 ** (bit_width - 1)
+
+        # Format 212 writes sample pairs, so blocks with an odd number of
+        # samples can't be written separately.
+        frame_multiple = 2 if fmt == '212' and n_sig % 2 else 1
+
+        dat_name = record_name + '.dat'
+        sig_len = 0
+        init_value = None
+        checksum = np.zeros(n_sig, dtype='int64')
+        ann_writer = None
+
+        fp.seek(file_fields['header_size'])
+        remaining_bytes = file_size - file_fields['header_size']
+        data = np.empty(0, dtype='u1')
+        frames = np.empty((0, n_sig), dtype='int64')
+
+        with open(os.path.join(write_dir, dat_name), 'wb') as dat_file:
+            try:
+                while True:
+                    chunk = np.fromfile(fp, dtype='u1',
+                                        count=min(chunk_size, remaining_bytes))
+                    remaining_bytes -= len(chunk)
+                    final = remaining_bytes == 0
+                    data = np.concatenate((data, chunk))
+
+                    if final and cut_end:
+                        stop = len(data) - frame_size + 1
+                    else:
+                        stop = len(data)
+                    (escape_starts, escape_ends, escape_types,
+                     parse_end) = _find_escapes(data, frame_size, stop, final)
+
+                    if parse_end > len(data):
+                        raise ValueError('The tff file ends with an incomplete sample frame. '
+                                         'Set cut_end=True to convert it without the last frame.')
+
+                    # Write the markers and triggers at their sample
+                    # numbers, counting the frames pending to be written
+                    escape_frames = (_escape_frames(escape_starts,
+                                                    escape_ends, frame_size)
+                                     + sig_len + len(frames))
+                    is_event = (escape_types == 1) | (escape_types == 2)
+                    if is_event.any():
+                        if ann_writer is None:
+                            ann_writer = annotation.AnnotationWriter(
+                                record_name, ann_extension, fs=fields['fs'],
+                                custom_labels=TFF_ANN_LABELS.copy(),
+                                write_dir=write_dir)
+                        ann_writer.write(
+                            escape_frames[is_event],
+                            label_store=TFF_ANN_LABELS['label_store'].values[
+                                escape_types[is_event] - 1])
+
+                    new_frames = _rm_escapes(data[:parse_end], escape_starts,
+                                             escape_ends)
+                    new_frames = new_frames.view(dtype).reshape((-1, n_sig))
+                    frames = np.concatenate((frames, new_frames.astype('int64')
+                                             - offset))
+                    data = data[parse_end:]
+
+                    # Encode and write the frames
+                    if final:
+                        n_write = len(frames)
+                    else:
+                        n_write = len(frames) - len(frames) % frame_multiple
+                    if n_write:
+                        write_frames = frames[:n_write]
+                        if init_value is None:
+                            init_value = write_frames[0]
+                        checksum += np.sum(write_frames, axis=0)
+                        _signal._dat_bytes(write_frames, fmt).tofile(dat_file)
+                        sig_len += n_write
+                        frames = frames[n_write:]
+
+                    if final:
+                        break
+            finally:
+                if ann_writer is not None:
+                    ann_writer.close()
+
+    if init_value is None:
+        init_value = np.zeros(n_sig, dtype='int64')
+
+    rec = record.Record(record_name=record_name, n_sig=n_sig,
+                        fs=fields['fs'], sig_len=sig_len,
+                        base_time=fields['base_time'],
+                        base_date=fields['base_date'],
+                        file_name=[dat_name] * n_sig, fmt=[fmt] * n_sig,
+                        adc_gain=[1.] * n_sig, baseline=[-offset] * n_sig,
+                        units=['NU'] * n_sig, sig_name=fields['sig_name'],
+                        init_value=[int(v) for v in init_value],
+                        checksum=[int(c) for c in checksum % 65536])
+    rec.set_defaults()
+    rec.wrheader(write_dir=write_dir)
+
+    return sig_len
+
+
 def _rdheader(fp):
     """
     Read header info of the windaq file
@@ -149,74 +314,176 @@ def _rdsignal(fp, file_size, header_size, n_sig, bit_width, is_signed, cut_end):
         If True, enables reading the end of files which appear to terminate
         with the incorrect number of samples (ie. sample not present for all channels),
         by checking and skipping the reading the end of such files.
-        Checking this option makes reading slower.
+
+    Notes
+    -----
+    The signal bytes are read at once, and the escape sequences
+    interspersed with the sample frames are located with numpy and
+    removed.
+
     """
-    # Cannot initially figure out signal length because there
-    # are escape sequences.
     fp.seek(header_size)
-    signal_size = file_size - header_size
-    byte_width = int(bit_width / 8)
-    # numpy dtype
-    dtype = str(byte_width)
-    if is_signed:
-        dtype = 'i' + dtype
-    else:
-        dtype = 'u' + dtype
-    # big endian
-    dtype = '>' + dtype
-    # The maximum possible samples given the file size
-    # All channels must be present
-    max_samples = int(signal_size / byte_width)
-    max_samples = max_samples - max_samples % n_sig
-    # Output information
-    signal = np.empty(max_samples, dtype=dtype)
-    markers = []
-    triggers = []
-    # Number of (total) samples read
-    sample_num = 0
-
-    # Read one sample for all channels at a time
+    data = np.fromfile(fp, dtype='u1', count=file_size - header_size)
+
+    dtype = _sample_dtype(bit_width, is_signed)
+    frame_size = n_sig * dtype.itemsize
+
+    # With cut_end, stop before the last incomplete frame
     if cut_end:
-        stop_byte = file_size - n_sig * byte_width + 1
-        while fp.tell() < stop_byte:
-            chunk = fp.read(2)
-            sample_num = _get_sample(fp, chunk, n_sig, dtype, signal, markers, triggers, sample_num)
+        stop = len(data) - frame_size + 1
     else:
-        while True:
-            chunk = fp.read(2)
-            if not chunk:
-                break
-            sample_num = _get_sample(fp, chunk, n_sig, dtype, signal, markers, triggers, sample_num)
+        stop = len(data)
+
+    (escape_starts, escape_ends, escape_types,
+     parse_end) = _find_escapes(data, frame_size, stop, final=True)
+
+    if parse_end > len(data):
+        raise ValueError('The tff file ends with an incomplete sample frame. '
+                         'Set cut_end=True to read it without the last frame.')
+
+    signal = _rm_escapes(data[:parse_end], escape_starts, escape_ends)
+    signal = signal.view(dtype).reshape((-1, n_sig))
+
+    # The frame index at which each escape sequence occurs
+    escape_frames = _escape_frames(escape_starts, escape_ends, frame_size)
+    markers = escape_frames[escape_types == 1].astype('int')
+    triggers = escape_frames[escape_types == 2].astype('int')
 
-    # No more bytes to read. Reshape output arguments.
-    signal = signal[:sample_num]
-    signal = signal.reshape((-1, n_sig))
-    markers = np.array(markers, dtype='int')
-    triggers = np.array(triggers, dtype='int')
     return signal, markers, triggers
 
 
-def _get_sample(fp, chunk, n_sig, dtype, signal, markers, triggers, sample_num):
-    tag = struct.unpack('>h', chunk)[0]
-    # Escape sequence
-    if tag == -32768:
-        # Escape sequence structure: int16 marker, uint8 type,
-        # uint8 length, uint8 * length data, padding % 2
-        escape_type = struct.unpack('B', fp.read(1))[0]
-        data_len = struct.unpack('B', fp.read(1))[0]
-        # Marker*
-        if escape_type == 1:
-            # *In manual mode, this could be block start/top time.
-            # But we are it is just a single time marker.
-            markers.append(sample_num / n_sig)
-        # Trigger
-        elif escape_type == 2:
-            triggers.append(sample_num / n_sig)
-        fp.seek(data_len + data_len % 2, 1)
-    # Regular samples
-    else:
-        fp.seek(-2, 1)
-        signal[sample_num:sample_num + n_sig] = np.fromfile(
-            fp, dtype=dtype, count=n_sig)
-        sample_num += n_sig
-    return sample_num
+def _sample_dtype(bit_width, is_signed):
+    """
+    Get the numpy dtype of the big endian samples.
+    """
+    byte_width = int(bit_width / 8)
+    if is_signed:
+        return np.dtype('>i%d' % byte_width)
+    return np.dtype('>u%d' % byte_width)
+
+
+def _find_escapes(data, frame_size, stop, final):
+    """
+    Locate the escape sequences among the sample frames of the signal
+    bytes.
+
+    Each sample frame or escape sequence follows the previous one. An
+    escape sequence starts with the int16 tag -32768, followed by the
+    uint8 type, the uint8 data length, the data, and a padding byte for
+    odd lengths. The tag is only checked for at the start of each
+    frame, so the positions of the tag bytes which are frame aligned
+    are the escape sequences.
+
+    Parameters
+    ----------
+    data : numpy array
+        The signal bytes, as uint8.
+    frame_size : int
+        The number of bytes in each sample frame.
+    stop : int
+        The byte position from which no further frames or escape
+        sequences start.
+    final : bool
+        Whether `data` holds the end of the signal. If False, only the
+        frames and escape sequences complete within `data` are parsed,
+        so that the remaining bytes can be parsed with the following
+        bytes of the signal.
+
+    Returns
+    -------
+    escape_starts, escape_ends : numpy array
+        The byte positions of the start and end of each escape
+        sequence.
+    escape_types : numpy array
+        The type of each escape sequence.
+    parse_end : int
+        The byte position following the last frame or escape sequence
+        parsed. If `final` is True, this exceeds the length of `data`
+        when it ends with an incomplete frame.
+
+    """
+    n_bytes = len(data)
+    if not final:
+        # The tag of a frame starting at the last byte is unknown
+        stop = min(stop, n_bytes - 1)
+
+    # The positions of all tag bytes, most of which are sample values
+    tag_inds = np.flatnonzero((data[:-1] == 128) & (data[1:] == 0))
+    tag_inds = tag_inds[tag_inds < stop]
+
+    escape_starts, escape_ends, escape_types = [], [], []
+    pos = 0
+    while True:
+        # Find the next frame aligned tag, searching blocks of tag
+        # positions of increasing size.
+        i = np.searchsorted(tag_inds, pos)
+        block_size = 64
+        escape_start = None
+        while i < len(tag_inds):
+            block = tag_inds[i:i + block_size]
+            aligned = np.flatnonzero((block - pos) % frame_size == 0)
+            if len(aligned):
+                escape_start = int(block[aligned[0]])
+                break
+            i += block_size
+            block_size *= 2
+
+        if escape_start is None:
+            break
+
+        if escape_start + 4 > n_bytes:
+            if final:
+                raise ValueError('The tff file ends with an incomplete escape sequence.')
+            pos = escape_start
+            break
+        data_len = int(data[escape_start + 3])
+        escape_end = escape_start + 4 + data_len + data_len % 2
+        if escape_end > n_bytes:
+            if not final:
+                pos = escape_start
+                break
+            escape_end = n_bytes
+
+        escape_starts.append(escape_start)
+        escape_ends.append(escape_end)
+        escape_types.append(data[escape_start + 2])
+        pos = escape_end
+
+    if escape_start is None:
+        # The frames following the last escape sequence
+        if final:
+            n_frames = max(stop - pos + frame_size - 1, 0) // frame_size
+        else:
+            n_frames = max(min(stop + frame_size - 1, n_bytes) - pos,
+                           0) // frame_size
+        pos += n_frames * frame_size
+
+    return (np.array(escape_starts, dtype='int64'),
+            np.array(escape_ends, dtype='int64'),
+            np.array(escape_types, dtype='u1'), pos)
+
+
+def _rm_escapes(data, escape_starts, escape_ends):
+    """
+    Remove the escape sequences from the signal bytes, keeping the
+    sample frames.
+    """
+    if not len(escape_starts):
+        return np.array(data)
+
+    # Mark the bounds of the escape sequences, which don't overlap
+    bounds = np.zeros(len(data) + 1, dtype='int8')
+    bounds[escape_starts] += 1
+    bounds[escape_ends] -= 1
+    keep = np.cumsum(bounds[:-1]) == 0
+
+    return data[keep]
+
+
+def _escape_frames(escape_starts, escape_ends, frame_size):
+    """
+    Get the index of the sample frame following each escape sequence.
+    """
+    escape_sizes = escape_ends - escape_starts
+    removed = np.cumsum(escape_sizes) - escape_sizes
+    return (escape_starts - removed) // frame_size
@@ -3,4 +3,5 @@ from .basic import (resample_ann, resample_sig, resample_singlechan,
 from .evaluate import Comparitor, compare_annotations, benchmark_mitdb
 from .hr import compute_hr, calc_rr, calc_mean_hr
 from .peaks import find_peaks, find_local_peaks, correct_peaks
-from .qrs import XQRS, xqrs_detect, gqrs_detect
+from .qrs import (XQRS, XQRSStream, xqrs_detect, xqrs_detect_batch,
+                  xqrs_detect_records, gqrs_detect)
@@ -1,5 +1,6 @@
 import copy
 import numpy as np
+from scipy import ndimage
 
 from .basic import smooth
 
@@ -39,24 +40,20 @@ def find_peaks(sig):
     tmp = tmp-tmp2
 
     hard_peaks = np.where(np.logical_or(tmp==-2, tmp==+2))[0] + 1
-    soft_peaks = []
-
-    for iv in np.where(np.logical_or(tmp==-1,tmp==+1))[0]:
-        t = tmp[iv]
-        i = iv+1
-        while True:
-            if i==len(tmp) or tmp[i] == -t or tmp[i] == -2 or tmp[i] == 2:
-                break
-            if tmp[i] == t:
-                soft_peaks.append(int(iv + (i - iv)/2))
-                break
-            i += 1
-    soft_peaks = np.array(soft_peaks, dtype='int') + 1
+
+    # Run-length encode the slope changes. A soft peak is the middle of
+    # a flat run started by a +-1 change and ended by the same change.
+    change_inds = np.where(tmp != 0)[0]
+    changes = tmp[change_inds]
+    is_soft = np.logical_and(np.abs(changes[:-1]) == 1,
+                             changes[1:] == changes[:-1])
+    soft_peaks = (change_inds[:-1][is_soft]
+                  + change_inds[1:][is_soft]).astype('int') // 2 + 1
 
     return hard_peaks, soft_peaks
 
 
-def find_local_peaks(sig, radius):
+def find_local_peaks(sig, radius, axis=0):
     """
     Find all local peaks in a signal. A sample is a local peak if it is
     the largest value within the <radius> samples on its left and right.
@@ -67,40 +64,74 @@ def find_local_peaks(sig, radius):
     Parameters
     ----------
     sig : numpy array
-        1d numpy array of the signal.
+        1d numpy array of the signal, or 2d numpy array of signals.
     radius : int
         The radius in which to search for defining local maxima.
+    axis : int, optional
+        The axis along which to search for local maxima, if `sig` is
+        2d.
+
+    Returns
+    -------
+    peak_inds : numpy array, or list
+        The indices of the local peaks. If `sig` is 2d, a list of
+        arrays, one for each signal along `axis`.
+
+    Notes
+    -----
+    The samples equal to the maximum of the window spanning `radius`
+    samples on their left and `radius - 1` samples on their right are
+    candidates, found with a sliding window maximum. Going from left to
+    right, a candidate less than `radius` samples after the previous
+    peak is skipped.
 
     """
-    # TODO: Fix flat mountain scenarios.
-    if np.min(sig) == np.max(sig):
-        return np.empty(0)
+    if radius < 1:
+        raise ValueError('radius must be a positive integer')
 
-    peak_inds = []
+    sig = np.asarray(sig)
+    if sig.ndim == 2:
+        sig = np.moveaxis(sig, axis, 0)
+        window_max = ndimage.maximum_filter1d(sig, size=2 * radius, axis=0,
+                                              mode='nearest')
+        return [_local_peak_inds(sig[:, ch], window_max[:, ch], radius)
+                for ch in range(sig.shape[1])]
+    elif sig.ndim != 1:
+        raise ValueError('sig must be a 1d or 2d numpy array')
 
-    i = 0
-    while i < radius + 1:
-        if sig[i] == max(sig[:i + radius]):
-            peak_inds.append(i)
-            i += radius
-        else:
-            i += 1
+    window_max = ndimage.maximum_filter1d(sig, size=2 * radius,
+                                          mode='nearest')
+    return _local_peak_inds(sig, window_max, radius)
 
-    while i < len(sig):
-        if sig[i] == max(sig[i - radius:i + radius]):
-            peak_inds.append(i)
-            i += radius
-        else:
-            i += 1
 
-    while i < len(sig):
-        if sig[i] == max(sig[i - radius:]):
-            peak_inds.append(i)
-            i += radius
+def _local_peak_inds(sig, window_max, radius):
+    """
+    Get the local peak indices of a 1d signal, given the maximum of the
+    window around each sample. Helper function for `find_local_peaks`.
+    """
+    # TODO: Fix flat mountain scenarios.
+    if np.min(sig) == np.max(sig):
+        return np.empty(0)
+
+    peak_inds = np.flatnonzero(sig == window_max)
+
+    # Candidates closer than radius to each other share the same value.
+    # Only these can be skipped, so only these are inspected one by one.
+    close = np.diff(peak_inds) < radius
+    if not close.any():
+        return peak_inds
+
+    keep = np.ones(len(peak_inds), dtype='bool')
+    for k in np.flatnonzero(close) + 1:
+        # The previous candidate is a peak unless it was itself close
+        if k == 1 or not close[k - 2]:
+            last_peak_ind = peak_inds[k - 1]
+        if peak_inds[k] >= last_peak_ind + radius:
+            last_peak_ind = peak_inds[k]
         else:
-            i += 1
+            keep[k] = False
 
-    return (np.array(peak_inds))
+    return peak_inds[keep]
 
 
 def correct_peaks(sig, peak_inds, search_radius, smooth_window_size,
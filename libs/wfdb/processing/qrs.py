@@ -1,9 +1,17 @@
-import copy
+import array
+import functools
+import multiprocessing
+from multiprocessing import shared_memory, util
 import pdb
+import time
 
 import numpy as np
 from scipy import signal
 from sklearn.preprocessing import normalize
+try:
+    import numba
+except ImportError:
+    numba = None
 
 from .basic import get_filter_gain
 from .peaks import find_local_peaks
@@ -36,9 +44,8 @@ class XQRS(object):
       the mwi signal. For each local maxima:
 
       - Check if it is a qrs complex. To be classified as a qrs,
-        it must come after the refractory period, cross the qrs
-        detection threshold, and not be classified as a t-wave
-        if it comes close enough to the previous qrs. If
+        it must come after the refractory period and cross the qrs
+        detection threshold. Peaks are not inspected for t-waves. If
         successfully classified, update running detection
         threshold and heart rate parameters.
       - If not a qrs, classify it as a noise peak and update
@@ -101,7 +108,9 @@ class XQRS(object):
                 The qrs refractory period.
             t_inspect_period : int or float, optional
                 The period below which a potential qrs complex is
-                inspected to see if it is a t wave.
+                inspected to see if it is a t wave. The inspection never
+                rejected a peak, so it is skipped by the detection. See
+                `xqrs_detect_peaks`.
 
             """
             if hr_min < 0:
@@ -145,6 +154,16 @@ class XQRS(object):
         self.t_inspect_period = int(self.conf.t_inspect_period * self.fs)
 
 
+    def _design_filters(self, fc_low=5, fc_high=20):
+        """
+        Design the filters used by the detection, for the configured
+        sampling frequency and qrs width. The designs are memoized, so
+        this only computes them on their first use in the process.
+        """
+        design_bandpass(self.fs, fc_low, fc_high)
+        design_mwi(self.fs, self.qrs_width, fc_low, fc_high)
+        design_ricker(self.qrs_radius * 2)
+
     def _bandpass(self, fc_low=5, fc_high=20):
         """
         Apply a bandpass filter onto the signal, and save the filtered
@@ -153,13 +172,14 @@ class XQRS(object):
         self.fc_low = fc_low
         self.fc_high = fc_high
 
-        b, a = signal.butter(2, [float(fc_low) * 2 / self.fs,
-                                 float(fc_high) * 2 / self.fs], 'pass')
-        self.sig_f = signal.filtfilt(b, a, self.sig[self.sampfrom:self.sampto],
-                                     axis=0)
+        b, a, _, filter_gain = design_bandpass(self.fs, fc_low, fc_high)
+        # The filter runs in the precision of its inputs
+        self.sig_f = signal.filtfilt(
+            b.astype(self.dtype), a.astype(self.dtype),
+            self.sig[self.sampfrom:self.sampto].astype(self.dtype, copy=False),
+            axis=0)
         # Save the passband gain (x2 due to double filtering)
-        self.filter_gain = get_filter_gain(b, a, np.mean([fc_low, fc_high]),
-                                           self.fs) * 2
+        self.filter_gain = filter_gain * 2
 
 
     def _mwi(self):
@@ -172,15 +192,17 @@ class XQRS(object):
 
         After integration, find all local peaks in the mwi signal.
         """
-        wavelet_filter = signal.ricker(self.qrs_width, 4)
+        wavelet_filter, mwi_gain = design_mwi(self.fs, self.qrs_width,
+                                              self.fc_low, self.fc_high)
 
-        self.sig_i = signal.filtfilt(wavelet_filter, [1], self.sig_f,
-                                     axis=0) ** 2
+        self.sig_i = signal.filtfilt(wavelet_filter.astype(self.dtype),
+                                     np.ones(1, dtype=self.dtype),
+                                     self.sig_f, axis=0)
+        np.square(self.sig_i, out=self.sig_i)
 
         # Save the mwi gain (x2 due to double filtering) and the total
         # gain from raw to mwi
-        self.mwi_gain = get_filter_gain(wavelet_filter, [1],
-                         np.mean([self.fc_low, self.fc_high]), self.fs) * 2
+        self.mwi_gain = mwi_gain * 2
         self.transform_gain = self.filter_gain * self.mwi_gain
         self.peak_inds_i = find_local_peaks(self.sig_i, radius=self.qrs_radius)
         self.n_peaks_i = len(self.peak_inds_i)
@@ -224,7 +246,7 @@ class XQRS(object):
         qrs_amps = []
         noise_amps = []
 
-        ricker_wavelet = signal.ricker(self.qrs_radius * 2, 4).reshape(-1,1)
+        ricker_wavelet = design_ricker(self.qrs_radius * 2)
 
         # Find the local peaks of the signal.
         peak_inds_f = find_local_peaks(self.sig_f, self.qrs_radius)
@@ -242,30 +264,45 @@ class XQRS(object):
             self._set_default_init_params()
             return
 
-        # Go through the peaks and find qrs peaks and noise peaks.
-        # only inspect peaks with at least qrs_radius around either side
-        for peak_num in range(peak_nums_r[0], peak_nums_l[-1]):
-            i = peak_inds_f[peak_num]
-            # Calculate cross-correlation between the filtered signal
-            # segment and a ricker wavelet
-
-            # Question: should the signal be squared? Case for inverse qrs
-            # complexes
-            sig_segment = normalize((self.sig_f[i - self.qrs_radius:
-                                                i + self.qrs_radius]).reshape(-1, 1), axis=0)
+        # The filtered signal segments centered around each peak
+        windows = np.lib.stride_tricks.sliding_window_view(
+            self.sig_f, 2 * self.qrs_radius)
 
-            xcorr = np.correlate(sig_segment[:, 0], ricker_wavelet[:,0])
+        # Go through the peaks and find qrs peaks and noise peaks.
+        # only inspect peaks with at least qrs_radius around either side.
+        # Peaks are inspected in growing blocks, to stop early once
+        # enough beats are found.
+        start_num = peak_nums_r[0]
+        end_num = min(peak_nums_l[-1], np.searchsorted(
+            peak_inds_f, len(windows) + self.qrs_radius))
+        block_size = 64
+        while start_num < end_num and len(qrs_inds) < n_calib_beats:
+            block_end_num = min(start_num + block_size, end_num)
+            block_inds = peak_inds_f[start_num:block_end_num]
+            block_size *= 2
+
+            # Calculate cross-correlation between the normalized filtered
+            # signal segments and a ricker wavelet
+            sig_segments = normalize(windows[block_inds - self.qrs_radius],
+                                     axis=1)
+            xcorr = np.dot(sig_segments, ricker_wavelet)
 
             # Classify as qrs if xcorr is large enough
-            if xcorr > 0.6 and i-last_qrs_ind > self.rr_min:
-                last_qrs_ind = i
-                qrs_inds.append(i)
-                qrs_amps.append(self.sig_i[i])
-            else:
-                noise_amps.append(self.sig_i[i])
+            is_qrs = np.zeros(len(block_inds), dtype='bool')
+            for k in np.where(xcorr > 0.6)[0]:
+                if block_inds[k] - last_qrs_ind > self.rr_min:
+                    last_qrs_ind = block_inds[k]
+                    is_qrs[k] = True
+                    qrs_inds.append(block_inds[k])
+                    if len(qrs_inds) == n_calib_beats:
+                        # Inspect no further than this beat
+                        is_qrs = is_qrs[:k + 1]
+                        block_inds = block_inds[:k + 1]
+                        break
 
-            if len(qrs_inds) == n_calib_beats:
-                break
+            qrs_amps.extend(self.sig_i[block_inds[is_qrs]])
+            noise_amps.extend(self.sig_i[block_inds[~is_qrs]])
+            start_num = block_end_num
 
         # Found enough calibration beats to initialize parameters
         if len(qrs_inds) == n_calib_beats:
@@ -328,6 +365,7 @@ class XQRS(object):
 
         # No qrs detected initially
         self.last_qrs_peak_num = None
+        self._backsearch_peak_num = -1
 
 
     def _set_default_init_params(self):
@@ -360,153 +398,6 @@ class XQRS(object):
 
         self.learned_init_params = False
 
-    def _is_qrs(self, peak_num, backsearch=False):
-        """
-        Check whether a peak is a qrs complex. It is classified as qrs
-        if it:
-        - Comes after the refractory period
-        - Passes qrs threshold
-        - Is not a t-wave (check it if the peak is close to the previous
-          qrs).
-
-        Parameters
-        ----------
-        peak_num : int
-            The peak number of the mwi signal to be inspected
-        backsearch: bool, optional
-            Whether the peak is being inspected during backsearch
-
-        """
-        i = self.peak_inds_i[peak_num]
-        if backsearch:
-            qrs_thr = self.qrs_thr / 2
-        else:
-            qrs_thr = self.qrs_thr
-
-        if (i-self.last_qrs_ind > self.ref_period
-           and self.sig_i[i] > qrs_thr):
-            if i-self.last_qrs_ind < self.t_inspect_period:
-                if self._is_twave(peak_num):
-                    return False
-            return True
-
-        return False
-
-
-    def _update_qrs(self, peak_num, backsearch=False):
-        """
-        Update live qrs parameters. Adjust the recent rr-intervals and
-        qrs amplitudes, and the qrs threshold.
-
-        Parameters
-        ----------
-        peak_num : int
-            The peak number of the mwi signal where the qrs is detected
-        backsearch: bool, optional
-            Whether the qrs was found via backsearch
-        """
-
-        i = self.peak_inds_i[peak_num]
-
-        # Update recent rr if the beat is consecutive (do this before
-        # updating self.last_qrs_ind)
-        rr_new = i - self.last_qrs_ind
-        if rr_new < self.rr_max:
-            self.rr_recent = 0.875*self.rr_recent + 0.125*rr_new
-
-        self.qrs_inds.append(i)
-        self.last_qrs_ind = i
-        # Peak number corresponding to last qrs
-        self.last_qrs_peak_num = self.peak_num
-
-        # qrs recent amplitude is adjusted twice as quickly if the peak
-        # was found via backsearch
-        if backsearch:
-            self.backsearch_qrs_inds.append(i)
-            self.qrs_amp_recent = (0.75*self.qrs_amp_recent
-                                   + 0.25*self.sig_i[i])
-        else:
-            self.qrs_amp_recent = (0.875*self.qrs_amp_recent
-                                   + 0.125*self.sig_i[i])
-
-        self.qrs_thr = max((0.25*self.qrs_amp_recent
-                            + 0.75*self.noise_amp_recent), self.qrs_thr_min)
-
-        return
-
-
-    def _is_twave(self, peak_num):
-        """
-        Check whether a segment is a t-wave. Compare the maximum gradient of
-        the filtered signal segment with that of the previous qrs segment.
-
-        Parameters
-        ----------
-        peak_num : int
-            The peak number of the mwi signal where the qrs is detected
-
-        """
-        i = self.peak_inds_i[peak_num]
-
-        # Due to initialization parameters, last_qrs_ind may be negative.
-        # No way to check in this instance.
-        if self.last_qrs_ind - self.qrs_radius < 0:
-            return False
-
-        # Get half the qrs width of the signal to the left.
-        # Should this be squared?
-        sig_segment = normalize((self.sig_f[i - self.qrs_radius:i]
-                                 ).reshape(-1, 1), axis=0)
-        last_qrs_segment = self.sig_f[self.last_qrs_ind - self.qrs_radius:
-                                      self.last_qrs_ind]
-
-        segment_slope = np.diff(sig_segment)
-        last_qrs_slope = np.diff(last_qrs_segment)
-
-        # Should we be using absolute values?
-        if max(segment_slope) < 0.5*max(abs(last_qrs_slope)):
-            return True
-        else:
-            return False
-
-    def _update_noise(self, peak_num):
-        """
-        Update live noise parameters
-        """
-        i = self.peak_inds_i[peak_num]
-        self.noise_amp_recent = (0.875*self.noise_amp_recent
-                                 + 0.125*self.sig_i[i])
-        return
-
-    def _require_backsearch(self):
-        """
-        Determine whether a backsearch should be performed on prior peaks
-        """
-        if self.peak_num == self.n_peaks_i-1:
-            # If we just return false, we may miss a chance to backsearch.
-            # Update this?
-            return False
-
-        next_peak_ind = self.peak_inds_i[self.peak_num + 1]
-
-        if next_peak_ind-self.last_qrs_ind > self.rr_recent*1.66:
-            return True
-        else:
-            return False
-
-    def _backsearch(self):
-        """
-        Inspect previous peaks from the last detected qrs peak (if any),
-        using a lower threshold
-
-        """
-        if self.last_qrs_peak_num is not None:
-            for peak_num in range(self.last_qrs_peak_num + 1, self.peak_num + 1):
-                if self._is_qrs(peak_num=peak_num, backsearch=True):
-                    self._update_qrs(peak_num=peak_num, backsearch=True)
-                # No need to update noise parameters if it was classified as
-                # noise. It would have already been updated.
-
     def _run_detection(self):
         """
         Run the qrs detection after all signals and parameters have been
@@ -516,34 +407,68 @@ class XQRS(object):
         if self.verbose:
             print('Running QRS detection...')
 
-        # Detected qrs indices
-        self.qrs_inds = []
-        # qrs indices found via backsearch
-        self.backsearch_qrs_inds = []
-
-        # Iterate through mwi signal peak indices
-        for self.peak_num in range(self.n_peaks_i):
-            if self._is_qrs(self.peak_num):
-                self._update_qrs(self.peak_num)
-            else:
-                self._update_noise(self.peak_num)
+        qrs_inds, is_backsearch = self._detect_peaks(0, self.n_peaks_i)
 
-            # Before continuing to the next peak, do backsearch if
-            # necessary
-            if self._require_backsearch():
-                self._backsearch()
+        # qrs indices found via backsearch
+        self.backsearch_qrs_inds = list(qrs_inds[is_backsearch])
 
         # Detected indices are relative to starting sample
-        if self.qrs_inds:
-            self.qrs_inds = np.array(self.qrs_inds) + self.sampfrom
+        if qrs_inds.size:
+            self.qrs_inds = qrs_inds + self.sampfrom
         else:
-            self.qrs_inds = np.array(self.qrs_inds)
+            self.qrs_inds = np.array([])
 
         if self.verbose:
             print('QRS detection complete.')
 
+    def _detect_peaks(self, start_peak_num, end_peak_num):
+        """
+        Classify the mwi signal peaks from `start_peak_num` to
+        `end_peak_num`, updating the running parameters. See
+        `xqrs_detect_peaks` for the detection steps.
 
-    def detect(self, sampfrom=0, sampto='end', learn=True, verbose=True):
+        Returns
+        -------
+        qrs_inds : numpy array
+            The indices of the detected qrs complexes.
+        is_backsearch : numpy array
+            Whether each qrs complex was found via backsearch.
+
+        """
+        state = np.array([self.qrs_amp_recent, self.noise_amp_recent,
+                          self.qrs_thr, self.rr_recent, self.last_qrs_ind],
+                         dtype='float64')
+        peak_nums = np.array([
+            -1 if self.last_qrs_peak_num is None else self.last_qrs_peak_num,
+            self._backsearch_peak_num], dtype='int64')
+        # Backsearch can also find qrs complexes among the peaks before
+        # `start_peak_num`, back to the one after the last qrs peak.
+        # Each peak is classified as qrs at most once.
+        n_qrs_max = end_peak_num - min(start_peak_num, peak_nums[0] + 1)
+        qrs_inds = np.empty(max(n_qrs_max, 0), dtype='int64')
+        is_backsearch = np.zeros(max(n_qrs_max, 0), dtype='bool')
+
+        n_qrs = _xqrs_detect_peaks(
+            np.asarray(self.peak_inds_i, dtype='int64'), self.sig_i,
+            start_peak_num, end_peak_num, self.n_peaks_i, self.ref_period,
+            self.rr_max, self.qrs_thr_min, state, peak_nums, qrs_inds,
+            is_backsearch)
+
+        (self.qrs_amp_recent, self.noise_amp_recent, self.qrs_thr,
+         self.rr_recent, last_qrs_ind) = state.tolist()
+        # The initial last qrs index may not be a whole number
+        if last_qrs_ind != self.last_qrs_ind:
+            self.last_qrs_ind = int(last_qrs_ind)
+        if peak_nums[0] != -1:
+            self.last_qrs_peak_num = int(peak_nums[0])
+        self._backsearch_peak_num = int(peak_nums[1])
+        if end_peak_num > start_peak_num:
+            self.peak_num = end_peak_num - 1
+
+        return qrs_inds[:n_qrs], is_backsearch[:n_qrs]
+
+    def detect(self, sampfrom=0, sampto='end', learn=True, verbose=True,
+               dtype='float64', keep_signals=True):
         """
         Detect qrs locations between two samples.
 
@@ -563,11 +488,20 @@ class XQRS(object):
         verbose : bool, optional
             Whether to display the stages and outcomes of the detection
             process.
+        dtype : str, or numpy dtype, optional
+            The floating point precision in which to filter the signal.
+            Using 'float32' halves the memory of the filtered and mwi
+            signals, which may slightly change the detections.
+        keep_signals : bool, optional
+            Whether to keep the filtered and mwi signals in the `sig_f`
+            and `sig_i` attributes after the detection. If False, each
+            one is discarded as soon as it is no longer needed.
 
         """
         if sampfrom < 0:
             raise ValueError("'sampfrom' cannot be negative")
         self.sampfrom = sampfrom
+        self.dtype = np.dtype(dtype)
 
         if sampto == 'end':
             sampto = self.sig_len
@@ -595,13 +529,232 @@ class XQRS(object):
             self._learn_init_params()
         else:
             self._set_default_init_params()
+        if not keep_signals:
+            self.sig_f = None
 
         # Run the detection
         self._run_detection()
+        if not keep_signals:
+            self.sig_i = None
+
+
+@functools.lru_cache(maxsize=128)
+def design_bandpass(fs, fc_low, fc_high):
+    """
+    Design the second order Butterworth bandpass filter of the xqrs
+    detector. The designs are memoized, and shared by all detectors in
+    the process.
+
+    Parameters
+    ----------
+    fs : int or float
+        The sampling frequency of the signal.
+    fc_low : int or float
+        The low cutoff frequency.
+    fc_high : int or float
+        The high cutoff frequency.
+
+    Returns
+    -------
+    b : numpy array
+        The filter numerator coefficients.
+    a : numpy array
+        The filter denominator coefficients.
+    sos : numpy array
+        The filter as second order sections.
+    gain : float
+        The gain of the filter at the center of the passband.
+
+    """
+    wn = [float(fc_low) * 2 / fs, float(fc_high) * 2 / fs]
+    b, a = signal.butter(2, wn, 'pass')
+    sos = signal.butter(2, wn, 'pass', output='sos')
+    gain = get_filter_gain(b, a, np.mean([fc_low, fc_high]), fs)
+    return _read_only(b), _read_only(a), _read_only(sos), gain
+
+
+@functools.lru_cache(maxsize=128)
+def design_mwi(fs, qrs_width, fc_low, fc_high):
+    """
+    Design the ricker wavelet moving wave integration filter of the
+    xqrs detector. The designs are memoized, and shared by all detectors
+    in the process.
+
+    Parameters
+    ----------
+    fs : int or float
+        The sampling frequency of the signal.
+    qrs_width : int
+        The qrs width in samples, which is the width of the wavelet.
+    fc_low : int or float
+        The low cutoff frequency of the bandpass filter.
+    fc_high : int or float
+        The high cutoff frequency of the bandpass filter.
+
+    Returns
+    -------
+    wavelet : numpy array
+        The filter coefficients.
+    gain : float
+        The gain of the filter at the center of the bandpass filter's
+        passband.
+
+    """
+    wavelet = design_ricker(qrs_width)
+    gain = get_filter_gain(wavelet, [1], np.mean([fc_low, fc_high]), fs)
+    return wavelet, gain
+
+
+@functools.lru_cache(maxsize=128)
+def design_ricker(points):
+    """
+    Get a memoized, read only ricker wavelet of a given length, with
+    width parameter 4.
+    """
+    return _read_only(signal.ricker(points, 4))
+
+
+def _read_only(array):
+    """
+    Make an array read only, so it can be safely memoized.
+    """
+    array.setflags(write=False)
+    return array
+
+
+def xqrs_detect_peaks(peak_inds, sig_i, start_peak_num, end_peak_num,
+                      n_peaks, ref_period, rr_max, qrs_thr_min, state,
+                      peak_nums, qrs_inds, is_backsearch):
+    """
+    Run the xqrs peak classification over plain arrays and scalars. This
+    is the main detection loop of the XQRS class, and is compiled with
+    numba when it is installed.
+
+    For each peak of the mwi signal, from `start_peak_num` to
+    `end_peak_num`:
+
+    - Classify it as qrs if it comes after the refractory period and
+      crosses the qrs detection threshold, and update the running qrs
+      parameters. Otherwise classify it as noise and update the running
+      noise amplitude.
+    - If the next peak is more than 1.66 times the recent rr interval
+      after the last qrs, backsearch the peaks since the last qrs peak
+      using half the threshold.
+
+    Parameters
+    ----------
+    peak_inds : numpy array
+        The indices of the mwi signal peaks.
+    sig_i : numpy array
+        The mwi signal.
+    start_peak_num : int
+        The first peak number to classify.
+    end_peak_num : int
+        The peak number to stop at (not included).
+    n_peaks : int
+        The number of peaks. The last peak never triggers backsearch.
+    ref_period : int
+        The qrs refractory period, in samples.
+    rr_max : float
+        The maximum rr interval, in samples.
+    qrs_thr_min : float
+        The minimum qrs detection threshold.
+    state : numpy array
+        The running parameters: recent qrs amplitude, recent noise
+        amplitude, qrs threshold, recent rr interval, and last qrs
+        index. Updated in place.
+    peak_nums : numpy array
+        The last qrs peak number (-1 if none), and the last peak number
+        which triggered backsearch. Updated in place.
+    qrs_inds : numpy array
+        The array to write the detected qrs indices into. Backsearch can
+        find qrs complexes from the peak after the last qrs peak, so its
+        length must be at least `end_peak_num` minus the lower of
+        `start_peak_num` and that peak number.
+    is_backsearch : numpy array
+        The array to write whether each qrs was found via backsearch
+        into, of the same length as `qrs_inds`.
+
+    Returns
+    -------
+    n_qrs : int
+        The number of detected qrs complexes.
+
+    Notes
+    -----
+    Peaks are not inspected to see if they are t-waves. The previous
+    t-wave check took the slope of the normalized segment along its
+    length 1 axis, so it was always empty and never rejected a peak,
+    and it was removed without changing the detections.
+
+    """
+    qrs_amp_recent = state[0]
+    noise_amp_recent = state[1]
+    qrs_thr = state[2]
+    rr_recent = state[3]
+    last_qrs_ind = state[4]
+    last_qrs_peak_num = peak_nums[0]
+    n_qrs = 0
+
+    for peak_num in range(start_peak_num, end_peak_num):
+        i = peak_inds[peak_num]
+
+        if i - last_qrs_ind > ref_period and sig_i[i] > qrs_thr:
+            rr_new = i - last_qrs_ind
+            if rr_new < rr_max:
+                rr_recent = 0.875*rr_recent + 0.125*rr_new
+            qrs_inds[n_qrs] = i
+            n_qrs += 1
+            last_qrs_ind = i
+            last_qrs_peak_num = peak_num
+            qrs_amp_recent = 0.875*qrs_amp_recent + 0.125*sig_i[i]
+            qrs_thr = 0.25*qrs_amp_recent + 0.75*noise_amp_recent
+            if qrs_thr_min > qrs_thr:
+                qrs_thr = qrs_thr_min
+        else:
+            noise_amp_recent = 0.875*noise_amp_recent + 0.125*sig_i[i]
+
+        if (peak_num != n_peaks - 1
+                and peak_inds[peak_num + 1] - last_qrs_ind > rr_recent*1.66):
+            if last_qrs_peak_num != -1:
+                for back_peak_num in range(last_qrs_peak_num + 1,
+                                           peak_num + 1):
+                    i = peak_inds[back_peak_num]
+                    if (i - last_qrs_ind > ref_period
+                            and sig_i[i] > qrs_thr / 2):
+                        rr_new = i - last_qrs_ind
+                        if rr_new < rr_max:
+                            rr_recent = 0.875*rr_recent + 0.125*rr_new
+                        qrs_inds[n_qrs] = i
+                        is_backsearch[n_qrs] = True
+                        n_qrs += 1
+                        last_qrs_ind = i
+                        last_qrs_peak_num = peak_num
+                        qrs_amp_recent = (0.75*qrs_amp_recent
+                                          + 0.25*sig_i[i])
+                        qrs_thr = 0.25*qrs_amp_recent + 0.75*noise_amp_recent
+                        if qrs_thr_min > qrs_thr:
+                            qrs_thr = qrs_thr_min
+            peak_nums[1] = peak_num
+
+    state[0] = qrs_amp_recent
+    state[1] = noise_amp_recent
+    state[2] = qrs_thr
+    state[3] = rr_recent
+    state[4] = last_qrs_ind
+    peak_nums[0] = last_qrs_peak_num
+
+    return n_qrs
+
+
+if numba is not None:
+    _xqrs_detect_peaks = numba.njit(nogil=True, cache=True)(xqrs_detect_peaks)
+else:
+    _xqrs_detect_peaks = xqrs_detect_peaks
 
 
 def xqrs_detect(sig, fs, sampfrom=0, sampto='end', conf=None,
-                learn=True, verbose=True):
+                learn=True, verbose=True, dtype='float64'):
     """
     Run the 'xqrs' qrs detection algorithm on a signal. See the
     docstring of the XQRS class for algorithm details.
@@ -628,6 +781,9 @@ def xqrs_detect(sig, fs, sampfrom=0, sampto='end', conf=None,
     verbose : bool, optional
         Whether to display the stages and outcomes of the detection
         process.
+    dtype : str, or numpy dtype, optional
+        The floating point precision in which to filter the signal. See
+        `XQRS.detect`.
 
     Returns
     -------
@@ -644,17 +800,528 @@ def xqrs_detect(sig, fs, sampfrom=0, sampto='end', conf=None,
 
     """
     xqrs = XQRS(sig=sig, fs=fs, conf=conf)
-    xqrs.detect(sampfrom=sampfrom, sampto=sampto, verbose=verbose)
+    xqrs.detect(sampfrom=sampfrom, sampto=sampto, verbose=verbose,
+                dtype=dtype, keep_signals=False)
     return xqrs.qrs_inds
 
 
+def xqrs_detect_batch(signals, fs, conf=None, learn=True, workers=1,
+                      dtype='float64'):
+    """
+    Run the 'xqrs' qrs detection algorithm on multiple signals,
+    optionally in parallel processes. See the docstring of the XQRS
+    class for algorithm details.
+
+    Parameters
+    ----------
+    signals : list, or numpy array
+        The input ecg signals: a list of 1d numpy arrays, or a 2d numpy
+        array whose columns are the signals.
+    fs : int or float, or list
+        The sampling frequency of the input signals, or a list of the
+        sampling frequency of each signal.
+    conf : XQRS.Conf object, optional
+        The configuration object specifying signal configuration
+        parameters, used for all signals. See the docstring of the
+        XQRS.Conf class.
+    learn : bool, optional
+        Whether to apply learning on each signal before running the
+        main detection.
+    workers : int, optional
+        The number of processes running the detection in parallel.
+        Leave as 1 to run it in the current process.
+    dtype : str, or numpy dtype, optional
+        The floating point precision in which to filter the signals. See
+        `XQRS.detect`.
+
+    Returns
+    -------
+    qrs_offsets : numpy array
+        The offsets of each signal's qrs indices in `qrs_inds`. The qrs
+        indices of signal i are `qrs_inds[qrs_offsets[i]:qrs_offsets[i+1]]`.
+    qrs_inds : numpy array
+        The indices of the detected qrs complexes of all signals,
+        concatenated.
+    times : numpy array
+        The detection time of each signal, in seconds.
+
+    Notes
+    -----
+    The signals are passed to the worker processes through a single
+    shared memory block rather than being pickled, and only the qrs
+    indices are sent back.
+
+    Examples
+    --------
+    >>> import wfdb
+    >>> from wfdb import processing
+
+    >>> sig, fields = wfdb.rdsamp('sample-data/100')
+    >>> qrs_offsets, qrs_inds, times = processing.xqrs_detect_batch(
+            sig, fs=fields['fs'], workers=2)
+    >>> qrs_inds_ch1 = qrs_inds[qrs_offsets[1]:qrs_offsets[2]]
+
+    """
+    if isinstance(signals, np.ndarray) and signals.ndim == 2:
+        signals = list(signals.T)
+    signals = [np.asarray(sig, dtype='float64') for sig in signals]
+    for sig in signals:
+        if sig.ndim != 1:
+            raise ValueError('signals must be 1d numpy arrays')
+
+    n_sig = len(signals)
+    if np.ndim(fs) == 0:
+        fs = n_sig * [fs]
+    elif len(fs) != n_sig:
+        raise ValueError('fs must have one value per signal')
+
+    sig_ends = np.cumsum([0] + [len(sig) for sig in signals])
+    items = [(sig_ends[i], sig_ends[i + 1], fs[i], conf, learn, dtype)
+             for i in range(n_sig)]
+
+    if workers > 1 and sig_ends[-1]:
+        # Design the filters once, for the forked workers to inherit
+        for item_fs in set(fs):
+            XQRS(sig=np.empty(0), fs=item_fs, conf=conf)._design_filters()
+
+        shm = shared_memory.SharedMemory(create=True, size=int(sig_ends[-1]) * 8)
+        try:
+            shared_sig = np.ndarray(sig_ends[-1], dtype='float64',
+                                    buffer=shm.buf)
+            for sig, start in zip(signals, sig_ends):
+                shared_sig[start:start + len(sig)] = sig
+            del shared_sig
+
+            with multiprocessing.Pool(
+                    processes=workers, initializer=_attach_shared_signal,
+                    initargs=(shm.name, int(sig_ends[-1]))) as pool:
+                results = pool.map(_xqrs_detect_item, items,
+                                   chunksize=max(1, n_sig // (4 * workers)))
+                # Let the workers exit and detach from the block
+                pool.close()
+                pool.join()
+        finally:
+            shm.close()
+            shm.unlink()
+    else:
+        results = [_xqrs_detect_timed(sig, fs[i], conf, learn, dtype)
+                   for i, sig in enumerate(signals)]
+
+    qrs_offsets = np.cumsum([0] + [len(r[0]) for r in results],
+                            dtype='int64')
+    qrs_inds = np.concatenate([r[0] for r in results]
+                              + [np.empty(0, dtype='int64')])
+    times = np.array([r[1] for r in results], dtype='float64')
+
+    return qrs_offsets, qrs_inds, times
+
+
+def xqrs_detect_records(records, channels=None, conf=None, learn=True,
+                        workers=1, dtype='float64'):
+    """
+    Run the 'xqrs' qrs detection algorithm on the channels of one or
+    more records. See `xqrs_detect_batch`.
+
+    Parameters
+    ----------
+    records : Record, or list
+        The Record object, or list of Record objects, whose physical
+        signals to run the detection on.
+    channels : list, optional
+        The channels of each record to run the detection on. Leave as
+        None to use all channels.
+    conf : XQRS.Conf object, optional
+        The configuration object specifying signal configuration
+        parameters. See the docstring of the XQRS.Conf class.
+    learn : bool, optional
+        Whether to apply learning on each signal before running the
+        main detection.
+    workers : int, optional
+        The number of processes running the detection in parallel.
+    dtype : str, or numpy dtype, optional
+        The floating point precision in which to filter the signals.
+
+    Returns
+    -------
+    qrs_offsets : numpy array
+        The offsets of each signal's qrs indices in `qrs_inds`.
+    qrs_inds : numpy array
+        The indices of the detected qrs complexes of all signals,
+        concatenated.
+    times : numpy array
+        The detection time of each signal, in seconds.
+    items : list
+        The (record_name, sig_name) pair of each signal, in order.
+
+    Notes
+    -----
+    The signals of all the records are held in memory at once, so a
+    very large number of records should be processed in groups.
+
+    Examples
+    --------
+    >>> import wfdb
+    >>> from wfdb import processing
+
+    >>> records = [wfdb.rdrecord('sample-data/' + r) for r in ['100', '101']]
+    >>> qrs_offsets, qrs_inds, times, items = processing.xqrs_detect_records(
+            records, workers=2)
+
+    """
+    if isinstance(records, Record):
+        records = [records]
+
+    signals = []
+    fs = []
+    items = []
+    for record in records:
+        if record.p_signal is None:
+            raise ValueError('The records must have physical signals')
+        for ch in (channels if channels is not None else range(record.n_sig)):
+            signals.append(record.p_signal[:, ch])
+            fs.append(record.fs)
+            items.append((record.record_name, record.sig_name[ch]))
+
+    return xqrs_detect_batch(signals, fs, conf=conf, learn=learn,
+                             workers=workers, dtype=dtype) + (items,)
+
+
+# The concatenated signals of xqrs_detect_batch, in a worker process
+_shared_signal = None
+_shared_memory = None
+
+
+def _attach_shared_signal(shm_name, size):
+    """
+    Attach a worker process to the shared memory block holding the
+    signals of xqrs_detect_batch.
+    """
+    global _shared_signal, _shared_memory
+    _shared_memory = shared_memory.SharedMemory(name=shm_name)
+    _shared_signal = np.ndarray(size, dtype='float64',
+                                buffer=_shared_memory.buf)
+    util.Finalize(None, _detach_shared_signal, exitpriority=10)
+
+
+def _detach_shared_signal():
+    """
+    Close a worker process's view of the shared memory block, when the
+    worker exits.
+    """
+    global _shared_signal, _shared_memory
+    if _shared_memory is not None:
+        # The array must be released before the block can be closed
+        _shared_signal = None
+        _shared_memory.close()
+        _shared_memory = None
+
+
+def _xqrs_detect_item(item):
+    """
+    Run the xqrs detection on one signal of the shared memory block.
+    """
+    start, stop, fs, conf, learn, dtype = item
+    return _xqrs_detect_timed(_shared_signal[start:stop], fs, conf, learn,
+                              dtype)
+
+
+def _xqrs_detect_timed(sig, fs, conf, learn, dtype):
+    """
+    Run the xqrs detection on a signal. Returns the qrs indices and the
+    detection time.
+    """
+    start_time = time.perf_counter()
+    xqrs = XQRS(sig=sig, fs=fs, conf=conf)
+    xqrs.detect(learn=learn, verbose=False, dtype=dtype, keep_signals=False)
+    qrs_inds = np.asarray(xqrs.qrs_inds, dtype='int64')
+    return qrs_inds, time.perf_counter() - start_time
+
+
+class XQRSStream(XQRS):
+    """
+    Streaming version of the xqrs detector, for signals which are not
+    available all at once, such as live feeds or very long records.
+
+    Chunks of the signal are fed to the `XQRSStream.process_chunk`
+    method, which returns the qrs indices that became final. The
+    `XQRSStream.finish` method returns the remaining qrs indices once
+    the signal has ended.
+
+    The detection follows that of the `XQRS` class, with the following
+    differences:
+
+    - The bandpass and moving wave integration filters are applied
+      causally, carrying the filter states across chunks, instead of
+      forwards and backwards over the whole signal. The qrs indices are
+      shifted back by the filters' group delay.
+    - Learning is conducted on the first `learn_len` samples of the
+      signal, and detection starts once they are received.
+    - The local peaks of the mwi signal are found as soon as `qrs_radius`
+      samples are available on their right.
+
+    Only the samples and peaks still required by the backsearch are
+    kept, so the memory is bounded, and the results don't depend on the
+    chunk sizes.
+
+    Parameters
+    ----------
+    fs : int or float
+        The sampling frequency of the input signal.
+    conf : XQRS.Conf object, optional
+        The configuration object specifying signal configuration
+        parameters. See the docstring of the XQRS.Conf class.
+    learn : bool, optional
+        Whether to apply learning on the start of the signal before
+        running the main detection. If learning fails or is not
+        conducted, the default configuration parameters will be used.
+    learn_len : int, optional
+        The number of samples to apply learning on. Default is 10
+        seconds of signal.
+    verbose : bool, optional
+        Whether to display the stages and outcomes of the detection
+        process.
+
+    Examples
+    --------
+    >>> import wfdb
+    >>> from wfdb import processing
+
+    >>> sig, fields = wfdb.rdsamp('sample-data/100', channels=[0])
+    >>> xqrs = processing.XQRSStream(fs=fields['fs'])
+    >>> qrs_inds = [xqrs.process_chunk(chunk) for chunk in
+                    np.array_split(sig[:, 0], 100)]
+    >>> qrs_inds = np.concatenate(qrs_inds + [xqrs.finish()])
+
+    """
+
+    def __init__(self, fs, conf=None, learn=True, learn_len=None,
+                 verbose=False):
+        self.fs = fs
+        self.conf = conf or XQRS.Conf()
+        self._set_conf()
+        self.learn = learn
+        self.learn_len = learn_len or int(10 * fs)
+        self.verbose = verbose
+        self.fc_low = 5
+        self.fc_high = 20
+        self.sampfrom = 0
+
+        # Bandpass filter, applied once
+        b, a, sos, self.filter_gain = design_bandpass(fs, self.fc_low,
+                                                      self.fc_high)
+        # sosfilt requires writable sections
+        self._sos = sos.copy()
+        self._zi_f = None
+
+        # Moving wave integration filter
+        self._wavelet, self.mwi_gain = design_mwi(fs, self.qrs_width,
+                                                  self.fc_low, self.fc_high)
+        self._zi_i = np.zeros(len(self._wavelet) - 1)
+        self.transform_gain = self.filter_gain * self.mwi_gain
+
+        # The mwi signal lags behind the filtered signal by the wavelet
+        # delay, and behind the input by the total delay.
+        mwi_delay = (len(self._wavelet) - 1) // 2
+        fc_mid = np.mean([self.fc_low, self.fc_high])
+        filter_delay = signal.group_delay((b, a),
+                                          w=[2 * np.pi * fc_mid / fs])[1][0]
+        self.delay = int(round(mwi_delay + filter_delay))
+
+        # The filtered and mwi signals, aligned with each other, starting
+        # at sample `_offset` of the mwi signal. The filtered signal is
+        # delayed so that sig_f[i] is centered under sig_i[i].
+        self._offset = 0
+        self.sig_f = np.zeros(mwi_delay)
+        self.sig_i = np.empty(0)
+        self.peak_inds_i = np.empty(0, dtype='int64')
+        self.n_peaks_i = 0
+        # The next sample at which to search for peaks
+        self._peak_search_ind = 0
+        # The next peak to run detection on
+        self._next_peak_num = 0
+        self._detecting = False
+
+        self.qrs_inds = []
+        self.backsearch_qrs_inds = []
+
+    def process_chunk(self, samples):
+        """
+        Run the detection on the next chunk of the signal.
+
+        Parameters
+        ----------
+        samples : numpy array
+            The next samples of the 1d input ecg signal.
+
+        Returns
+        -------
+        qrs_inds : numpy array
+            The indices of the qrs complexes which became final, relative
+            to the start of the signal.
+
+        """
+        samples = np.asarray(samples, dtype='float64')
+        if samples.ndim != 1:
+            raise ValueError('samples must be a 1d numpy array')
+        if samples.size:
+            self._filter(samples)
+        return self._detect_available(final=False)
+
+    def finish(self):
+        """
+        Run the detection on the end of the signal, after all the chunks
+        have been processed.
+
+        Returns
+        -------
+        qrs_inds : numpy array
+            The indices of the remaining qrs complexes, relative to the
+            start of the signal.
+
+        """
+        return self._detect_available(final=True)
+
+    def _filter(self, samples):
+        """
+        Apply the bandpass and mwi filters onto the chunk, carrying the
+        filter states, and append the outputs to the buffers.
+        """
+        if self._zi_f is None:
+            self._zi_f = signal.sosfilt_zi(self._sos) * samples[0]
+        sig_f, self._zi_f = signal.sosfilt(self._sos, samples, zi=self._zi_f)
+        sig_i, self._zi_i = signal.lfilter(self._wavelet, [1], sig_f,
+                                           zi=self._zi_i)
+        self.sig_f = np.concatenate((self.sig_f, sig_f))
+        self.sig_i = np.concatenate((self.sig_i, sig_i ** 2))
+
+    def _detect_available(self, final):
+        """
+        Find the peaks and run the detection as far as the available
+        samples allow, and return the new qrs indices.
+        """
+        if not self._detecting:
+            if not final and self._offset + len(self.sig_i) < self.learn_len:
+                return np.empty(0, dtype='int64')
+            self._init_detection()
+
+        self._find_peaks(final)
+
+        # A peak can only be classified once the next one is known
+        self.n_peaks_i = len(self.peak_inds_i)
+        n_ready = self.n_peaks_i if final else self.n_peaks_i - 1
+        qrs_inds = np.empty(0, dtype='int64')
+        if n_ready > self._next_peak_num:
+            qrs_inds, _ = self._detect_peaks(self._next_peak_num, n_ready)
+            self._next_peak_num = n_ready
+
+        # Detected indices are final, as later detections only come after
+        # them.
+        qrs_inds = np.maximum(qrs_inds + self._offset - self.delay, 0)
+
+        self._trim()
+        return qrs_inds
+
+    def _init_detection(self):
+        """
+        Initialize the running parameters on the buffered samples.
+        """
+        if self.learn:
+            # Learn on exactly learn_len samples, regardless of chunking
+            sig_f, sig_i = self.sig_f, self.sig_i
+            self.sig_len = min(self.learn_len, len(sig_i))
+            self.sig_f = sig_f[:self.sig_len]
+            self.sig_i = sig_i[:self.sig_len]
+            self._learn_init_params()
+            self.sig_f, self.sig_i = sig_f, sig_i
+        else:
+            self._set_default_init_params()
+        self._detecting = True
+
+    def _find_peaks(self, final):
+        """
+        Find the local peaks of the mwi signal which have `qrs_radius`
+        samples available on either side, or up to the end of the signal
+        if `final`.
+        """
+        search_end = len(self.sig_i) if final else len(self.sig_i) - self.qrs_radius
+        if search_end <= self._peak_search_ind:
+            return
+
+        seg_start = max(self._peak_search_ind - self.qrs_radius, 0)
+        peak_inds = find_local_peaks(self.sig_i[seg_start:search_end
+                                                + self.qrs_radius],
+                                     radius=self.qrs_radius)
+        peak_inds = np.asarray(peak_inds, dtype='int64') + seg_start
+        peak_inds = peak_inds[(peak_inds >= self._peak_search_ind)
+                              & (peak_inds < search_end)]
+
+        # Keep the peaks at least qrs_radius apart, as in the whole signal
+        if self.peak_inds_i.size and peak_inds.size:
+            peak_inds = peak_inds[peak_inds >= self.peak_inds_i[-1]
+                                  + self.qrs_radius]
+        self.peak_inds_i = np.concatenate((self.peak_inds_i, peak_inds))
+        self._peak_search_ind = search_end
+
+    def _trim(self):
+        """
+        Discard the samples and peaks which can no longer affect the
+        detection.
+
+        Peaks up to the last detected qrs are never inspected again. The
+        peaks which failed backsearch would fail again with the same
+        threshold, so are also discarded. The last discarded peak is
+        kept as a placeholder for the backsearch start, without its
+        samples.
+        """
+        last_qrs_peak_num = self.last_qrs_peak_num
+        if last_qrs_peak_num is None:
+            last_qrs_peak_num = -1
+        n_drop = min(max(last_qrs_peak_num, self._backsearch_peak_num),
+                     self._next_peak_num - 1)
+
+        if n_drop + 1 < len(self.peak_inds_i):
+            keep_start = min(self.peak_inds_i[n_drop + 1],
+                             self._peak_search_ind)
+        else:
+            keep_start = self._peak_search_ind
+        n_trim = max(keep_start - self.qrs_radius, 0)
+        n_drop = max(n_drop, 0)
+
+        # Avoid copying the buffers on every chunk
+        if n_trim < max(len(self.sig_i) // 2, self.learn_len):
+            return
+
+        self.sig_f = self.sig_f[n_trim:]
+        self.sig_i = self.sig_i[n_trim:]
+        self.peak_inds_i = self.peak_inds_i[n_drop:] - n_trim
+        self._offset += n_trim
+        self._peak_search_ind -= n_trim
+        self.last_qrs_ind -= n_trim
+        self._next_peak_num -= n_drop
+        self._backsearch_peak_num = max(self._backsearch_peak_num - n_drop, -1)
+        if self.last_qrs_peak_num is not None:
+            self.last_qrs_peak_num = max(self.last_qrs_peak_num - n_drop, 0)
+
+
 def time_to_sample_number(seconds, frequency):
     return seconds * frequency + 0.5
 
 class GQRS(object):
     """
     GQRS detection class
+
+    Parameters
+    ----------
+    trace : function, optional
+        A function to inspect the filtered signals, called as
+        `trace(name, sampfrom, values)` for each block of samples of the
+        smoothed signal (name 'smooth') and QRS filtered signal (name
+        'qrs'). The filtered signals are not kept otherwise.
+
     """
+    def __init__(self, trace=None):
+        self.trace = trace
+
     class Conf(object):
         """
         Initial signal configuration object for this qrs detector
@@ -666,6 +1333,17 @@ class GQRS(object):
                      RTmin=0.25, RTmax=0.33,
                      QRSa=750, QRSamin=130,
                      thresh=1.0):
+            # The derived constants are memoized, and copied into each
+            # instance since detection modifies some of them.
+            self.__dict__.update(_gqrs_conf_fields(
+                fs, adc_gain, hr, RRdelta, RRmin, RRmax, QS, QT, RTmin,
+                RTmax, QRSa, QRSamin, thresh))
+
+        def _set_fields(self, fs, adc_gain, hr, RRdelta, RRmin, RRmax, QS,
+                        QT, RTmin, RTmax, QRSa, QRSamin, thresh):
+            """
+            Set the configuration parameters and their derived constants.
+            """
             self.fs = fs
 
             self.sps = int(time_to_sample_number(1, fs))
@@ -727,15 +1405,6 @@ class GQRS(object):
             self.smt0 = 0 + self.smdt
 
 
-    class Peak(object):
-        def __init__(self, peak_time, peak_amp, peak_type):
-            self.time = peak_time
-            self.amp = peak_amp
-            self.type = peak_type
-            self.next_peak = None
-            self.prev_peak = None
-
-
     class Annotation(object):
         def __init__(self, ann_time, ann_type, ann_subtype, ann_num):
             self.time = ann_time
@@ -745,20 +1414,30 @@ class GQRS(object):
 
 
     def putann(self, annotation):
-        self.annotations.append(copy.deepcopy(annotation))
+        self.ann_time.append(annotation.time)
+        self.ann_type.append(annotation.type)
+        self.ann_subtype.append(annotation.subtype)
+        self.ann_num.append(annotation.num)
 
     def detect(self, x, conf, adc_zero):
         """
         Run detection. x is digital signal
+
+        Returns the sample numbers of the annotations. Their types,
+        subtypes and nums are in the `ann_type`, `ann_subtype` and
+        `ann_num` arrays.
         """
         self.c = conf
-        self.annotations = []
+        self.ann_time = array.array('q')
+        self.ann_type = array.array('b')
+        self.ann_subtype = array.array('b')
+        self.ann_num = array.array('q')
         self.sample_valid = False
 
         if len(x) < 1:
-            return []
+            return np.array(self.ann_time, dtype='int64')
 
-        self.x = x
+        self.x = np.asarray(x)
         self.adc_zero = adc_zero
 
         self.qfv = np.zeros((self.c._BUFLN), dtype="int64")
@@ -769,18 +1448,13 @@ class GQRS(object):
         self.tf = len(x) - 1
         self.t = 0 - self.c.dt4
 
-        self.annot = GQRS.Annotation(0, "NOTE", 0, 0)
+        self.annot = GQRS.Annotation(0, self.c._NOTE, 0, 0)
 
-        # Cicular buffer of Peaks
-        first_peak = GQRS.Peak(0, 0, 0)
-        tmp = first_peak
-        for _ in range(1, self.c._NPEAKS):
-            tmp.next_peak = GQRS.Peak(0, 0, 0)
-            tmp.next_peak.prev_peak = tmp
-            tmp = tmp.next_peak
-        tmp.next_peak = first_peak
-        first_peak.prev_peak = tmp
-        self.current_peak = first_peak
+        # Cicular buffer of peaks. The peak after peak i is peak i+1.
+        self.peak_time = np.zeros(self.c._NPEAKS, dtype='int64')
+        self.peak_amp = np.zeros(self.c._NPEAKS, dtype='int64')
+        self.peak_type = np.zeros(self.c._NPEAKS, dtype='int64')
+        self.current_peak = 0
 
         if self.c.spm > self.c._BUFLN:
             if self.tf - t0 > self.c._BUFLN:
@@ -793,7 +1467,6 @@ class GQRS(object):
             else:
                 tf_learn = self.tf - self.c.dt4
 
-        self.countdown = -1
         self.state = "LEARNING"
         self.gqrs(t0, tf_learn)
 
@@ -803,99 +1476,91 @@ class GQRS(object):
         self.t = t0 - self.c.dt4
         self.gqrs(t0, self.tf)
 
-        return self.annotations
+        return np.array(self.ann_time, dtype='int64')
 
     def rewind_gqrs(self):
-        self.countdown = -1
-        self.at(self.t)
+        self.sample_valid = self.t <= self.tf
         self.annot.time = 0
-        self.annot.type = "NORMAL"
+        self.annot.type = self.c._NORMAL
         self.annot.subtype = 0
         self.annot.num = 0
-        p = self.current_peak
-        for _ in range(self.c._NPEAKS):
-            p.time = 0
-            p.type = 0
-            p.amp = 0
-            p = p.next_peak
-
-    def at(self, t):
-        if t < 0:
-            self.sample_valid = True
-            return self.x[0]
-        if t > len(self.x) - 1:
-            self.sample_valid = False
-            return self.x[-1]
-        self.sample_valid = True
-        return self.x[t]
-
-    def smv_at(self, t):
-        return self.smv[t & (self.c._BUFLN - 1)]
-
-    def smv_put(self, t, v):
-        self.smv[t & (self.c._BUFLN - 1)] = v
-
-    def qfv_at(self, t):
-        return self.qfv[t & (self.c._BUFLN - 1)]
-
-    def qfv_put(self, t, v):
-        self.qfv[t & (self.c._BUFLN - 1)] = v
+        self.peak_time[:] = 0
+        self.peak_type[:] = 0
+        self.peak_amp[:] = 0
+
+    def ring_put(self, ring, t, v):
+        # store the values v of samples t, t+1, ... in a circular
+        # buffer, which keeps the last BUFLN of them
+        n_skip = max(len(v) - self.c._BUFLN, 0)
+        t += n_skip
+        v = v[n_skip:]
+        ring[np.arange(t, t + len(v)) & (self.c._BUFLN - 1)] = v
 
     def sm(self, at_t):
         # implements a trapezoidal low pass (smoothing) filter
         # (with a gain of 4*smdt) applied to input signal sig
         # before the QRS matched filter qf().
-        # Before attempting to 'rewind' by more than BUFLN-smdt
-        # samples, reset smt and smt0.
 
-        # Calculate samp values from self.smt to at_t.
+        # Calculate samp values from self.smt to at_t. The input is
+        # clamped to its first and last samples at the edges.
         smt = self.c.smt
         smdt = int(self.c.smdt)
+        n = len(self.x)
+
+        def at(t):
+            return self.x[np.clip(t, 0, n - 1)].astype('int64')
+
+        # from 1 to dt, with the full trapezoid. 0 is never calculated.
+        head = np.arange(smt + 1, min(at_t, int(self.c.smt0)) + 1)
+        head_v = np.zeros(len(head), dtype='int64')
+        for i, t in enumerate(head):
+            v = at(np.arange(t - smdt + 1, t + smdt)).sum()
+            head_v[i] = ((v << 1) + at(t + smdt) + at(t - smdt)
+                         - self.adc_zero * (smdt << 2))
+
+        # from dt+1 onwards, as a running sum continuing the last
+        # buffered value
+        tail = np.arange(max(smt, int(self.c.smt0)) + 1, at_t + 1)
+        if len(head):
+            v0 = head_v[-1]
+        else:
+            v0 = self.smv[smt & (self.c._BUFLN - 1)]
+        tail_v = v0 + np.cumsum(at(tail + smdt) + at(tail + smdt - 1)
+                                - at(tail - smdt) - at(tail - smdt - 1))
 
-        v = 0
-        while at_t > smt:
-            smt += 1
-            # from dt+1 onwards
-            if smt > int(self.c.smt0):
-                tmp = int(self.smv_at(smt - 1) + \
-                             self.at(smt + smdt) + self.at(smt + smdt - 1) - \
-                             self.at(smt - smdt) - self.at(smt - smdt - 1))
-                self.smv_put(smt, tmp)
-                self.SIG_SMOOTH.append(tmp)
-            # from 1 to dt. 0 is never calculated.
-            else:
-                v = int(self.at(smt))
-                for j in range(1, smdt):
-                    smtpj = self.at(smt + j)
-                    smtlj = self.at(smt - j)
-                    v += int(smtpj + smtlj)
-                self.smv_put(smt, (v << 1) + self.at(smt + j+1) + self.at(smt - j-1) - \
-                             self.adc_zero * (smdt << 2))
-
-                self.SIG_SMOOTH.append((v << 1) + self.at(smt + j+1) + self.at(smt - j-1) - \
-                             self.adc_zero * (smdt << 2))
-        self.c.smt = smt
-
-        return self.smv_at(at_t)
-
-    def qf(self):
-        # evaluate the QRS detector filter for the next sample
-
-        # do this first, to ensure that all of the other smoothed values needed below are in the buffer
-        dv2 = self.sm(self.t + self.c.dt4)
-        dv2 -= self.smv_at(self.t - self.c.dt4)
-        dv1 = int(self.smv_at(self.t + self.c.dt) - self.smv_at(self.t - self.c.dt))
-        dv = dv1 << 1
-        dv -= int(self.smv_at(self.t + self.c.dt2) - self.smv_at(self.t - self.c.dt2))
-        dv = dv << 1
-        dv += dv1
-        dv -= int(self.smv_at(self.t + self.c.dt3) - self.smv_at(self.t - self.c.dt3))
-        dv = dv << 1
-        dv += dv2
-        self.v1 += dv
-        v0 = int(self.v1 / self.c.v1norm)
-        self.qfv_put(self.t, v0 * v0)
-        self.SIG_QRS.append(v0 ** 2)
+        return np.concatenate((head_v, tail_v))
+
+    def qf(self, t0, t1):
+        # evaluate the QRS detector filter for samples t0 to t1
+
+        # the smoothed values needed, the ones up to smt being in the
+        # buffer
+        smt = self.c.smt
+        dt, dt2, dt3, dt4 = self.c.dt, self.c.dt2, self.c.dt3, self.c.dt4
+        m = np.arange(t0 - dt4, t1 + dt4 + 1)
+        smv = self.smv[m & (self.c._BUFLN - 1)]
+        if t1 + dt4 > smt:
+            v = self.sm(t1 + dt4)
+            smv[m > smt] = v[m[m > smt] - smt - 1]
+            self.ring_put(self.smv, smt + 1, v)
+            self.c.smt = t1 + dt4
+            if self.trace is not None:
+                self.trace('smooth', smt + 1, v)
+
+        def dsm(d):
+            # smv_at(t + d) - smv_at(t - d) for all the samples
+            return smv[dt4 + d:len(smv) - dt4 + d] - smv[dt4 - d:len(smv) - dt4 - d]
+
+        dv1 = dsm(dt)
+        dv = ((((dv1 << 1) - dsm(dt2)) << 1) + dv1 - dsm(dt3)) << 1
+        dv += dsm(dt4)
+        v1 = self.v1 + np.cumsum(dv)
+        self.v1 = int(v1[-1])
+        v0 = (v1 / self.c.v1norm).astype('int64')
+        q = v0 * v0
+        if self.trace is not None:
+            self.trace('qrs', t0, q)
+        return q
 
     def gqrs(self, from_sample, to_sample):
         q0 = None
@@ -915,16 +1580,22 @@ class GQRS(object):
         last_peak = from_sample
         last_qrs = from_sample
 
-        self.SIG_SMOOTH = []
-        self.SIG_QRS = []
+        npeaks = self.c._NPEAKS
+        ptime, pamp, ptype = self.peak_time, self.peak_amp, self.peak_type
+
+        def next_peak(p):
+            return (p + 1) % npeaks
+
+        def prev_peak(p):
+            return (p - 1) % npeaks
 
         def add_peak(peak_time, peak_amp, type):
-            p = self.current_peak.next_peak
-            p.time = peak_time
-            p.amp = peak_amp
-            p.type = type
+            p = next_peak(self.current_peak)
+            ptime[p] = peak_time
+            pamp[p] = peak_amp
+            ptype[p] = type
             self.current_peak = p
-            p.next_peak.amp = 0
+            pamp[next_peak(p)] = 0
 
         def peaktype(p):
             # peaktype() returns 1 if p is the most prominent peak in its neighborhood, 2
@@ -938,50 +1609,50 @@ class GQRS(object):
             # the most prominent peak in the (b, c) neighborhood.  This is necessary to
             # permit detection of low-amplitude beats that closely precede or follow beats
             # with large secondary peaks (as, for example, in R-on-T PVCs).
-            if p.type:
-                return p.type
+            if ptype[p]:
+                return ptype[p]
             else:
-                a = p.amp
-                t0 = p.time - self.c.rrmin
-                t1 = p.time + self.c.rrmin
+                a = pamp[p]
+                t0 = ptime[p] - self.c.rrmin
+                t1 = ptime[p] + self.c.rrmin
 
                 if t0 < 0:
                     t0 = 0
 
-                pp = p.prev_peak
-                while t0 < pp.time and pp.time < pp.next_peak.time:
-                    if pp.amp == 0:
+                pp = prev_peak(p)
+                while t0 < ptime[pp] and ptime[pp] < ptime[next_peak(pp)]:
+                    if pamp[pp] == 0:
                         break
-                    if a < pp.amp and peaktype(pp) == 1:
-                        p.type = 2
-                        return p.type
+                    if a < pamp[pp] and peaktype(pp) == 1:
+                        ptype[p] = 2
+                        return ptype[p]
                     # end:
-                    pp = pp.prev_peak
+                    pp = prev_peak(pp)
 
-                pp = p.next_peak
-                while pp.time < t1 and pp.time > pp.prev_peak.time:
-                    if pp.amp == 0:
+                pp = next_peak(p)
+                while ptime[pp] < t1 and ptime[pp] > ptime[prev_peak(pp)]:
+                    if pamp[pp] == 0:
                         break
-                    if a < pp.amp and peaktype(pp) == 1:
-                        p.type = 2
-                        return p.type
+                    if a < pamp[pp] and peaktype(pp) == 1:
+                        ptype[p] = 2
+                        return ptype[p]
                     # end:
-                    pp = pp.next_peak
+                    pp = next_peak(pp)
 
-                p.type = 1
-                return p.type
+                ptype[p] = 1
+                return ptype[p]
 
         def find_missing(r, p):
             if r is None or p is None:
                 return None
 
-            minrrerr = p.time - r.time
+            minrrerr = ptime[p] - ptime[r]
 
             s = None
-            q = r.next_peak
-            while q.time < p.time:
+            q = next_peak(r)
+            while ptime[q] < ptime[p]:
                 if peaktype(q) == 1:
-                    rrtmp = q.time - r.time
+                    rrtmp = ptime[q] - ptime[r]
                     rrerr = rrtmp - self.c.rrmean
                     if rrerr < 0:
                         rrerr = -rrerr
@@ -989,43 +1660,83 @@ class GQRS(object):
                         minrrerr = rrerr
                         s = q
                 # end:
-                q = q.next_peak
+                q = next_peak(q)
 
             return s
 
         r = None
-        next_minute = 0
-        minutes = 0
-        while self.t <= to_sample + self.c.sps:
-            if self.countdown < 0:
-                if self.sample_valid:
-                    self.qf()
-                else:
-                    self.countdown = int(time_to_sample_number(1, self.c.fs))
+        n = len(self.x)
+        countdown = int(time_to_sample_number(1, self.c.fs))
+
+        # The QRS filter is evaluated until the smoothed samples it needs
+        # are past the end of the signal, at t_filt. Detection then runs
+        # for another second in the CLEANUP state, and stops past
+        # to_sample + sps.
+        t_start = self.t
+        if self.sample_valid:
+            t_filt = max(t_start, self.c.smt - self.c.dt4 + 1,
+                         n + self.c.smdt - self.c.dt4 + 1)
+        else:
+            t_filt = t_start - 1
+        t_stop = max(t_start, min(to_sample + self.c.sps,
+                                  t_filt + countdown + 1) + 1)
+
+        def lower_pthr(t0, t1, last_peak):
+            # Lower the peak threshold for each non-peak sample from t0
+            # to t1 (excluded) more than rrmax after the last peak.
+            n_lower = t1 - max(t0, last_peak + self.c.rrmax + 1)
+            while n_lower > 0 and self.c.pthr > self.c.pthmin and self.c.pthr >> 4:
+                self.c.pthr -= (self.c.pthr >> 4)
+                n_lower -= 1
+
+        # Process the samples in chunks of at most BUFLN, the length of
+        # the circular buffers.
+        t_lower = t_start
+        for t0 in range(t_start, t_stop, self.c._BUFLN):
+            t1 = min(t0 + self.c._BUFLN, t_stop)
+
+            # The filtered values of samples t0-2 to t1-1. Those which
+            # are not evaluated in this chunk are read from the buffer.
+            qv = self.qfv[np.arange(t0 - 2, t1) & (self.c._BUFLN - 1)]
+            if min(t1 - 1, t_filt) >= t0:
+                q = self.qf(t0, min(t1 - 1, t_filt))
+                qv[2:2 + len(q)] = q
+                self.ring_put(self.qfv, t0, q)
+
+            # Samples after a local maximum of the filtered signal. Only
+            # these can be peaks, the others just lower the threshold.
+            peak_t = t0 + np.flatnonzero((qv[:-2] < qv[1:-1])
+                                         & (qv[1:-1] >= qv[2:]))
+            peak_t = peak_t[peak_t > self.c.dt4]
+
+            for t in peak_t.tolist():
+                self.t = t
+                lower_pthr(t_lower, self.t, last_peak)
+                t_lower = self.t
+                q1 = qv[self.t - t0 + 1]
+                if q1 <= self.c.pthr:
+                    continue
+                t_lower = self.t + 1
+                if self.t > t_filt:
                     self.state = "CLEANUP"
-            else:
-                self.countdown -= 1
-                if self.countdown < 0:
-                    break
-
-            q0 = self.qfv_at(self.t)
-            q1 = self.qfv_at(self.t - 1)
-            q2 = self.qfv_at(self.t - 2)
-            # state == RUNNING only
-            if q1 > self.c.pthr and q2 < q1 and q1 >= q0 and self.t > self.c.dt4:
                 add_peak(self.t - 1, q1, 0)
                 last_peak = self.t - 1
-                p = self.current_peak.next_peak
-                while p.time < self.t - self.c.rtmax:
-                    if p.time >= self.annot.time + self.c.rrmin and peaktype(p) == 1:
-                        if p.amp > self.c.qthr:
-                            rr = p.time - self.annot.time
+                p = next_peak(self.current_peak)
+                # Skip the oldest peaks, before the last annotation's
+                # neighborhood. The peak just added always stops this.
+                p += np.argmin(np.roll(ptime, -p) < min(
+                    self.t - self.c.rtmax, self.annot.time + self.c.rrmin))
+                p %= npeaks
+                while ptime[p] < self.t - self.c.rtmax:
+                    if ptime[p] >= self.annot.time + self.c.rrmin and peaktype(p) == 1:
+                        if pamp[p] > self.c.qthr:
+                            rr = ptime[p] - self.annot.time
                             q = find_missing(r, p)
                             if rr > self.c.rrmean + 2 * self.c.rrdev and \
                                rr > 2 * (self.c.rrmean - self.c.rrdev) and \
                                q is not None:
                                 p = q
-                                rr = p.time - self.annot.time
+                                rr = ptime[p] - self.annot.time
                                 self.annot.subtype = 1
                             rrd = rr - self.c.rrmean
                             if rrd < 0:
@@ -1037,18 +1748,18 @@ class GQRS(object):
                                 self.c.rrmean += rrd
                             else:
                                 self.c.rrmean -= rrd
-                            if p.amp > self.c.qthr * 4:
+                            if pamp[p] > self.c.qthr * 4:
                                 self.c.qthr += 1
-                            elif p.amp < self.c.qthr:
+                            elif pamp[p] < self.c.qthr:
                                 self.c.qthr -= 1
                             if self.c.qthr > self.c.pthr * 20:
                                 self.c.qthr = self.c.pthr * 20
-                            last_qrs = p.time
+                            last_qrs = ptime[p]
 
                             if self.state == "RUNNING":
-                                self.annot.time = p.time - self.c.dt2
-                                self.annot.type = "NORMAL"
-                                qsize = int(p.amp * 10.0 / self.c.qthr)
+                                self.annot.time = ptime[p] - self.c.dt2
+                                self.annot.type = self.c._NORMAL
+                                qsize = int(pamp[p] * 10.0 / self.c.qthr)
                                 if qsize > 127:
                                     qsize = 127
                                 self.annot.num = qsize
@@ -1058,12 +1769,12 @@ class GQRS(object):
                             # look for this beat's T-wave
                             tw = None
                             rtdmin = self.c.rtmean
-                            q = p.next_peak
-                            while q.time > self.annot.time:
-                                rt = q.time - self.annot.time - self.c.dt2
+                            q = next_peak(p)
+                            while ptime[q] > self.annot.time:
+                                rt = ptime[q] - self.annot.time - self.c.dt2
                                 if rt < self.c.rtmin:
                                     # end:
-                                    q = q.next_peak
+                                    q = next_peak(q)
                                     continue
                                 if rt > self.c.rtmax:
                                     break
@@ -1074,10 +1785,10 @@ class GQRS(object):
                                     rtdmin = rtd
                                     tw = q
                                 # end:
-                                q = q.next_peak
+                                q = next_peak(q)
                             if tw is not None:
-                                tmp_time = tw.time - self.c.dt2
-                                tann = GQRS.Annotation(tmp_time, "TWAVE",
+                                tmp_time = ptime[tw] - self.c.dt2
+                                tann = GQRS.Annotation(tmp_time, self.c._TWAVE,
                                                   1 if tmp_time > self.annot.time + self.c.rtmean else 0,
                                                   rtdmin)
                                 # if self.state == "RUNNING":
@@ -1088,36 +1799,45 @@ class GQRS(object):
                                     self.c.rtmean = self.c.rtmax
                                 elif self.c.rtmean < self.c.rtmin:
                                     self.c.rtmean = self.c.rrmin
-                                tw.type = 2  # mark T-wave as secondary
+                                ptype[tw] = 2  # mark T-wave as secondary
                             r = p
                             q = None
                             self.annot.subtype = 0
                         elif self.t - last_qrs > self.c.rrmax and self.c.qthr > self.c.qthmin:
                             self.c.qthr -= (self.c.qthr >> 4)
                     # end:
-                    p = p.next_peak
-            elif self.t - last_peak > self.c.rrmax and self.c.pthr > self.c.pthmin:
-                self.c.pthr -= (self.c.pthr >> 4)
+                    p = next_peak(p)
 
-            self.t += 1
-            if self.t >= next_minute:
-                next_minute += self.c.spm
-                minutes += 1
-                if minutes >= 60:
-                    minutes = 0
+        lower_pthr(t_lower, t_stop, last_peak)
+        if t_filt + 1 < t_stop:
+            self.state = "CLEANUP"
+        if self.sample_valid and t_stop > t_start:
+            self.sample_valid = t_stop - 1 < t_filt
+        self.t = t_stop
 
         if self.state == "LEARNING":
             return
 
         # Mark the last beat or two.
-        p = self.current_peak.next_peak
-        while p.time < p.next_peak.time:
-            if p.time >= self.annot.time + self.c.rrmin and p.time < self.tf and peaktype(p) == 1:
-                self.annot.type = "NORMAL"
-                self.annot.time = p.time
+        p = next_peak(self.current_peak)
+        while ptime[p] < ptime[next_peak(p)]:
+            if ptime[p] >= self.annot.time + self.c.rrmin and ptime[p] < self.tf and peaktype(p) == 1:
+                self.annot.type = self.c._NORMAL
+                self.annot.time = ptime[p]
                 self.putann(self.annot)
             # end:
-            p = p.next_peak
+            p = next_peak(p)
+
+
+@functools.lru_cache(maxsize=128)
+def _gqrs_conf_fields(*args):
+    """
+    Get the memoized fields of a GQRS.Conf object, as (name, value)
+    pairs. See `GQRS.Conf._set_fields` for the arguments.
+    """
+    conf = GQRS.Conf.__new__(GQRS.Conf)
+    conf._set_fields(*args)
+    return tuple(vars(conf).items())
 
 
 def gqrs_detect(sig=None, fs=None, d_sig=None, adc_gain=None, adc_zero=None,
@@ -1273,6 +1993,6 @@ def gqrs_detect(sig=None, fs=None, d_sig=None, adc_gain=None, adc_zero=None,
                 QRSamin=QRSamin, thresh=threshold)
     gqrs = GQRS()
 
-    annotations = gqrs.detect(x=d_sig, conf=conf, adc_zero=adc_zero)
+    qrs_locs = gqrs.detect(x=d_sig, conf=conf, adc_zero=adc_zero)
 
-    return np.array([a.time for a in annotations])
+    return qrs_locs
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import unittest
+
+import numpy as np
+
+import libs.wfdb as wfdb
+from libs.wfdb.io import aio
+from libs.wfdb.io import download
+
+from .test_download import DATA_DIR, local_fetcher
+
+
+DB_INDEX_URL = 'http://mirror.invalid/'
+
+
+class TestAio(unittest.TestCase):
+    """
+    Test that the awaitable reading functions match the blocking ones.
+    """
+    def setUp(self):
+        self.bad_urls = []
+        self.requests = []
+        fetcher = local_fetcher(DB_INDEX_URL, self.bad_urls)
+
+        def logged_fetcher(method, url, byte_range):
+            self.requests.append((method, url, byte_range))
+            return fetcher(method, url, byte_range)
+
+        self.token = download._remote_fetcher.set(logged_fetcher)
+
+    def tearDown(self):
+        download._remote_fetcher.reset(self.token)
+        self.assertEqual(self.bad_urls, [])
+
+    def run_read(self, coroutine):
+        async def read():
+            with download.use_db_index_url(DB_INDEX_URL):
+                return await coroutine
+        return asyncio.run(read())
+
+    def test_rdrecord(self):
+        for kwargs in [{}, {'sampfrom': 1000, 'sampto': 5000},
+                       {'channels': [1], 'physical': False},
+                       {'channel_names': ['V5']}]:
+            self.requests = []
+            record = self.run_read(aio.rdrecord('100', pb_dir='mitdb',
+                                                **kwargs))
+            expected = wfdb.rdrecord(os.path.join(DATA_DIR, '100'), **kwargs)
+            self.assertEqual(record.sig_name, expected.sig_name)
+            np.testing.assert_array_equal(record.p_signal, expected.p_signal)
+            np.testing.assert_array_equal(record.d_signal, expected.d_signal)
+            # Each request is performed once
+            self.assertEqual(len(set(self.requests)), len(self.requests))
+
+    def test_rdsamp_rdheader(self):
+        signals, fields = self.run_read(aio.rdsamp('203', pb_dir='mitdb',
+                                                   sampto=3600))
+        expected = wfdb.rdsamp(os.path.join(DATA_DIR, '203'), sampto=3600)
+        np.testing.assert_array_equal(signals, expected[0])
+        self.assertEqual(fields, expected[1])
+
+        header = self.run_read(aio.rdheader('203', pb_dir='mitdb'))
+        expected = wfdb.rdheader(os.path.join(DATA_DIR, '203'))
+        self.assertEqual(header.sig_len, expected.sig_len)
+        self.assertEqual(header.sig_name, expected.sig_name)
+
+    def test_rdann(self):
+        ann = self.run_read(aio.rdann('101', 'atr', pb_dir='mitdb',
+                                      sampto=100000))
+        expected = wfdb.rdann(os.path.join(DATA_DIR, '101'), 'atr',
+                              sampto=100000)
+        np.testing.assert_array_equal(ann.sample, expected.sample)
+        self.assertEqual(ann.symbol, expected.symbol)
+        self.assertEqual(ann.aux_note, expected.aux_note)
+        self.assertEqual(ann.fs, 360)
+
+    def test_missing_file(self):
+        with self.assertRaises(FileNotFoundError):
+            self.run_read(aio.rdrecord('999', pb_dir='mitdb'))
+
+    def test_stored_errors(self):
+        url = DB_INDEX_URL + 'mitdb/100.hea'
+        for error in [ValueError('Bad content'), asyncio.CancelledError()]:
+            store = {('GET', url, None): error}
+            with self.assertRaises(type(error)):
+                asyncio.run(aio._run(store, download._request, 'GET', url))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,528 @@
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import libs.wfdb as wfdb
+from libs.wfdb.io import annotation
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'ecg_data')
+
+
+def synthetic_annotations(n_ann=3000):
+    """
+    Get the sample and symbol fields of synthetic annotations, and sets
+    of the other fields to write with them, using the SKIP, AUX, CHAN,
+    NUM and SUB fields of annotation files.
+    """
+    rng = np.random.RandomState(0)
+    # Some differences need a SKIP, and some are 0
+    sample_diff = rng.randint(1, 1000, n_ann)
+    sample_diff[rng.rand(n_ann) < 0.05] = rng.randint(1024, 10 ** 7, 1)
+    sample = np.cumsum(sample_diff)
+    sample[n_ann // 3] = sample[n_ann // 3 - 1]
+    symbol = list(rng.choice(['N', 'V', 'A', '+', '~'], n_ann))
+    subtype = rng.randint(0, 128, n_ann)
+    subtype[rng.rand(n_ann) < 0.5] = 0
+    chan = np.repeat(rng.randint(0, 256, n_ann // 100), 100)
+    num = rng.randint(0, 128, n_ann)
+    num[rng.rand(n_ann) < 0.8] = 0
+    # Odd and even lengths
+    aux_note = [rng.choice(['', '', '(N', '(AFIB', 'a note'])
+                for _ in range(n_ann)]
+
+    field_sets = [('skip', {}),
+                  ('sub', {'subtype': subtype}),
+                  ('chan', {'chan': chan}),
+                  ('num', {'num': num}),
+                  ('aux', {'aux_note': aux_note}),
+                  ('all', {'subtype': subtype, 'chan': chan, 'num': num,
+                           'aux_note': aux_note})]
+
+    return sample, symbol, field_sets
+
+
+def loop_core_bytes(ann):
+    """
+    The original annotation encoder, encoding one field of one
+    annotation at a time. Used as `Annotation.calc_core_bytes`.
+    """
+    sampdiff = np.concatenate(([ann.sample[0]], np.diff(ann.sample)))
+    compact_ann = copy.deepcopy(ann)
+    compact_ann.compact_fields()
+    fields = [field for field in ['num', 'subtype', 'chan', 'aux_note']
+              if not annotation.isblank(getattr(compact_ann, field))]
+
+    data_bytes = []
+    for i in range(len(sampdiff)):
+        data_bytes.extend(annotation.field2bytes(
+            'samptype', [sampdiff[i], ann.symbol[i]]))
+        for field in fields:
+            value = getattr(compact_ann, field)[i]
+            if value is not None:
+                data_bytes.extend(annotation.field2bytes(field, value))
+
+    return np.array(data_bytes).astype('u1')
+
+
+class TestAnnotationEncoder(unittest.TestCase):
+    """
+    Test that the files written by `wrann` match the ones written with
+    the original loop encoder.
+    """
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def check_encoders(self, name, sample, symbol, **fields):
+        wfdb.wrann(name, 'new', sample, symbol=symbol,
+                   write_dir=self.temp_dir, **fields)
+        with mock.patch.object(annotation.Annotation, 'calc_core_bytes',
+                               loop_core_bytes):
+            wfdb.wrann(name, 'old', sample, symbol=symbol,
+                       write_dir=self.temp_dir, **fields)
+        file_bytes = []
+        for extension in ['new', 'old']:
+            with open(os.path.join(self.temp_dir, name + '.' + extension),
+                      'rb') as f:
+                file_bytes.append(f.read())
+        self.assertEqual(file_bytes[0], file_bytes[1])
+
+    def test_bundled_files(self):
+        for record_name in ['100', '101', '102', '203']:
+            ann = wfdb.rdann(os.path.join(DATA_DIR, record_name), 'atr')
+            # wrann only writes non-negative subtypes
+            self.check_encoders(record_name, ann.sample, ann.symbol,
+                                subtype=np.abs(ann.subtype), chan=ann.chan,
+                                num=ann.num, aux_note=ann.aux_note, fs=ann.fs)
+
+    def test_synthetic_files(self):
+        sample, symbol, field_sets = synthetic_annotations()
+        for name, fields in field_sets:
+            self.check_encoders(name, sample, symbol, **fields)
+        # A single annotation, needing a SKIP
+        self.check_encoders('single', np.array([5000]), ['N'],
+                            aux_note=['(N'])
+
+
+class TestAnnotationDecoder(unittest.TestCase):
+    """
+    Test that the vectorized annotation decoder matches the loop
+    decoder.
+    """
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def check_decoders(self, record_name, extension):
+        filebytes = annotation.load_byte_pairs(record_name, extension, None)
+        ann_sample = annotation.proc_ann_bytes_loop(filebytes, None)[0]
+        for sampto in [None, 0, int(np.median(ann_sample)),
+                       int(ann_sample[-1]) + 1]:
+            vectorized = annotation.proc_ann_bytes_vectorized(filebytes,
+                                                              sampto)
+            loop = annotation.proc_ann_bytes_loop(filebytes, sampto)
+            self.assertIsNotNone(vectorized)
+            for vectorized_field, loop_field in zip(vectorized, loop):
+                self.assertEqual(list(vectorized_field), list(loop_field))
+
+    def test_bundled_files(self):
+        for record_name in ['100', '101', '102', '203']:
+            self.check_decoders(os.path.join(DATA_DIR, record_name), 'atr')
+
+    def test_synthetic_files(self):
+        """
+        Files with the SKIP, AUX, CHAN, NUM and SUB fields.
+        """
+        sample, symbol, field_sets = synthetic_annotations()
+        for name, fields in field_sets:
+            wfdb.wrann(name, 'atr', sample, symbol=symbol,
+                       write_dir=self.temp_dir, **fields)
+            self.check_decoders(os.path.join(self.temp_dir, name), 'atr')
+            ann = wfdb.rdann(os.path.join(self.temp_dir, name), 'atr')
+            np.testing.assert_array_equal(ann.sample, sample)
+
+
+class TestRhythmIndex(unittest.TestCase):
+    """
+    Test the rhythm episode index.
+    """
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_no_rhythm_notes(self):
+        """
+        Annotations without any rhythm change have no episodes.
+        """
+        wfdb.wrann('norhythm', 'atr', np.array([10, 200, 400, 650]),
+                   symbol=['N', 'N', 'V', 'N'], write_dir=self.temp_dir)
+        ann = wfdb.rdann(os.path.join(self.temp_dir, 'norhythm'), 'atr')
+        rhythm_index = wfdb.RhythmIndex([ann])
+
+        self.assertEqual(len(rhythm_index.start), 0)
+        np.testing.assert_array_equal(rhythm_index.ann_rhythm, [-1] * 4)
+        np.testing.assert_array_equal(
+            rhythm_index.rhythm_at('norhythm', [0, 200, 1000]), [''] * 3)
+        record, sample = rhythm_index.annotations_in_rhythm('V', '(N')
+        self.assertEqual(len(sample), 0)
+
+    def test_bundled_records(self):
+        """
+        The rhythm of the annotations matches the last rhythm change
+        before them.
+        """
+        anns = [wfdb.rdann(os.path.join(DATA_DIR, record_name), 'atr')
+                for record_name in ['100', '203']]
+        rhythm_index = wfdb.RhythmIndex(anns)
+
+        for record, ann in enumerate(anns):
+            rhythm = ''
+            expected = []
+            for symbol, aux_note in zip(ann.symbol, ann.aux_note):
+                if symbol == '+' and aux_note.rstrip('\x00'):
+                    rhythm = aux_note.rstrip('\x00')
+                expected.append(rhythm)
+            np.testing.assert_array_equal(
+                rhythm_index.rhythm_at(record, ann.sample), expected)
+
+
+class TestAnnotationIndex(unittest.TestCase):
+    """
+    Test the checkpoint index of annotation files.
+    """
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.record_name = os.path.join(self.temp_dir, '100')
+        ann = wfdb.rdann(os.path.join(DATA_DIR, '100'), 'atr')
+        self.sample = ann.sample
+        self.symbol = ann.symbol
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, sample, write_index):
+        wfdb.wrann('100', 'atr', sample, symbol=self.symbol,
+                   write_dir=self.temp_dir, write_index=write_index)
+
+    def check_window(self, sampfrom, sampto):
+        """
+        Reading a window with the index matches reading the whole file.
+        """
+        full = wfdb.rdann(self.record_name, 'atr')
+        window = wfdb.rdann(self.record_name, 'atr', sampfrom=sampfrom,
+                            sampto=sampto, use_index=True)
+        in_window = (full.sample >= sampfrom) & (full.sample <= sampto)
+        np.testing.assert_array_equal(window.sample, full.sample[in_window])
+
+    def test_rewrite_without_index(self):
+        """
+        Writing the file without an index removes the existing one.
+        """
+        self.write(self.sample, write_index=True)
+        self.assertIsNotNone(wfdb.io.annotation.rd_ann_index(
+            self.record_name, 'atr'))
+
+        self.write(self.sample + 500, write_index=False)
+        self.assertFalse(os.path.exists(self.record_name + '.atr.idx'))
+        self.check_window(300000, 400000)
+
+    def test_rewrite_same_size(self):
+        """
+        An index does not match a file rewritten with the same size.
+        """
+        self.write(self.sample, write_index=True)
+        with open(self.record_name + '.atr.idx', 'rb') as f:
+            index_bytes = f.read()
+        file_size = os.path.getsize(self.record_name + '.atr')
+
+        # Shift the annotations, keeping the file size, and restore the
+        # previous index
+        self.write(self.sample + 100, write_index=False)
+        self.assertEqual(os.path.getsize(self.record_name + '.atr'),
+                         file_size)
+        with open(self.record_name + '.atr.idx', 'wb') as f:
+            f.write(index_bytes)
+        file_stat = os.stat(self.record_name + '.atr')
+        os.utime(self.record_name + '.atr',
+                 ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns + 1000))
+
+        self.assertIsNone(wfdb.io.annotation.rd_ann_index(
+            self.record_name, 'atr'))
+        self.check_window(300000, 400000)
+
+    def test_corrupt_index(self):
+        """
+        A truncated or empty index is ignored, and reads fall back to
+        decoding the whole file.
+        """
+        self.write(self.sample, write_index=True)
+        # No temporary file is left over
+        self.assertEqual(sorted(os.listdir(self.temp_dir)),
+                         ['100.atr', '100.atr.idx'])
+        with open(self.record_name + '.atr.idx', 'rb') as f:
+            index_bytes = f.read()
+
+        for corrupt_bytes in [index_bytes[:len(index_bytes) // 2], b'']:
+            with open(self.record_name + '.atr.idx', 'wb') as f:
+                f.write(corrupt_bytes)
+            self.assertIsNone(wfdb.io.annotation.rd_ann_index(
+                self.record_name, 'atr'))
+            self.check_window(300000, 400000)
+
+
+class TestCompactAnnotation(unittest.TestCase):
+    """
+    Test that compact annotations read by `rdann` match the ones
+    converted from Annotation objects.
+    """
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        # Annotations with custom labels
+        ann = wfdb.rdann(os.path.join(DATA_DIR, '100'), 'atr')
+        symbol = list(ann.symbol)
+        symbol[5] = 's'
+        symbol[7] = 'v'
+        wfdb.wrann('100', 'cus', ann.sample, symbol=symbol,
+                   aux_note=ann.aux_note, fs=360,
+                   custom_labels=[('s', 'Custom S'), ('v', 'Custom V')],
+                   write_dir=self.temp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def check_equal(self, compact_ann, expected):
+        self.assertEqual(compact_ann.record_name, expected.record_name)
+        self.assertEqual(compact_ann.fs, expected.fs)
+        self.assertEqual(len(compact_ann), len(expected))
+        for field in ['sample', 'label_store', 'subtype', 'chan', 'num',
+                      'aux_inds']:
+            self.assertEqual(getattr(compact_ann, field).dtype,
+                             getattr(expected, field).dtype)
+            np.testing.assert_array_equal(getattr(compact_ann, field),
+                                          getattr(expected, field))
+        for field in ['aux_strings', 'symbol', 'description', 'aux_note']:
+            self.assertEqual(getattr(compact_ann, field),
+                             getattr(expected, field))
+        for field in ['custom_labels', 'contained_labels']:
+            if getattr(expected, field) is None:
+                self.assertIsNone(getattr(compact_ann, field))
+            else:
+                self.assertTrue(getattr(compact_ann, field).equals(
+                    getattr(expected, field)))
+
+    def test_read_compact(self):
+        files = [(os.path.join(DATA_DIR, record_name), 'atr')
+                 for record_name in ['100', '101', '102', '203']]
+        files.append((os.path.join(self.temp_dir, '100'), 'cus'))
+        for record_name, extension in files:
+            for kwargs in [{}, {'sampto': 100000},
+                           {'sampfrom': 50000, 'sampto': 200000,
+                            'shift_samps': True},
+                           {'summarize_labels': True}]:
+                ann = wfdb.rdann(record_name, extension,
+                                 return_label_elements=['label_store',
+                                                        'symbol'], **kwargs)
+                compact_ann = wfdb.rdann(record_name, extension,
+                                         compact=True, **kwargs)
+                self.check_equal(compact_ann, ann.to_compact())
+
+                # Round trip back to an Annotation
+                self.assertEqual(compact_ann.to_annotation(
+                    ['label_store', 'symbol']), ann)
+
+    def test_symbol(self):
+        record_name = os.path.join(self.temp_dir, '100')
+        ann = wfdb.rdann(record_name, 'cus')
+        compact_ann = wfdb.rdann(record_name, 'cus', compact=True)
+        self.assertEqual(compact_ann.symbol, ann.symbol)
+        self.assertEqual(compact_ann.symbol[5:8], ['s', 'N', 'v'])
+        self.assertEqual(compact_ann.description[5], 'Custom S')
+
+        table = annotation.AnnotationTable(
+            ['101', '100'], 'atr', record=[0, 0, 1, 1],
+            sample=[1, 2, 3, 4], label_store=[1, 42, 1, 42],
+            subtype=[0] * 4, chan=[0] * 4, num=[0] * 4,
+            aux_index=[-1] * 4, aux_strings=[],
+            custom_labels=[None, compact_ann.custom_labels])
+        self.assertEqual(list(table.symbol), ['N', None, 'N', 's'])
+
+
+    def test_label_lookup_cached(self):
+        compact_ann = wfdb.rdann(os.path.join(self.temp_dir, '100'), 'cus',
+                                 compact=True)
+        table = annotation.AnnotationTable(
+            ['100', '100'], 'cus', record=[0, 1], sample=[1, 2],
+            label_store=[42, 42], subtype=[0, 0], chan=[0, 0], num=[0, 0],
+            aux_index=[-1, -1], aux_strings=[],
+            custom_labels=[compact_ann.custom_labels] * 2)
+        with mock.patch.object(annotation, 'label_store_lookup',
+                               wraps=annotation.label_store_lookup) as lookup:
+            for _ in range(3):
+                self.assertEqual(compact_ann.symbol[5], 's')
+                self.assertEqual(compact_ann.description[7], 'Custom V')
+                self.assertEqual(list(table.symbol), ['s', 's'])
+            custom_calls = [c for c in lookup.call_args_list if c[0]]
+            self.assertEqual(len(custom_calls), 2)
+
+            # New custom labels are looked up again
+            custom_labels = compact_ann.custom_labels.copy()
+            custom_labels['symbol'] = ['x', 'y']
+            compact_ann.custom_labels = custom_labels
+            self.assertEqual(compact_ann.symbol[5], 'x')
+
+
+class TestAnnotationWriter(unittest.TestCase):
+    """
+    Test that the files written in batches by AnnotationWriter match the
+    ones written by a single `wrann` call.
+    """
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def check_writer(self, name, sample, batch_ends, fs=None,
+                     custom_labels=None, **fields):
+        wfdb.wrann(name, 'wrann', sample, fs=fs, custom_labels=custom_labels,
+                   write_dir=self.temp_dir, **fields)
+        with wfdb.AnnotationWriter(name, 'batch', fs=fs,
+                                   custom_labels=custom_labels,
+                                   write_dir=self.temp_dir,
+                                   flush_interval=100) as writer:
+            for start, end in zip([0] + batch_ends, batch_ends + [None]):
+                writer.write(sample[start:end],
+                             **{field: values[start:end]
+                                for field, values in fields.items()})
+        file_bytes = []
+        for extension in ['wrann', 'batch']:
+            with open(os.path.join(self.temp_dir, name + '.' + extension),
+                      'rb') as f:
+                file_bytes.append(f.read())
+        self.assertEqual(file_bytes[0], file_bytes[1])
+
+    def test_bundled_files(self):
+        for record_name in ['100', '101', '102', '203']:
+            ann = wfdb.rdann(os.path.join(DATA_DIR, record_name), 'atr')
+            self.check_writer(record_name, ann.sample, [1, 50, 51, 1500],
+                              fs=ann.fs, symbol=ann.symbol,
+                              subtype=np.abs(ann.subtype), chan=ann.chan,
+                              num=ann.num, aux_note=ann.aux_note)
+
+    def test_synthetic_files(self):
+        sample, symbol, field_sets = synthetic_annotations()
+        rng = np.random.RandomState(1)
+        batch_ends = sorted(rng.choice(np.arange(1, len(sample)), 40,
+                                       replace=False).tolist())
+        for name, fields in field_sets:
+            self.check_writer(name, sample, batch_ends, symbol=symbol,
+                              **fields)
+
+    def test_custom_labels(self):
+        ann = wfdb.rdann(os.path.join(DATA_DIR, '100'), 'atr')
+        symbol = list(ann.symbol)
+        symbol[5] = 's'
+        self.check_writer('100', ann.sample, [3, 1000], fs=360,
+                          custom_labels=[('s', 'Custom S')], symbol=symbol,
+                          aux_note=ann.aux_note)
+        self.assertEqual(wfdb.rdann(os.path.join(self.temp_dir, '100'),
+                                    'batch').symbol, symbol)
+
+    def test_write_index(self):
+        ann = wfdb.rdann(os.path.join(DATA_DIR, '203'), 'atr')
+        with wfdb.AnnotationWriter('203', 'batch', fs=360,
+                                   write_dir=self.temp_dir,
+                                   write_index=True) as writer:
+            for start in range(0, len(ann.sample), 500):
+                writer.write(ann.sample[start:start + 500],
+                             symbol=ann.symbol[start:start + 500])
+        record_name = os.path.join(self.temp_dir, '203')
+        self.assertIsNotNone(annotation.rd_ann_index(record_name, 'batch'))
+        window = wfdb.rdann(record_name, 'batch', sampfrom=300000,
+                            sampto=400000, use_index=True)
+        expected = wfdb.rdann(os.path.join(DATA_DIR, '203'), 'atr',
+                              sampfrom=300000, sampto=400000)
+        np.testing.assert_array_equal(window.sample, expected.sample)
+        self.assertEqual(window.symbol, expected.symbol)
+
+
+class TestReadAnnotations(unittest.TestCase):
+    """
+    Test that the annotation tables read by `rdanns` match the
+    annotations read by `rdann`.
+    """
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        # Annotations with custom labels
+        ann = wfdb.rdann(os.path.join(DATA_DIR, '100'), 'atr')
+        symbol = list(ann.symbol)
+        symbol[5] = 's'
+        wfdb.wrann('custom', 'atr', ann.sample, symbol=symbol,
+                   aux_note=ann.aux_note, fs=250,
+                   custom_labels=[('s', 'Custom S')],
+                   write_dir=self.temp_dir)
+        self.record_names = [os.path.join(DATA_DIR, record_name)
+                             for record_name in ['100', '101', '102', '203']]
+        self.record_names.insert(2, os.path.join(self.temp_dir, 'custom'))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_rdanns(self):
+        for kwargs in [{}, {'sampfrom': 100000, 'sampto': 300000}]:
+            anns = [wfdb.rdann(record_name, 'atr',
+                               return_label_elements=['label_store',
+                                                      'symbol'], **kwargs)
+                    for record_name in self.record_names]
+            for workers in [1, 2]:
+                table = wfdb.rdanns(self.record_names, 'atr', workers=workers,
+                                    **kwargs)
+                self.assertEqual(table.record_names, self.record_names)
+                self.assertEqual(len(table), sum(len(ann.sample)
+                                                 for ann in anns))
+                np.testing.assert_array_equal(
+                    table.record, np.repeat(np.arange(len(anns)),
+                                            [len(ann.sample) for ann in anns]))
+                for field in ['sample', 'label_store', 'subtype', 'chan',
+                              'num']:
+                    np.testing.assert_array_equal(
+                        getattr(table, field),
+                        np.concatenate([getattr(ann, field) for ann in anns]))
+                self.assertEqual(list(table.symbol),
+                                 sum([ann.symbol for ann in anns], []))
+                self.assertEqual(table.aux_note,
+                                 sum([ann.aux_note for ann in anns], []))
+                self.assertEqual(table.fs, [360, 360, 250, 360, 360])
+                self.assertEqual([c is not None for c in table.custom_labels],
+                                 [False, False, True, False, False])
+
+                structured = table.to_structured()
+                np.testing.assert_array_equal(structured['sample'],
+                                              table.sample)
+                df = table.to_pandas()
+                self.assertEqual(list(df['record'].cat.categories),
+                                 self.record_names)
+                np.testing.assert_array_equal(df['label_store'].values,
+                                              table.label_store)
+
+    def test_empty(self):
+        table = wfdb.rdanns([], 'atr')
+        self.assertEqual(len(table), 0)
+        self.assertEqual(list(table.symbol), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
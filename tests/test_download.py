@@ -0,0 +1,317 @@
+import concurrent.futures
+import hashlib
+import os
+import posixpath
+import shutil
+import tempfile
+import threading
+import types
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import libs.wfdb as wfdb
+from libs.wfdb.io import download
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'ecg_data')
+
+RECORD_NAMES = ['100', '101', '102', '203']
+
+N_THREADS = 32
+
+
+def local_fetcher(db_index_url, bad_urls):
+    """
+    Get a remote content fetcher serving the bundled files, for reads
+    using the database index url `db_index_url`. Requested urls from
+    other locations are added to `bad_urls`.
+    """
+    def fetcher(method, url, byte_range):
+        if not url.startswith(db_index_url):
+            bad_urls.append(url)
+        file_name = os.path.join(DATA_DIR, posixpath.basename(url))
+        if method == 'HEAD':
+            return os.path.getsize(file_name)
+        with open(file_name, 'rb') as f:
+            if byte_range is None:
+                return f.read()
+            f.seek(byte_range[0])
+            return f.read(byte_range[1])
+
+    return fetcher
+
+
+class TestConcurrentReads(unittest.TestCase):
+    """
+    Test reading records from many threads at once, each streaming from
+    its own database index url.
+    """
+    def read(self, record_name, db_index_url, bad_urls, barrier):
+        barrier.wait()
+        token = download._remote_fetcher.set(local_fetcher(db_index_url,
+                                                           bad_urls))
+        try:
+            with download.use_db_index_url(db_index_url):
+                remote_record = wfdb.rdrecord(record_name, pb_dir='mitdb',
+                                              physical=False)
+                remote_ann = wfdb.rdann(record_name, 'atr', pb_dir='mitdb')
+                self.assertEqual(download.get_db_index_url(), db_index_url)
+        finally:
+            download._remote_fetcher.reset(token)
+        local_record = wfdb.rdrecord(os.path.join(DATA_DIR, record_name))
+        local_ann = wfdb.rdann(os.path.join(DATA_DIR, record_name), 'atr')
+
+        return remote_record, remote_ann, local_record, local_ann
+
+    def test_threads_with_index_urls(self):
+        expected = {}
+        for record_name in RECORD_NAMES:
+            path = os.path.join(DATA_DIR, record_name)
+            expected[record_name] = (
+                wfdb.rdrecord(path, physical=False).d_signal,
+                wfdb.rdrecord(path).p_signal, wfdb.rdann(path, 'atr'))
+
+        bad_urls = []
+        barrier = threading.Barrier(N_THREADS)
+        with concurrent.futures.ThreadPoolExecutor(N_THREADS) as executor:
+            futures = [executor.submit(
+                self.read, RECORD_NAMES[i % len(RECORD_NAMES)],
+                'http://mirror-%d.invalid/' % i, bad_urls, barrier)
+                for i in range(N_THREADS)]
+            results = [future.result() for future in futures]
+
+        self.assertEqual(bad_urls, [])
+        self.assertEqual(download.get_db_index_url(),
+                         download.config.db_index_url)
+        for i, result in enumerate(results):
+            record_name = RECORD_NAMES[i % len(RECORD_NAMES)]
+            d_signal, p_signal, ann = expected[record_name]
+            remote_record, remote_ann, local_record, local_ann = result
+            np.testing.assert_array_equal(remote_record.d_signal, d_signal)
+            np.testing.assert_array_equal(local_record.p_signal, p_signal)
+            for read_ann in [remote_ann, local_ann]:
+                np.testing.assert_array_equal(read_ann.sample, ann.sample)
+                self.assertEqual(read_ann.symbol, ann.symbol)
+                self.assertEqual(read_ann.aux_note, ann.aux_note)
+
+
+class ListingServer(object):
+    """
+    Stand-in for `requests.get` serving listings with an ETag, which
+    answers conditional requests with 304 when the listing is unchanged.
+    """
+    def __init__(self, listings):
+        self.listings = listings
+        self.requests = []
+
+    def get(self, url, headers=None):
+        headers = headers or {}
+        self.requests.append((url, headers))
+        if url not in self.listings:
+            return types.SimpleNamespace(status_code=404, content=b'',
+                                         headers={})
+        content = self.listings[url]
+        etag = '"%d"' % hash(content)
+        if headers.get('If-None-Match') == etag:
+            return types.SimpleNamespace(status_code=304, content=b'',
+                                         headers={'etag': etag})
+        return types.SimpleNamespace(status_code=200, content=content,
+                                     headers={'etag': etag})
+
+
+class TestMetadataCache(unittest.TestCase):
+    """
+    Test the cache of remote metadata listings.
+    """
+    url = 'http://mirror.invalid/mitdb/RECORDS'
+
+    def setUp(self):
+        self.ttl = download.config.cache_ttl
+        self.cache_dir = download.config.cache_dir
+        self.temp_dir = tempfile.mkdtemp()
+        download.clear_metadata_cache()
+        self.server = ListingServer({self.url: b'100\n101\n'})
+        self.patch = mock.patch.object(download.requests, 'get',
+                                       self.server.get)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        download.clear_metadata_cache()
+        download.set_metadata_cache(self.ttl, self.cache_dir)
+        shutil.rmtree(self.temp_dir)
+
+    def expire(self):
+        """
+        Make the cached entries older than the ttl.
+        """
+        for entry in download._metadata_cache.values():
+            entry['time'] -= download.config.cache_ttl + 1
+
+    def test_fresh_entries(self):
+        download.set_metadata_cache(ttl=60)
+        for _ in range(3):
+            self.assertEqual(download._get_listing(self.url),
+                             (200, b'100\n101\n'))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_ttl_expiry(self):
+        download.set_metadata_cache(ttl=60)
+        download._get_listing(self.url)
+        self.expire()
+        self.server.listings[self.url] = b'100\n101\n102\n'
+        self.assertEqual(download._get_listing(self.url),
+                         (200, b'100\n101\n102\n'))
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertIn('If-None-Match', self.server.requests[1][1])
+
+    def test_revalidation(self):
+        download.set_metadata_cache(ttl=60)
+        download._get_listing(self.url)
+        self.expire()
+        self.assertEqual(download._get_listing(self.url),
+                         (200, b'100\n101\n'))
+        self.assertEqual(len(self.server.requests), 2)
+        # The 304 response refreshes the entry
+        self.assertEqual(download._get_listing(self.url),
+                         (200, b'100\n101\n'))
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_cache_dir(self):
+        download.set_metadata_cache(ttl=60, cache_dir=self.temp_dir)
+        download._get_listing(self.url)
+        download._metadata_cache.clear()
+        self.assertEqual(download._get_listing(self.url),
+                         (200, b'100\n101\n'))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_disabled(self):
+        download.set_metadata_cache(ttl=0)
+        for _ in range(3):
+            self.assertEqual(download._get_listing(self.url),
+                             (200, b'100\n101\n'))
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.server.requests[-1][1], {})
+        self.assertEqual(download._metadata_cache, {})
+
+    def test_file_sizes_not_cached(self):
+        download.set_metadata_cache(ttl=60)
+        sizes = [100, 200]
+        token = download._remote_fetcher.set(
+            lambda method, url, byte_range: sizes.pop(0))
+        try:
+            self.assertEqual(download._remote_file_size(self.url), 100)
+            self.assertEqual(download._remote_file_size(self.url), 200)
+        finally:
+            download._remote_fetcher.reset(token)
+        self.assertEqual(download._metadata_cache, {})
+
+
+class TestManifestSync(unittest.TestCase):
+    """
+    Test the incremental sync of database files using the checksum
+    manifest.
+    """
+    db_index_url = 'http://mirror.invalid/'
+
+    def setUp(self):
+        self.dl_dir = tempfile.mkdtemp()
+        # Database files, one of them in a subdirectory
+        self.files = {}
+        for file in ['100.hea', '100.atr', 'data/101.hea']:
+            with open(os.path.join(DATA_DIR, posixpath.basename(file)),
+                      'rb') as f:
+                self.files[file] = f.read()
+        self.manifest = {file: hashlib.sha256(content).hexdigest()
+                         for file, content in self.files.items()}
+        self.requests = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dl_dir)
+
+    def fetcher(self, method, url, byte_range):
+        self.requests.append((method, url))
+        content = self.files[url[len(self.db_index_url + 'mitdb/'):]]
+        if method == 'HEAD':
+            return len(content)
+        return content
+
+    def sync(self, files=None, remote_manifest=None):
+        token = download._remote_fetcher.set(self.fetcher)
+        try:
+            with download.use_db_index_url(self.db_index_url):
+                return download.sync_files(
+                    'mitdb', self.dl_dir, files or list(self.files),
+                    remote_manifest=remote_manifest or self.manifest)
+        finally:
+            download._remote_fetcher.reset(token)
+
+    def local_content(self, file):
+        with open(os.path.join(self.dl_dir, file), 'rb') as f:
+            return f.read()
+
+    def test_parse_manifest(self):
+        content = ('# SHA256 digests\n'
+                   '%s  100.hea\n'
+                   '%s *./100.atr\n'
+                   '\n'
+                   '%s  data/101.hea\n'
+                   % (self.manifest['100.hea'].upper(),
+                      self.manifest['100.atr'],
+                      self.manifest['data/101.hea']))
+        self.assertEqual(download._parse_manifest(content), self.manifest)
+
+    def test_skip_unchanged(self):
+        self.assertEqual(self.sync(), list(self.files))
+        for file, content in self.files.items():
+            self.assertEqual(self.local_content(file), content)
+        self.assertEqual(len(self.requests), 3)
+
+        self.requests = []
+        self.assertEqual(self.sync(), [])
+        self.assertEqual(self.requests, [])
+        # Recorded in the local manifest, so not hashed again
+        with mock.patch.object(download, '_file_sha256') as file_sha256:
+            self.assertEqual(self.sync(), [])
+        file_sha256.assert_not_called()
+
+    def test_digest_mismatch(self):
+        self.sync()
+        with open(os.path.join(self.dl_dir, '100.atr'), 'r+b') as f:
+            f.write(b'\0\0')
+        self.requests = []
+        self.assertEqual(self.sync(), ['100.atr'])
+        self.assertEqual(self.requests,
+                         [('GET', self.db_index_url + 'mitdb/100.atr')])
+        self.assertEqual(self.local_content('100.atr'), self.files['100.atr'])
+
+        # Downloaded content not matching the manifest is not kept
+        self.files['100.atr'] = b'\0\0'
+        os.remove(os.path.join(self.dl_dir, '100.atr'))
+        with self.assertRaises(ValueError):
+            self.sync()
+        self.assertFalse(os.path.exists(os.path.join(self.dl_dir, '100.atr')))
+        self.assertFalse(os.path.exists(os.path.join(self.dl_dir,
+                                                     '100.atr.part')))
+
+    def test_files_without_digest(self):
+        self.sync()
+        manifest = {'100.hea': self.manifest['100.hea']}
+        self.requests = []
+        self.assertEqual(self.sync(remote_manifest=manifest), [])
+        self.assertEqual(sorted(self.requests),
+                         [('HEAD', self.db_index_url + 'mitdb/100.atr'),
+                          ('HEAD', self.db_index_url + 'mitdb/data/101.hea')])
+
+        # Files of a different size are downloaded again
+        with open(os.path.join(self.dl_dir, '100.atr'), 'ab') as f:
+            f.write(b'\0\0')
+        self.assertEqual(self.sync(remote_manifest=manifest), ['100.atr'])
+        self.assertEqual(self.local_content('100.atr'), self.files['100.atr'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import unittest
+
+import numpy as np
+
+import libs.wfdb as wfdb
+from libs.wfdb import processing
+
+from .test_qrs import DATA_DIR, RECORD_NAMES
+
+
+def loop_find_local_peaks(sig, radius):
+    """
+    Find the local peaks of a 1d signal with the original loop, taking
+    the max of the window around one sample at a time.
+    """
+    if np.min(sig) == np.max(sig):
+        return np.empty(0)
+
+    peak_inds = []
+
+    i = 0
+    while i < radius + 1:
+        if sig[i] == max(sig[:i + radius]):
+            peak_inds.append(i)
+            i += radius
+        else:
+            i += 1
+
+    while i < len(sig):
+        if sig[i] == max(sig[i - radius:i + radius]):
+            peak_inds.append(i)
+            i += radius
+        else:
+            i += 1
+
+    return np.array(peak_inds)
+
+
+def loop_soft_peaks(sig):
+    """
+    Find the soft peaks of a signal with the original loop, walking
+    along the flat run after each +-1 slope change.
+    """
+    tmp = sig - np.append(sig[1:], [sig[-1]])
+    tmp = np.sign(tmp)
+    tmp = tmp - np.append(tmp[1:], [0])
+
+    soft_peaks = []
+    for iv in np.where(np.logical_or(tmp == -1, tmp == +1))[0]:
+        t = tmp[iv]
+        i = iv + 1
+        while True:
+            if i == len(tmp) or tmp[i] == -t or tmp[i] == -2 or tmp[i] == 2:
+                break
+            if tmp[i] == t:
+                soft_peaks.append(int(iv + (i - iv) / 2))
+                break
+            i += 1
+    return np.array(soft_peaks, dtype='int') + 1
+
+
+def peak_signals(n_samples=3000, seed=0):
+    """
+    Get signals with plateaus, repeated maxima and flat stretches, and
+    stretches of bundled records.
+    """
+    rng = np.random.RandomState(seed)
+    signals = [rng.randint(0, 4, n_samples),
+               rng.randint(0, 50, n_samples),
+               np.repeat(rng.randint(0, 5, n_samples // 10), 10),
+               np.cumsum(rng.randint(-1, 2, n_samples)),
+               np.sin(np.arange(n_samples) / 20.0),
+               np.concatenate([np.zeros(100), np.ones(5), np.zeros(100)])]
+    for record_name in RECORD_NAMES:
+        signals.append(wfdb.rdrecord(os.path.join(DATA_DIR, record_name),
+                                     sampto=20000).p_signal[:, 0])
+    return signals
+
+
+class TestFindLocalPeaks(unittest.TestCase):
+    """
+    Test the sliding window max local peaks against the original loop.
+    """
+    def test_reference_loop(self):
+        for sig in peak_signals():
+            for radius in [1, 2, 3, 7, 25, 90]:
+                peak_inds = processing.find_local_peaks(sig, radius)
+                np.testing.assert_array_equal(
+                    peak_inds, loop_find_local_peaks(sig, radius))
+
+    def test_2d(self):
+        sig = np.column_stack(peak_signals()[:4])
+        for radius in [2, 25]:
+            expected = [loop_find_local_peaks(sig[:, ch], radius)
+                        for ch in range(sig.shape[1])]
+            for axis, sig_2d in [(0, sig), (1, sig.T)]:
+                peak_inds = processing.find_local_peaks(sig_2d, radius,
+                                                        axis=axis)
+                self.assertEqual(len(peak_inds), len(expected))
+                for inds, expected_inds in zip(peak_inds, expected):
+                    np.testing.assert_array_equal(inds, expected_inds)
+
+    def test_flat_signal(self):
+        self.assertEqual(len(processing.find_local_peaks(np.ones(50), 5)), 0)
+        with self.assertRaises(ValueError):
+            processing.find_local_peaks(np.arange(10), 0)
+
+
+class TestFindPeaks(unittest.TestCase):
+    """
+    Test the run-length encoded soft peaks against the original loop.
+    """
+    def test_reference_loop(self):
+        for sig in peak_signals() + [np.array([1, 2, 2, 1]),
+                                     np.array([3, 3, 3]), np.array([5])]:
+            hard_peaks, soft_peaks = processing.find_peaks(sig)
+            np.testing.assert_array_equal(soft_peaks, loop_soft_peaks(sig))
+            self.assertEqual(soft_peaks.dtype.kind, 'i')
+
+    def test_empty(self):
+        hard_peaks, soft_peaks = processing.find_peaks(np.array([]))
+        self.assertEqual(len(hard_peaks), 0)
+        self.assertEqual(len(soft_peaks), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
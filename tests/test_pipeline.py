@@ -0,0 +1,92 @@
+import os
+import posixpath
+import threading
+import unittest
+
+import numpy as np
+
+import libs.wfdb as wfdb
+from libs.wfdb.io import download
+from libs.wfdb.io import pipeline
+
+from .test_download import DATA_DIR, RECORD_NAMES, local_fetcher
+
+
+DB_INDEX_URL = 'http://mirror.invalid/'
+
+
+class TestPipeline(unittest.TestCase):
+    """
+    Test the pipelined reading of remote records against the blocking
+    reading functions.
+    """
+    def setUp(self):
+        self.bad_urls = []
+        self.requests = []
+        self.requested = {}
+        fetcher = local_fetcher(DB_INDEX_URL, self.bad_urls)
+
+        def logged_fetcher(method, url, byte_range):
+            self.requests.append((method, url, byte_range))
+            self.requested.setdefault(posixpath.basename(url),
+                                      threading.Event()).set()
+            return fetcher(method, url, byte_range)
+
+        self.token = download._remote_fetcher.set(logged_fetcher)
+        self.index_url = download.use_db_index_url(DB_INDEX_URL)
+        self.index_url.__enter__()
+
+    def tearDown(self):
+        self.index_url.__exit__(None, None, None)
+        download._remote_fetcher.reset(self.token)
+        self.assertEqual(self.bad_urls, [])
+
+    def check_record(self, record_name, rec, annotations, **kwargs):
+        expected = wfdb.rdrecord(os.path.join(DATA_DIR, record_name),
+                                 **kwargs)
+        np.testing.assert_array_equal(rec.p_signal, expected.p_signal)
+        self.assertEqual(rec.sig_name, expected.sig_name)
+        expected_ann = wfdb.rdann(os.path.join(DATA_DIR, record_name), 'atr')
+        self.assertEqual(len(annotations), 1)
+        np.testing.assert_array_equal(annotations[0].sample,
+                                      expected_ann.sample)
+        self.assertEqual(annotations[0].symbol, expected_ann.symbol)
+        self.assertEqual(annotations[0].fs, expected_ann.fs)
+
+    def test_rdrecord_remote(self):
+        kwargs = {'sampfrom': 360, 'sampto': 7200, 'channels': [1]}
+        rec, annotations = pipeline.rdrecord_remote(
+            '203', 'mitdb', ann_extensions=['atr'], **kwargs)
+        self.check_record('203', rec, annotations, **kwargs)
+        # Each request is performed once
+        self.assertEqual(len(set(self.requests)), len(self.requests))
+
+    def test_iter_records(self):
+        for prefetch in [0, 2]:
+            self.requests = []
+            read = list(pipeline.iter_records('mitdb', RECORD_NAMES,
+                                              ann_extensions=['atr'],
+                                              prefetch=prefetch,
+                                              sampto=3600))
+            self.assertEqual([r[0] for r in read], RECORD_NAMES)
+            for record_name, rec, annotations in read:
+                self.check_record(record_name, rec, annotations, sampto=3600)
+            self.assertEqual(len(set(self.requests)), len(self.requests))
+
+    def test_read_ahead(self):
+        records = pipeline.iter_records('mitdb', RECORD_NAMES,
+                                        ann_extensions=['atr'], prefetch=2)
+        try:
+            record_name, rec, annotations = next(records)
+            self.assertEqual(record_name, '100')
+            # The next records are fetched while the first is processed
+            for next_record_name in RECORD_NAMES[1:]:
+                self.assertTrue(self.requested.setdefault(
+                    next_record_name + '.dat',
+                    threading.Event()).wait(timeout=30))
+        finally:
+            records.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
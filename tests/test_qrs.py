@@ -0,0 +1,473 @@
+import os
+import unittest
+from multiprocessing import shared_memory
+
+import numpy as np
+from scipy import signal
+from sklearn.preprocessing import normalize
+
+import libs.wfdb as wfdb
+from libs.wfdb import processing
+from libs.wfdb.processing import qrs
+from libs.wfdb.processing.qrs import GQRS
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'ecg_data')
+
+RECORD_NAMES = ['100', '101', '102', '203']
+
+
+class TestXQRSStream(unittest.TestCase):
+    """
+    Test streaming xqrs detection.
+    """
+    def test_chunk_sizes(self):
+        """
+        The detections don't depend on the chunk size. Backsearch
+        reaches peaks of earlier chunks.
+        """
+        for ch in range(2):
+            sig = wfdb.rdrecord(os.path.join(DATA_DIR, '203'), channels=[ch],
+                                sampto=100000).p_signal[:, 0]
+            detections = []
+            for chunk_size in [len(sig), 10, 97, 200]:
+                xqrs = processing.XQRSStream(fs=360)
+                qrs_inds = [xqrs.process_chunk(sig[i:i + chunk_size])
+                            for i in range(0, len(sig), chunk_size)]
+                qrs_inds.append(xqrs.finish())
+                detections.append(np.concatenate(qrs_inds))
+            for qrs_inds in detections[1:]:
+                np.testing.assert_array_equal(qrs_inds, detections[0])
+
+
+class TestXQRSBatch(unittest.TestCase):
+    """
+    Test the batch xqrs detection against the detection of each signal.
+    """
+    def test_workers(self):
+        signals = []
+        for record_name in RECORD_NAMES:
+            sig = wfdb.rdrecord(os.path.join(DATA_DIR, record_name),
+                                sampto=60000).p_signal
+            signals.extend([sig[:, 0], sig[:40000, 1]])
+        expected = [processing.xqrs_detect(sig, fs=360, verbose=False)
+                    for sig in signals]
+
+        for workers in [1, 2]:
+            qrs_offsets, qrs_inds, times = processing.xqrs_detect_batch(
+                signals, fs=360, workers=workers)
+            self.assertEqual(len(qrs_offsets), len(signals) + 1)
+            self.assertEqual(len(times), len(signals))
+            for i, expected_inds in enumerate(expected):
+                np.testing.assert_array_equal(
+                    qrs_inds[qrs_offsets[i]:qrs_offsets[i + 1]],
+                    expected_inds)
+
+    def test_detach_shared_signal(self):
+        sig = np.arange(10, dtype='float64')
+        shm = shared_memory.SharedMemory(create=True, size=sig.nbytes)
+        try:
+            np.ndarray(10, dtype='float64', buffer=shm.buf)[:] = sig
+            qrs._attach_shared_signal(shm.name, 10)
+            np.testing.assert_array_equal(qrs._shared_signal, sig)
+            attached = qrs._shared_memory
+            qrs._detach_shared_signal()
+            self.assertIsNone(qrs._shared_signal)
+            self.assertIsNone(qrs._shared_memory)
+            self.assertIsNone(attached.buf)
+        finally:
+            shm.close()
+            shm.unlink()
+
+
+# The (count, sum) of the xqrs detections of each bundled record
+# channel, with the original float64 filtering
+XQRS_DETECTIONS = {
+    ('100', 0): (2273, 738341717),
+    ('100', 1): (2270, 738013272),
+    ('101', 0): (1868, 595868903),
+    ('101', 1): (3410, 1131058816),
+    ('102', 0): (2187, 709847585),
+    ('102', 1): (1991, 705816986),
+    ('203', 0): (2933, 943118486),
+    ('203', 1): (3158, 1003241553),
+}
+
+
+class TestXQRSPrecision(unittest.TestCase):
+    """
+    Test the xqrs detections with float32 filtering against the
+    original float64 ones.
+    """
+    def test_float32_detections(self):
+        for record_name in RECORD_NAMES:
+            sig = wfdb.rdrecord(os.path.join(DATA_DIR, record_name)).p_signal
+            for ch in range(2):
+                expected = processing.xqrs_detect(sig[:, ch], fs=360,
+                                                  verbose=False)
+                self.assertEqual((len(expected), int(np.sum(expected))),
+                                 XQRS_DETECTIONS[(record_name, ch)])
+                qrs_inds = processing.xqrs_detect(sig[:, ch], fs=360,
+                                                  verbose=False,
+                                                  dtype='float32')
+                # At most one beat moves, by less than 50 ms
+                self.assertEqual(len(qrs_inds), len(expected))
+                self.assertLessEqual(np.sum(qrs_inds != expected), 1)
+                self.assertLess(np.max(np.abs(qrs_inds - expected)), 18)
+
+    def test_keep_signals(self):
+        sig = wfdb.rdrecord(os.path.join(DATA_DIR, '100'), channels=[0],
+                            sampto=20000).p_signal[:, 0]
+        xqrs = processing.XQRS(sig=sig, fs=360)
+        xqrs.detect(verbose=False, dtype='float32')
+        self.assertEqual(xqrs.sig_f.dtype, np.float32)
+        self.assertEqual(xqrs.sig_i.dtype, np.float32)
+        qrs_inds = xqrs.qrs_inds
+
+        xqrs = processing.XQRS(sig=sig, fs=360)
+        xqrs.detect(verbose=False, dtype='float32', keep_signals=False)
+        self.assertIsNone(xqrs.sig_f)
+        self.assertIsNone(xqrs.sig_i)
+        np.testing.assert_array_equal(xqrs.qrs_inds, qrs_inds)
+
+
+class ReferenceXQRS(processing.XQRS):
+    """
+    XQRS with the original learning phase, correlating the window around
+    one peak at a time.
+    """
+    def _learn_init_params(self, n_calib_beats=8):
+        last_qrs_ind = -self.rr_max
+        qrs_inds = []
+        qrs_amps = []
+        noise_amps = []
+
+        ricker_wavelet = signal.ricker(self.qrs_radius * 2, 4)
+        peak_inds_f = processing.find_local_peaks(self.sig_f,
+                                                  self.qrs_radius)
+        peak_nums_r = np.where(peak_inds_f > self.qrs_width)[0]
+        peak_nums_l = np.where(peak_inds_f <= self.sig_len - self.qrs_width)[0]
+        if (not peak_inds_f.size or not peak_nums_r.size
+                or not peak_nums_l.size):
+            self._set_default_init_params()
+            return
+
+        for peak_num in range(peak_nums_r[0], peak_nums_l[-1]):
+            i = peak_inds_f[peak_num]
+            # Windows past the end of the signal used to raise
+            if i + self.qrs_radius > len(self.sig_f):
+                break
+            sig_segment = normalize(
+                self.sig_f[i - self.qrs_radius:i + self.qrs_radius].reshape(
+                    -1, 1), axis=0)
+            xcorr = np.correlate(sig_segment[:, 0], ricker_wavelet)
+            if xcorr > 0.6 and i - last_qrs_ind > self.rr_min:
+                last_qrs_ind = i
+                qrs_inds.append(i)
+                qrs_amps.append(self.sig_i[i])
+            else:
+                noise_amps.append(self.sig_i[i])
+            if len(qrs_inds) == n_calib_beats:
+                break
+
+        if len(qrs_inds) == n_calib_beats:
+            qrs_amp = np.mean(qrs_amps)
+            noise_amp = np.mean(noise_amps) if noise_amps else qrs_amp / 10
+            rr_intervals = np.diff(qrs_inds)
+            rr_intervals = rr_intervals[rr_intervals < self.rr_max]
+            if rr_intervals.any():
+                rr_recent = np.mean(rr_intervals)
+            else:
+                rr_recent = self.rr_init
+            self._set_init_params(
+                qrs_amp_recent=qrs_amp, noise_amp_recent=noise_amp,
+                rr_recent=rr_recent,
+                last_qrs_ind=min(0, qrs_inds[0] - self.rr_min - 1))
+            self.learned_init_params = True
+        else:
+            self._set_default_init_params()
+
+
+def learned_params(xqrs_class, sig, **kwargs):
+    """
+    Get the initial parameters set by the learning phase of xqrs.
+    """
+    xqrs = xqrs_class(sig=sig, fs=360)
+    xqrs.detect(verbose=False, **kwargs)
+    # Rerun the learning on the final filtered signals
+    xqrs._learn_init_params()
+    return (xqrs.learned_init_params, xqrs.qrs_amp_recent,
+            xqrs.noise_amp_recent, xqrs.rr_recent, xqrs.last_qrs_ind,
+            xqrs.qrs_thr)
+
+
+class TestXQRSLearning(unittest.TestCase):
+    """
+    Test the vectorized xqrs learning phase against the original loop.
+    """
+    def check_learning(self, sig, **kwargs):
+        params = learned_params(processing.XQRS, sig, **kwargs)
+        self.assertEqual(params, learned_params(ReferenceXQRS, sig, **kwargs))
+        return params
+
+    def test_records(self):
+        rng = np.random.RandomState(0)
+        for record_name in RECORD_NAMES:
+            sig = wfdb.rdrecord(os.path.join(DATA_DIR, record_name),
+                                sampto=60000).p_signal
+            for ch in range(2):
+                self.assertTrue(self.check_learning(sig[:, ch])[0])
+                self.check_learning(sig[:, ch], sampto=3000)
+                self.check_learning(sig[:, ch] + rng.normal(0, 1, len(sig)))
+
+    def test_synthetic_signals(self):
+        rng = np.random.RandomState(0)
+        for i in range(10):
+            pulses = np.zeros(5000)
+            pulses[rng.randint(0, 5000, 20)] = rng.uniform(1, 5, 20)
+            self.check_learning(np.cumsum(rng.normal(0, 1, 5000)))
+            self.check_learning(np.convolve(pulses, np.hanning(15), 'same'))
+
+
+class TestFilterDesigns(unittest.TestCase):
+    """
+    Test the memoized filter designs and GQRS configurations.
+    """
+    def test_shared_designs(self):
+        sig = wfdb.rdrecord(os.path.join(DATA_DIR, '100'), channels=[0],
+                            sampto=20000).p_signal[:, 0]
+        # A sampling frequency not used by the other tests
+        fs = 361
+        xqrs = processing.XQRS(sig=sig, fs=fs)
+        xqrs.detect(verbose=False)
+        hits = qrs.design_bandpass.cache_info().hits
+        xqrs_2 = processing.XQRS(sig=sig, fs=fs)
+        xqrs_2.detect(verbose=False)
+        stream = processing.XQRSStream(fs=fs)
+        stream.process_chunk(sig)
+        self.assertEqual(qrs.design_bandpass.cache_info().hits, hits + 2)
+        np.testing.assert_array_equal(xqrs_2.qrs_inds, xqrs.qrs_inds)
+
+        b, a, sos, gain = qrs.design_bandpass(fs, 5, 20)
+        self.assertIs(qrs.design_bandpass(fs, 5, 20)[0], b)
+        expected_b, expected_a = signal.butter(2, [10 / fs, 40 / fs], 'pass')
+        np.testing.assert_array_equal(b, expected_b)
+        np.testing.assert_array_equal(a, expected_a)
+        wavelet = qrs.design_mwi(fs, xqrs.qrs_width, 5, 20)[0]
+        np.testing.assert_array_equal(
+            wavelet, signal.ricker(xqrs.qrs_width, 4))
+        # The shared arrays can't be modified
+        for array in [b, a, sos, wavelet]:
+            with self.assertRaises(ValueError):
+                array[0] = 0
+
+    def test_gqrs_conf(self):
+        conf = GQRS.Conf(fs=360, adc_gain=200)
+        expected = dict(vars(conf))
+        # Detection modifies the configuration
+        d_sig = wfdb.rdrecord(os.path.join(DATA_DIR, '100'), channels=[0],
+                              sampto=20000, physical=False).d_signal[:, 0]
+        qrs_inds = GQRS().detect(x=d_sig, conf=conf, adc_zero=1024)
+        self.assertNotEqual(vars(conf), expected)
+        conf.qthr = -1
+
+        new_conf = GQRS.Conf(fs=360, adc_gain=200)
+        self.assertEqual(vars(new_conf), expected)
+        np.testing.assert_array_equal(
+            GQRS().detect(x=d_sig, conf=new_conf, adc_zero=1024), qrs_inds)
+        self.assertNotEqual(GQRS.Conf(fs=360, adc_gain=100).pthr,
+                            new_conf.pthr)
+        for i in range(2):
+            with self.assertRaises(Exception):
+                GQRS.Conf(fs=10, adc_gain=200)
+
+
+class ReferenceGQRS(GQRS):
+    """
+    GQRS with the original smoothing and QRS filters, evaluated one
+    sample at a time.
+    """
+    def at(self, t):
+        return int(self.x[min(max(t, 0), len(self.x) - 1)])
+
+    def smv_at(self, t):
+        return int(self.smv[t & (self.c._BUFLN - 1)])
+
+    def sm_sample(self, at_t):
+        smt = self.c.smt
+        smdt = int(self.c.smdt)
+
+        while at_t > smt:
+            smt += 1
+            if smt > int(self.c.smt0):
+                v = (self.smv_at(smt - 1) + self.at(smt + smdt)
+                     + self.at(smt + smdt - 1) - self.at(smt - smdt)
+                     - self.at(smt - smdt - 1))
+            else:
+                v = self.at(smt)
+                for j in range(1, smdt):
+                    v += self.at(smt + j) + self.at(smt - j)
+                v = ((v << 1) + self.at(smt + smdt) + self.at(smt - smdt)
+                     - self.adc_zero * (smdt << 2))
+            self.smv[smt & (self.c._BUFLN - 1)] = v
+        self.c.smt = smt
+
+        return self.smv_at(at_t)
+
+    def qf(self, t0, t1):
+        c = self.c
+        q = []
+        for t in range(t0, t1 + 1):
+            dv2 = self.sm_sample(t + c.dt4) - self.smv_at(t - c.dt4)
+            dv1 = self.smv_at(t + c.dt) - self.smv_at(t - c.dt)
+            dv = dv1 << 1
+            dv -= self.smv_at(t + c.dt2) - self.smv_at(t - c.dt2)
+            dv = dv << 1
+            dv += dv1
+            dv -= self.smv_at(t + c.dt3) - self.smv_at(t - c.dt3)
+            dv = dv << 1
+            dv += dv2
+            self.v1 += dv
+            v0 = int(self.v1 / c.v1norm)
+            q.append(v0 * v0)
+
+        q = np.array(q, dtype='int64')
+        self.trace('qrs', t0, q)
+        return q
+
+
+def gqrs_fields(gqrs_class, d_sig, fs, adc_gain, adc_zero, **kwargs):
+    """
+    Run gqrs detection, and get the fields of the annotations, the QRS
+    filtered signal, the final smoothed signal buffer and the final
+    configuration.
+    """
+    qrs_filtered = []
+
+    def trace(name, sampfrom, values):
+        if name == 'qrs':
+            qrs_filtered.extend(values.tolist())
+
+    conf = GQRS.Conf(fs=fs, adc_gain=adc_gain, **kwargs)
+    gqrs = gqrs_class(trace=trace)
+    qrs_locs = gqrs.detect(x=d_sig, conf=conf, adc_zero=adc_zero)
+
+    return (qrs_locs, list(gqrs.ann_type), list(gqrs.ann_subtype),
+            list(gqrs.ann_num), qrs_filtered, gqrs.smv.tolist(), vars(conf))
+
+
+class TestGQRS(unittest.TestCase):
+    """
+    Test the gqrs detector against the original filters and the
+    original detections.
+    """
+    def test_reference_filters(self):
+        """
+        Detect with the vectorized and the per sample filters, on
+        segments of the bundled records and resampled signals.
+        """
+        for record_name in RECORD_NAMES:
+            record = wfdb.rdrecord(os.path.join(DATA_DIR, record_name),
+                                   physical=False, sampto=40000)
+            for ch in range(record.n_sig):
+                args = (record.d_signal[:, ch], record.fs,
+                        record.adc_gain[ch], record.adc_zero[ch])
+                self.check_fields(gqrs_fields(GQRS, *args),
+                                  gqrs_fields(ReferenceGQRS, *args))
+
+        d_sig = wfdb.rdrecord(os.path.join(DATA_DIR, '100'), physical=False,
+                              channels=[0], sampto=60000).d_signal[:, 0]
+        for fs in [128, 250, 1000]:
+            inds = (np.arange(len(d_sig) * fs // 360) * 360 // fs)
+            args = (d_sig[inds], fs, 200, 1024)
+            self.check_fields(gqrs_fields(GQRS, *args),
+                              gqrs_fields(ReferenceGQRS, *args))
+
+        # A conf whose thresholds are lowered during learning
+        args = (d_sig[:20000], 360, 200, 1024)
+        self.check_fields(gqrs_fields(GQRS, *args, RRmax=0.3),
+                          gqrs_fields(ReferenceGQRS, *args, RRmax=0.3))
+
+    def check_fields(self, fields, reference_fields):
+        np.testing.assert_array_equal(fields[0], reference_fields[0])
+        for field, reference_field in zip(fields[1:], reference_fields[1:]):
+            self.assertEqual(field, reference_field)
+
+    def test_original_detections(self):
+        """
+        The detections on the full bundled records match those of the
+        original implementation: their number, sum, and first and last
+        locations.
+        """
+        expected = {
+            ('100', 0): (2272, 738313452, [357, 650, 934], [649721, 649978]),
+            ('100', 1): (2269, 737985078, [355, 648, 931], [649718, 649983]),
+            ('101', 0): (1865, 595667309, [384, 699, 1020], [649359, 649750]),
+            ('101', 1): (90, 5658609, [8094, 9015, 9617], [310772, 345124]),
+            ('102', 0): (2187, 709820782, [103, 397, 684], [649540, 649851]),
+            ('102', 1): (2188, 710471576, [139, 396, 682], [649849, 649960]),
+            ('203', 0): (2959, 947051493, [418, 647, 849], [649435, 649776]),
+            ('203', 1): (3046, 968689923, [422, 651, 854], [649438, 649779]),
+        }
+        for record_name in RECORD_NAMES:
+            record = wfdb.rdrecord(os.path.join(DATA_DIR, record_name),
+                                   physical=False)
+            for ch in range(record.n_sig):
+                qrs_locs = processing.gqrs_detect(
+                    d_sig=record.d_signal[:, ch], fs=record.fs,
+                    adc_gain=record.adc_gain[ch],
+                    adc_zero=record.adc_zero[ch])
+                self.assertEqual((len(qrs_locs), int(qrs_locs.sum()),
+                                  qrs_locs[:3].tolist(),
+                                  qrs_locs[-2:].tolist()),
+                                 expected[(record_name, ch)])
+
+    def test_annotation_arrays(self):
+        """
+        The annotation columns on the full bundled records match the
+        annotation objects of the original implementation: their number,
+        time sum, type, and subtype and num sums.
+        """
+        expected = {
+            ('100', 0): (2272, 738313452, 0, 112622),
+            ('100', 1): (2269, 737985078, 0, 82777),
+            ('101', 0): (1865, 595667309, 0, 123965),
+            ('101', 1): (90, 5658609, 23, 1814),
+            ('102', 0): (2187, 709820782, 0, 55863),
+            ('102', 1): (2188, 710471576, 0, 101524),
+            ('203', 0): (2959, 947051493, 42, 164766),
+            ('203', 1): (3046, 968689923, 84, 92226),
+        }
+        for record_name in RECORD_NAMES:
+            record = wfdb.rdrecord(os.path.join(DATA_DIR, record_name),
+                                   physical=False)
+            for ch in range(record.n_sig):
+                conf = GQRS.Conf(fs=record.fs, adc_gain=record.adc_gain[ch])
+                gqrs = GQRS()
+                ann_time = gqrs.detect(x=record.d_signal[:, ch], conf=conf,
+                                       adc_zero=record.adc_zero[ch])
+                self.assertIsInstance(ann_time, np.ndarray)
+                self.assertEqual(ann_time.dtype, np.int64)
+                np.testing.assert_array_equal(ann_time, gqrs.ann_time)
+                # Only normal beats are annotated
+                self.assertEqual(set(gqrs.ann_type), {conf._NORMAL})
+                self.assertEqual(len(gqrs.ann_type), len(ann_time))
+                self.assertEqual((len(ann_time), int(ann_time.sum()),
+                                  sum(gqrs.ann_subtype), sum(gqrs.ann_num)),
+                                 expected[(record_name, ch)])
+
+    def test_empty_signal(self):
+        conf = GQRS.Conf(fs=360, adc_gain=200)
+        ann_time = GQRS().detect(x=np.empty(0, dtype='int64'), conf=conf,
+                                 adc_zero=1024)
+        self.assertEqual(ann_time.dtype, np.int64)
+        self.assertEqual(len(ann_time), 0)
+        qrs_locs = processing.gqrs_detect(d_sig=np.empty(0, dtype='int64'),
+                                          fs=360, adc_gain=200, adc_zero=1024)
+        self.assertEqual(qrs_locs.dtype, np.int64)
+        self.assertEqual(len(qrs_locs), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
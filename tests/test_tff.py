@@ -0,0 +1,248 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+import libs.wfdb as wfdb
+from libs.wfdb.io import _signal
+from libs.wfdb.io import tff
+
+
+def tff_header(n_sig, fs, bit_width, is_signed):
+    """
+    Get the header bytes of a tff file.
+    """
+    tags = [(1003, struct.pack('>H', fs)),
+            (1007, bytes([79 + i for i in range(n_sig)])),
+            (3, bytes([bit_width + 128 * is_signed])),
+            (101, struct.pack('>I', 1500000000)),
+            (2, b'')]
+    header = b''
+    for tag, data in tags:
+        header += struct.pack('>HH', tag, len(data)) + data
+        header += b'\0' * ((4 - len(data) % 4) % 4)
+    return header
+
+
+def tff_file(file_name, signal, escapes, fs=1000, is_signed=True,
+             extra_bytes=b''):
+    """
+    Write a tff file with the sample frames of `signal`, and the escape
+    sequences of `escapes`: (frame, type, data) tuples preceding the
+    sample frame of each.
+    """
+    dtype = signal.dtype.newbyteorder('>')
+    escapes = sorted(escapes, key=lambda e: e[0])
+    content = [tff_header(signal.shape[1], fs, 8 * dtype.itemsize,
+                          is_signed)]
+    i = 0
+    for frame in range(len(signal) + 1):
+        while i < len(escapes) and escapes[i][0] == frame:
+            _, escape_type, data = escapes[i]
+            content.append(b'\x80\x00' + bytes([escape_type, len(data)])
+                           + data + b'\0' * (len(data) % 2))
+            i += 1
+        if frame < len(signal):
+            content.append(signal[frame].astype(dtype).tobytes())
+    content.append(extra_bytes)
+    with open(file_name, 'wb') as f:
+        f.write(b''.join(content))
+
+
+def loop_rdtff(file_name, cut_end=False):
+    """
+    Read the signal, markers and triggers of a tff file with the
+    original reader, parsing one sample frame or escape sequence at a
+    time.
+    """
+    file_size = os.path.getsize(file_name)
+    with open(file_name, 'rb') as fp:
+        fields, file_fields = tff._rdheader(fp)
+        n_sig = file_fields['n_sig']
+        byte_width = file_fields['bit_width'] // 8
+        dtype = tff._sample_dtype(file_fields['bit_width'],
+                                  file_fields['is_signed'])
+        stop_byte = file_size - n_sig * byte_width + 1 if cut_end else file_size
+        frames, markers, triggers = [], [], []
+        while fp.tell() < stop_byte:
+            chunk = fp.read(2)
+            if struct.unpack('>h', chunk)[0] == -32768:
+                escape_type, data_len = struct.unpack('BB', fp.read(2))
+                if escape_type == 1:
+                    markers.append(len(frames))
+                elif escape_type == 2:
+                    triggers.append(len(frames))
+                fp.seek(data_len + data_len % 2, 1)
+            else:
+                fp.seek(-2, 1)
+                frames.append(np.frombuffer(fp.read(n_sig * byte_width),
+                                            dtype=dtype))
+    signal = np.array(frames, dtype=dtype).reshape((-1, n_sig))
+    return (signal, np.array(markers, dtype='int'),
+            np.array(triggers, dtype='int'))
+
+
+def synthetic_signal(n_frames, n_sig, dtype, seed=0):
+    """
+    Get a signal with tag valued samples in every channel but the first,
+    which would start an escape sequence, and escape sequences of every
+    type and data length.
+    """
+    rng = np.random.RandomState(seed)
+    info = np.iinfo(dtype)
+    signal = rng.randint(info.min, int(info.max) + 1,
+                         (n_frames, n_sig)).astype(dtype)
+    # The sample value of the tag bytes
+    tag = np.array([128, 0], dtype='u1').view('>' + dtype)[0]
+    if signal.dtype.itemsize == 1:
+        # Any frame starting with the first tag byte could be a tag
+        signal[signal == tag] = 0
+    else:
+        signal[:, 0][signal[:, 0] == tag] = 0
+        signal[rng.rand(n_frames) < 0.1, 1:] = tag
+
+    escape_frames = rng.choice(n_frames, n_frames // 20, replace=False)
+    escapes = [(int(frame), int(rng.randint(1, 5)),
+                bytes(rng.randint(0, 256, rng.randint(0, 8)).tolist()))
+               for frame in escape_frames]
+    # Consecutive escape sequences, and ones at the start and end
+    escapes += [(0, 1, b''), (0, 2, b'ab'), (n_frames, 1, b'a'),
+                (int(escape_frames[0]), 2, b'')]
+    return signal, escapes
+
+
+class TestTffReader(unittest.TestCase):
+    """
+    Test the vectorized tff reader against the original loop reader.
+    """
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def check_reader(self, file_name, cut_end=False):
+        signal, fields, markers, triggers = wfdb.io.rdtff(file_name,
+                                                          cut_end=cut_end)
+        loop_signal, loop_markers, loop_triggers = loop_rdtff(file_name,
+                                                              cut_end)
+        self.assertEqual(signal.dtype, loop_signal.dtype)
+        np.testing.assert_array_equal(signal, loop_signal)
+        np.testing.assert_array_equal(markers, loop_markers)
+        np.testing.assert_array_equal(triggers, loop_triggers)
+        return signal, fields, markers, triggers
+
+    def test_synthetic_files(self):
+        file_name = os.path.join(self.temp_dir, 'test.tff')
+        for dtype, is_signed in [('i2', True), ('u2', False), ('i1', True)]:
+            for n_sig in [1, 3, 8]:
+                signal, escapes = synthetic_signal(2000, n_sig, dtype)
+                tff_file(file_name, signal, escapes, is_signed=is_signed)
+                read_signal, fields = self.check_reader(file_name)[:2]
+                np.testing.assert_array_equal(read_signal, signal)
+                self.assertEqual(fields['fs'], 1000)
+                self.assertEqual(fields['n_sig'], n_sig)
+                self.assertEqual(fields['sig_name'][0], 'ecg_0')
+
+    def test_cut_end(self):
+        file_name = os.path.join(self.temp_dir, 'test.tff')
+        signal, escapes = synthetic_signal(500, 4, 'i2')
+        tff_file(file_name, signal, escapes, extra_bytes=b'\1\2\3')
+        read_signal = self.check_reader(file_name, cut_end=True)[0]
+        np.testing.assert_array_equal(read_signal, signal)
+        with self.assertRaises(ValueError):
+            wfdb.io.rdtff(file_name)
+
+
+class TestTff2Wfdb(unittest.TestCase):
+    """
+    Test converting tff files into WFDB records.
+    """
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def check_conversion(self, file_name, fmts, cut_end=False):
+        signal, fields, markers, triggers = wfdb.io.rdtff(file_name,
+                                                          cut_end=cut_end)
+        offset = 0 if signal.dtype.kind == 'i' else 2 ** (
+            8 * signal.dtype.itemsize - 1)
+        record_name = os.path.join(self.temp_dir, 'converted')
+
+        d_signal = signal.astype('int64') - offset
+
+        for fmt in fmts:
+            # The dat file written at once from the whole signal
+            dat_content = _signal._dat_bytes(d_signal, fmt).tobytes()
+            for chunk_size in [7, 64, 1000, 16777216]:
+                sig_len = wfdb.io.tff2wfdb(file_name, 'converted', fmt=fmt,
+                                           write_dir=self.temp_dir,
+                                           cut_end=cut_end,
+                                           chunk_size=chunk_size)
+                self.assertEqual(sig_len, len(signal))
+                with open(record_name + '.dat', 'rb') as f:
+                    self.assertEqual(f.read(), dat_content)
+
+                header = wfdb.rdheader(record_name)
+                self.assertEqual(header.sig_len, len(signal))
+                self.assertEqual(header.fs, fields['fs'])
+                self.assertEqual(header.sig_name, fields['sig_name'])
+                self.assertEqual(header.base_date, fields['base_date'])
+                self.assertEqual(header.baseline, [-offset] * len(d_signal[0]))
+                self.assertEqual(header.init_value, list(d_signal[0]))
+                self.assertEqual(header.checksum,
+                                 list(np.sum(d_signal, axis=0) % 65536))
+
+                # rdrecord can't read format 24
+                if fmt != '24':
+                    rec = wfdb.rdrecord(record_name, physical=False)
+                    np.testing.assert_array_equal(rec.d_signal, d_signal)
+                    # Samples with the invalid value are read as nan
+                    p_signal = wfdb.rdrecord(record_name).p_signal
+                    valid = ~np.isnan(p_signal)
+                    np.testing.assert_array_equal(p_signal[valid],
+                                                  signal[valid])
+
+                ann = wfdb.rdann(record_name, 'tff')
+                self.assertEqual(
+                    sorted(zip(ann.sample.tolist(), ann.symbol)),
+                    sorted([(m, 'M') for m in markers.tolist()]
+                           + [(t, 'G') for t in triggers.tolist()]))
+
+    def test_synthetic_files(self):
+        file_name = os.path.join(self.temp_dir, 'test.tff')
+        for dtype, is_signed, fmts in [('i2', True, ['16', '24', '32']),
+                                       ('u2', False, ['16']),
+                                       ('i1', True, ['80', '212', '16'])]:
+            for n_sig in [1, 3]:
+                signal, escapes = synthetic_signal(700, n_sig, dtype)
+                # Markers and triggers only
+                escapes = [(frame, escape_type % 2 + 1, data)
+                           for frame, escape_type, data in escapes]
+                tff_file(file_name, signal, escapes, is_signed=is_signed)
+                self.check_conversion(file_name, fmts)
+
+    def test_cut_end(self):
+        file_name = os.path.join(self.temp_dir, 'test.tff')
+        signal, escapes = synthetic_signal(300, 2, 'i2')
+        tff_file(file_name, signal, escapes, extra_bytes=b'\1')
+        self.check_conversion(file_name, ['16'], cut_end=True)
+        with self.assertRaises(ValueError):
+            wfdb.io.tff2wfdb(file_name, 'converted', write_dir=self.temp_dir)
+
+    def test_unsupported_fmt(self):
+        file_name = os.path.join(self.temp_dir, 'test.tff')
+        signal, escapes = synthetic_signal(100, 2, 'i2')
+        tff_file(file_name, signal, escapes)
+        with self.assertRaises(ValueError):
+            wfdb.io.tff2wfdb(file_name, 'converted', fmt='212',
+                             write_dir=self.temp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()